@@ -0,0 +1,71 @@
+# Startup cost of PomodoroUsers.load_database with the pickle database and with the memory-mapped binary snapshot.
+# Run from the pomodoro folder:
+#     python -m benchmarks.database_load_benchmark [--sizes 10000 1000000]
+import argparse
+import os
+import pickle
+import random
+import tempfile
+import time
+
+from pomodorotteux import PomodoroCallbacks, PomodoroUsers
+from pomodorotteux.binary_snapshot import BinarySnapshot
+from pomodorotteux.configuration import TwitchConfigurationInternal
+from pomodorotteux.pomodoro_user import PomodoroUser
+
+
+def create_databases(database_path: str, number_of_users: int):
+    users = {}
+    for i in range(number_of_users):
+        name = f"viewer_{i:07d}"
+        users[name] = PomodoroUser(_pseudo=name, _initial_number_of_tomatoes=random.randint(0, 500))
+        users[name].disconnect()
+
+    with open(database_path, "wb") as file:
+        pickle.dump(users, file)
+    BinarySnapshot.write(
+        BinarySnapshot.path_from_database_path(database_path),
+        {name: user.total_number_of_tomatoes for name, user in users.items()},
+    )
+    return list(users)
+
+
+def time_load(database_path: str, database_mode: str, names: list) -> tuple:
+    config = TwitchConfigurationInternal("bench", "bench", database_path, "bench", database_mode=database_mode)
+    callbacks = PomodoroCallbacks(lambda name, users: None, lambda name, users: None, lambda users: None)
+
+    start = time.perf_counter()
+    users = PomodoroUsers.load_database(config, callbacks)
+    load_time = time.perf_counter() - start
+
+    # A typical first minute: a few viewers talk and the leaderboard is drawn
+    start = time.perf_counter()
+    for name in random.sample(names, min(100, len(names))):
+        users.declare_user_interaction(name, config, callbacks)
+    users.wait_for_pending_changes()
+    users.leaderboard(10)
+    first_interactions_time = time.perf_counter() - start
+    users.close()
+    return load_time, first_interactions_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Database load benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 1_000_000])
+    args = parser.parse_args()
+
+    for number_of_users in args.sizes:
+        with tempfile.TemporaryDirectory() as folder:
+            database_path = os.path.join(folder, "database.pomo")
+            names = create_databases(database_path, number_of_users)
+            print(f"{number_of_users} users")
+            for database_mode in ("pickle", "binary"):
+                load_time, first_interactions_time = time_load(database_path, database_mode, names)
+                print(
+                    f"{database_mode:>8}: load_database {load_time * 1000:9.1f} ms, "
+                    f"100 first interactions + leaderboard {first_interactions_time * 1000:7.1f} ms"
+                )
+
+
+if __name__ == "__main__":
+    main()
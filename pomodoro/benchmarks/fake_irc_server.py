@@ -0,0 +1,270 @@
+import argparse
+import asyncio
+import itertools
+import threading
+import time
+from typing import Callable, Iterable, Union
+
+
+class _FakeClient:
+    __slots__ = ("writer", "nickname", "oauth_key", "channels")
+
+    writer: asyncio.StreamWriter
+    nickname: Union[str, None]
+    oauth_key: Union[str, None]
+    channels: set
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.nickname = None
+        self.oauth_key = None
+        self.channels = set()
+
+
+# Local stand-in of irc.chat.twitch.tv speaking the part of the protocol Pomodorotteux uses (PASS, NICK, CAP, JOIN,
+# PART, PING/PONG and PRIVMSG). Chat is either replayed from recorded lines or generated from synthetic chatters, and
+# what the bots send is kept in received_messages. Like IrcConnection, the server runs an asyncio event loop in its own
+# thread and the public methods are synchronous.
+class FakeTwitchIrcServer:
+    _address: str
+    _port: int
+    _accepted_oauth_keys: Union[set, None]
+
+    received_messages: list
+
+    def __init__(self, address: str = "127.0.0.1", port: int = 0, accepted_oauth_keys: Iterable[str] = None):
+        # port 0 picks a free port, accepted_oauth_keys None accepts any key
+        self._address = address
+        self._port = port
+        self._accepted_oauth_keys = None if accepted_oauth_keys is None else set(accepted_oauth_keys)
+        self._clients = []
+        self._server = None
+        self._channel_joined = threading.Condition()
+        self.received_messages = []
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+
+    @property
+    def address(self) -> str:
+        return self._address
+
+    @property
+    def port(self) -> int:
+        return self._port
+
+    @property
+    def joined_channels(self) -> set:
+        with self._channel_joined:
+            return {channel for client in list(self._clients) for channel in client.channels}
+
+    def start(self, timeout: float = 10):
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result(timeout)
+
+    def stop(self, timeout: float = 5):
+        if not self._thread.is_alive():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._stop(), self._loop).result(timeout)
+        finally:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+
+    def wait_for_join(self, channel: str, timeout: float = 10) -> bool:
+        with self._channel_joined:
+            return self._channel_joined.wait_for(lambda: channel.lower() in self.joined_channels, timeout)
+
+    def send_line(self, line: str, channel: str = None):
+        # To every client, or only to those which joined channel
+        self._run(self._send_lines([line], channel))
+
+    def drop_connections(self):
+        # As a network failure, the bots are expected to connect again
+        self._run(self._drop_connections())
+
+    def send_reconnect(self):
+        # As before a restart of the Twitch servers
+        self.send_line(":tmi.twitch.tv RECONNECT")
+
+    def send_ping(self):
+        self.send_line("PING :tmi.twitch.tv")
+
+    def send_chat_message(self, channel: str, nickname: str, message: str, user_id: str = None):
+        self.send_line(self.chat_line(channel, nickname, message, user_id), channel)
+
+    def send_join(self, channel: str, nickname: str):
+        # Another user entering the channel, as seen with the twitch.tv/membership capability
+        self.send_line(f":{nickname}!{nickname}@{nickname}.tmi.twitch.tv JOIN #{channel.lower()}", channel)
+
+    def send_part(self, channel: str, nickname: str):
+        self.send_line(f":{nickname}!{nickname}@{nickname}.tmi.twitch.tv PART #{channel.lower()}", channel)
+
+    def replay(self, lines: Iterable[str], lines_per_second: float = None):
+        # Server lines, recorded or synthetic like benchmarks/chat_corpus.txt, sent as fast as possible if
+        # lines_per_second is None
+        lines = (line.rstrip("\r\n") for line in lines)
+        self._run(self._send_paced(lambda index, line: line, lines, None, lines_per_second))
+
+    def generate_chat(
+        self,
+        channel: str,
+        number_of_chatters: int,
+        number_of_messages: int,
+        messages_per_second: float = None,
+        message_formatter: Callable = None,
+    ):
+        # number_of_messages PRIVMSG from chatter_000000, chatter_000001... in turn, so every chatter talks if there are
+        # enough messages. message_formatter(index) gives the text, it is called when the message is sent
+        channel = channel.lower()
+        names = [f"chatter_{i:06d}" for i in range(number_of_chatters)]
+
+        def format_line(index: int, _) -> str:
+            message = f"Message {index} pour les tomates" if message_formatter is None else message_formatter(index)
+            return self.chat_line(channel, names[index % number_of_chatters], message)
+
+        self._run(self._send_paced(format_line, range(number_of_messages), channel, messages_per_second))
+
+    @staticmethod
+    def chat_line(channel: str, nickname: str, message: str, user_id: str = None) -> str:
+        # With a user_id, the line has the tags sent with the twitch.tv/tags capability
+        tags = "" if user_id is None else f"@display-name={nickname};user-id={user_id} "
+        login = nickname.lower()
+        return f"{tags}:{login}!{login}@{login}.tmi.twitch.tv PRIVMSG #{channel.lower()} :{message}"
+
+    def _run(self, coroutine):
+        asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _start(self):
+        self._server = await asyncio.start_server(self._handle_client, self._address, self._port)
+        self._port = self._server.sockets[0].getsockname()[1]
+
+    async def _stop(self):
+        self._server.close()
+        for client in list(self._clients):
+            client.writer.close()
+        await self._server.wait_closed()
+
+    async def _drop_connections(self):
+        for client in list(self._clients):
+            client.writer.close()
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        client = _FakeClient(writer)
+        self._clients.append(client)
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                self._handle_command(client, line.decode("utf-8", errors="replace").rstrip("\r\n"))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._clients.remove(client)
+            writer.close()
+
+    def _handle_command(self, client: _FakeClient, line: str):
+        command, _, argument = line.partition(" ")
+        command = command.upper()
+        if command == "PASS":
+            client.oauth_key = argument
+        elif command == "NICK":
+            client.nickname = argument.lower()
+            if self._accepted_oauth_keys is not None and client.oauth_key not in self._accepted_oauth_keys:
+                self._write(client, ":tmi.twitch.tv NOTICE * :Login authentication failed")
+                client.writer.close()
+                return
+            self._write(client, f":tmi.twitch.tv 001 {client.nickname} :Welcome, GLHF!")
+        elif command == "CAP":
+            capabilities = argument.partition(":")[2]
+            self._write(client, f":tmi.twitch.tv CAP * ACK :{capabilities}")
+        elif command == "JOIN":
+            nickname = client.nickname
+            for channel in argument.lstrip("#").lower().split(",#"):
+                self._write(client, f":{nickname}!{nickname}@{nickname}.tmi.twitch.tv JOIN #{channel}")
+                self._write(client, f":{nickname}.tmi.twitch.tv 353 {nickname} = #{channel} :{nickname}")
+                self._write(client, f":{nickname}.tmi.twitch.tv 366 {nickname} #{channel} :End of /NAMES list")
+                with self._channel_joined:
+                    client.channels.add(channel)
+                    self._channel_joined.notify_all()
+        elif command == "PART":
+            nickname = client.nickname
+            channel = argument.lstrip("#").lower()
+            with self._channel_joined:
+                client.channels.discard(channel)
+            self._write(client, f":{nickname}!{nickname}@{nickname}.tmi.twitch.tv PART #{channel}")
+        elif command == "PING":
+            self._write(client, f"PONG :{argument.lstrip(':')}")
+        elif command == "PRIVMSG":
+            target, _, message = argument.partition(" :")
+            self.received_messages.append((target.lstrip("#"), message))
+
+    def _write(self, client: _FakeClient, line: str):
+        if not client.writer.is_closing():
+            client.writer.write((line + "\r\n").encode())
+
+    async def _send_lines(self, lines: list, channel: Union[str, None]):
+        data = "".join(line + "\r\n" for line in lines).encode()
+        for client in list(self._clients):
+            if channel is None or channel.lower() in client.channels:
+                if not client.writer.is_closing():
+                    client.writer.write(data)
+                    await client.writer.drain()
+
+    async def _send_paced(
+        self, format_line: Callable, items: Iterable, channel: Union[str, None], lines_per_second: Union[float, None]
+    ):
+        # Lines are sent by batches, either as fast as the clients read them or one batch every tick at the given rate
+        tick = 0.01
+        batch_size = 1000 if lines_per_second is None else max(1, round(lines_per_second * tick))
+        start = time.perf_counter()
+        number_sent = 0
+        items = iter(items)
+        while True:
+            batch = list(itertools.islice(items, batch_size))
+            if not batch:
+                return
+            if lines_per_second is not None:
+                await asyncio.sleep(max(0.0, start + number_sent / lines_per_second - time.perf_counter()))
+            await self._send_lines([format_line(number_sent + i, item) for i, item in enumerate(batch)], channel)
+            number_sent += len(batch)
+
+
+def main():
+    # python -m benchmarks.fake_irc_server --channel pariterre --chatters 100 --rate 5
+    # then set "irc_server_address": "127.0.0.1" and "irc_port" in the configuration file
+    parser = argparse.ArgumentParser(description="Local stand-in of the Twitch IRC server")
+    parser.add_argument("--port", type=int, default=6667)
+    parser.add_argument("--channel", required=True)
+    parser.add_argument("--chatters", type=int, default=10, help="Number of synthetic chatters")
+    parser.add_argument("--rate", type=float, default=1, help="Chat messages per second")
+    parser.add_argument("--messages", type=int, default=1000, help="Number of chat messages to generate")
+    parser.add_argument("--replay", help="File of recorded IRC lines to replay instead of generating the chat")
+    args = parser.parse_args()
+
+    server = FakeTwitchIrcServer(port=args.port)
+    server.start()
+    print(f"Listening on {server.address}:{server.port}, waiting for a bot to join #{args.channel}")
+    try:
+        while not server.wait_for_join(args.channel, timeout=1):
+            pass
+        if args.replay:
+            with open(args.replay, "r", encoding="utf-8") as file:
+                server.replay(file, args.rate)
+        else:
+            server.generate_chat(args.channel, args.chatters, args.messages, args.rate)
+        print("Chat done, press Ctrl+C to stop")
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"The bots sent {len(server.received_messages)} messages")
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
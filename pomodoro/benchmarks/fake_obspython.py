@@ -0,0 +1,212 @@
+import sys
+from typing import Callable, Union
+
+
+class FakeSource:
+    __slots__ = ("name", "source_id", "text", "number_of_references", "updates")
+
+    name: str
+    source_id: str
+    text: Union[str, None]
+    number_of_references: int
+    # (virtual time, text) of every obs_source_update
+    updates: list
+
+    def __init__(self, name: str, source_id: str):
+        self.name = name
+        self.source_id = source_id
+        self.text = None
+        self.number_of_references = 0
+        self.updates = []
+
+
+class FakeSceneItem:
+    __slots__ = ("source", "is_visible", "number_of_changes")
+
+    source: FakeSource
+    is_visible: bool
+    number_of_changes: int
+
+    def __init__(self, source: FakeSource):
+        self.source = source
+        self.is_visible = True
+        self.number_of_changes = 0
+
+
+class FakeScene:
+    __slots__ = ("name", "items", "number_of_references")
+
+    name: str
+    items: dict
+    number_of_references: int
+
+    def __init__(self, name: str, items: dict):
+        self.name = name
+        self.items = items
+        self.number_of_references = 0
+
+
+# Stand-in of the obspython module given by OBS to its scripts, for what pomodoro-obs.py uses, so the script runs
+# headless. The time is virtual: the timers (timer_add) only run when advance() moves the clock, one after the other at
+# their due time and as fast as they return, so hours of timer run in a fraction of a second. The references taken on
+# the sources, scenes and data are counted, so what a script forgets to release shows. Once install()ed,
+# "import obspython" gives this object.
+class FakeObs:
+    LOG_ERROR = 100
+    LOG_WARNING = 200
+    LOG_INFO = 300
+    OBS_COMBO_TYPE_LIST = 2
+    OBS_COMBO_FORMAT_STRING = 3
+
+    time: float
+    sources: dict
+    scenes: dict
+    logs: list
+    number_of_live_data: int
+
+    def __init__(self, start_time: float = 0):
+        self.time = start_time
+        self.sources = {}
+        self.scenes = {}
+        # (virtual time, level, message) of script_log
+        self.logs = []
+        self.number_of_live_data = 0
+        # callback: [interval in seconds, next due time]
+        self._timers = {}
+
+    def install(self):
+        sys.modules["obspython"] = self
+        return self
+
+    def clock(self) -> float:
+        # To replace time.monotonic in the script
+        return self.time
+
+    def advance(self, seconds: float, until: Callable = None) -> float:
+        # Runs the timers due in the next seconds, stops early once until() is True (checked after each timer call).
+        # Returns the virtual time reached
+        end = self.time + seconds
+        while self._timers:
+            callback, timer = min(self._timers.items(), key=lambda item: item[1][1])
+            if timer[1] > end:
+                break
+            self.time = timer[1]
+            timer[1] += timer[0]
+            callback()
+            if until is not None and until():
+                return self.time
+        self.time = end
+        return self.time
+
+    def add_source(self, name: str, source_id: str = "text_ft2_source") -> FakeSource:
+        source = FakeSource(name, source_id)
+        self.sources[name] = source
+        return source
+
+    def add_scene(self, name: str, source_names: list) -> FakeScene:
+        scene = FakeScene(name, {source_name: FakeSceneItem(self.sources[source_name]) for source_name in source_names})
+        self.scenes[name] = scene
+        return scene
+
+    @property
+    def number_of_live_references(self) -> int:
+        # Sources and scenes obtained by name and not released
+        return sum(source.number_of_references for source in self.sources.values()) + sum(
+            scene.number_of_references for scene in self.scenes.values()
+        )
+
+    # obspython
+
+    def script_log(self, level: int, message: str):
+        self.logs.append((self.time, level, message))
+
+    def timer_add(self, callback: Callable, milliseconds: int):
+        self._timers[callback] = [milliseconds / 1000, self.time + milliseconds / 1000]
+
+    def timer_remove(self, callback: Callable):
+        self._timers.pop(callback, None)
+
+    def obs_data_create(self) -> dict:
+        self.number_of_live_data += 1
+        return {}
+
+    def obs_data_release(self, data: dict):
+        self.number_of_live_data -= 1
+
+    def obs_data_set_string(self, data: dict, name: str, value: str):
+        data[name] = value
+
+    def obs_data_get_string(self, data: dict, name: str) -> str:
+        return data.get(name, "")
+
+    def obs_data_get_int(self, data: dict, name: str) -> int:
+        return data.get(name, 0)
+
+    def obs_data_set_int(self, data: dict, name: str, value: int):
+        data[name] = value
+
+    def obs_data_set_default_int(self, data: dict, name: str, value: int):
+        data.setdefault(name, value)
+
+    def obs_get_source_by_name(self, name: str) -> Union[FakeSource, None]:
+        source = self.sources.get(name)
+        if source is not None:
+            source.number_of_references += 1
+        return source
+
+    def obs_source_release(self, source: Union[FakeSource, None]):
+        if source is not None:
+            source.number_of_references -= 1
+
+    def obs_source_update(self, source: FakeSource, settings: dict):
+        source.text = settings.get("text")
+        source.updates.append((self.time, source.text))
+
+    def obs_source_get_name(self, source: FakeSource) -> str:
+        return source.name
+
+    def obs_source_get_unversioned_id(self, source: FakeSource) -> str:
+        return source.source_id
+
+    def obs_enum_sources(self) -> list:
+        return list(self.sources.values())
+
+    def source_list_release(self, sources: list):
+        pass
+
+    def obs_get_scene_by_name(self, name: str) -> Union[FakeScene, None]:
+        scene = self.scenes.get(name)
+        if scene is not None:
+            scene.number_of_references += 1
+        return scene
+
+    def obs_scene_release(self, scene: Union[FakeScene, None]):
+        if scene is not None:
+            scene.number_of_references -= 1
+
+    def obs_scene_find_source_recursive(self, scene: Union[FakeScene, None], name: str):
+        return None if scene is None else scene.items.get(name)
+
+    def obs_sceneitem_set_visible(self, item: Union[FakeSceneItem, None], is_visible: bool):
+        if item is not None and item.is_visible != is_visible:
+            item.is_visible = is_visible
+            item.number_of_changes += 1
+
+    def obs_frontend_get_scene_names(self) -> list:
+        return list(self.scenes)
+
+    def obs_properties_create(self) -> dict:
+        return {}
+
+    def obs_properties_add_int(self, properties: dict, name: str, description: str, minimum, maximum, step):
+        properties[name] = {"description": description, "type": "int"}
+
+    def obs_properties_add_button(self, properties: dict, name: str, text: str, callback: Callable):
+        properties[name] = {"description": text, "type": "button", "callback": callback}
+
+    def obs_properties_add_list(self, properties: dict, name: str, description: str, list_type, list_format):
+        properties[name] = {"description": description, "type": "list", "items": []}
+        return properties[name]
+
+    def obs_property_list_add_string(self, property_list: dict, name: str, value: str):
+        property_list["items"].append((name, value))
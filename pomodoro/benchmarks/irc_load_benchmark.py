@@ -0,0 +1,135 @@
+# Load benchmark of the chat hot path against the local fake Twitch IRC server, as a regression baseline. For each
+# number of chatters, it measures the chat messages handled per second, the latency from the server sending a PRIVMSG
+# to Pomodorotteux handing it to the users, the time of a full save and the peak memory of the process. Run from the
+# pomodoro folder:
+#     python -m benchmarks.irc_load_benchmark [--chatters 10 1000 100000] [--database-mode pickle]
+import argparse
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from pomodorotteux import PomodoroCallbacks, Pomodorotteux
+from pomodorotteux.configuration import TwitchConfigurationInternal
+from pomodorotteux.irc_message import IrcMessage
+
+from benchmarks.fake_irc_server import FakeTwitchIrcServer
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, the memory is then not reported
+    resource = None
+
+
+CHANNEL = "benchmark"
+
+
+class InstrumentedPomodorotteux(Pomodorotteux):
+    # Counts the chat messages handled and, for those carrying their sending time, how long they took to get through
+    def __init__(self, *args, **kwargs):
+        self.number_of_handled_messages = 0
+        self.latencies = []
+        self._lock = threading.Lock()
+        self._target = None
+        self._target_reached = threading.Event()
+        super().__init__(*args, **kwargs)
+
+    def handle_chat_message(self, message: IrcMessage):
+        super().handle_chat_message(message)
+        now = time.perf_counter()
+        with self._lock:
+            if message.trailing.startswith("t="):
+                self.latencies.append(now - float(message.trailing[2:]))
+            self.number_of_handled_messages += 1
+            if self._target is not None and self.number_of_handled_messages >= self._target:
+                self._target_reached.set()
+
+    def expect_messages(self, number_of_messages: int):
+        # To call before they are sent
+        with self._lock:
+            self._target = self.number_of_handled_messages + number_of_messages
+            self._target_reached.clear()
+
+    def wait_for_expected_messages(self, timeout: float = 600):
+        if not self._target_reached.wait(timeout):
+            raise TimeoutError(f"Only {self.number_of_handled_messages} of {self._target} messages were handled")
+
+
+def run(number_of_chatters: int, database_mode: str, latency_rate: float, latency_duration: float):
+    server = FakeTwitchIrcServer()
+    server.start()
+    folder = tempfile.TemporaryDirectory()
+    config = TwitchConfigurationInternal(
+        "benchmark",
+        CHANNEL,
+        os.path.join(folder.name, "database", "database.pomo"),
+        "benchmark",
+        irc_server_address=server.address,
+        irc_port=server.port,
+        database_mode=database_mode,
+    )
+    callbacks = PomodoroCallbacks(lambda name, users: None, lambda name, users: None, lambda users: None)
+    pomodorotteux = InstrumentedPomodorotteux(config, callbacks)
+    server.wait_for_join(CHANNEL)
+
+    try:
+        # Throughput: every chatter shows up (so is registered), then keeps talking
+        number_of_messages = max(20_000, 2 * number_of_chatters)
+        pomodorotteux.expect_messages(number_of_messages)
+        start = time.perf_counter()
+        server.generate_chat(CHANNEL, number_of_chatters, number_of_messages)
+        pomodorotteux.wait_for_expected_messages()
+        pomodorotteux._users.wait_for_pending_changes()
+        messages_per_second = number_of_messages / (time.perf_counter() - start)
+
+        # Latency, at a steady rate so it is not the time spent waiting behind a burst
+        number_of_messages = int(latency_rate * latency_duration)
+        pomodorotteux.latencies.clear()
+        pomodorotteux.expect_messages(number_of_messages)
+        server.generate_chat(
+            CHANNEL, number_of_chatters, number_of_messages, latency_rate, lambda index: f"t={time.perf_counter()!r}"
+        )
+        pomodorotteux.wait_for_expected_messages()
+        percentiles = statistics.quantiles(pomodorotteux.latencies, n=100)
+
+        # Full save of the database, users connected
+        pomodorotteux._users.wait_for_pending_changes()
+        save_times = []
+        for _ in range(5):
+            start = time.perf_counter()
+            pomodorotteux.save_database()
+            save_times.append(time.perf_counter() - start)
+        save_time = statistics.median(save_times)
+    finally:
+        pomodorotteux.end_session()
+        server.stop()
+        folder.cleanup()
+
+    print(f"{number_of_chatters} chatters ({database_mode} database)")
+    print(f"  throughput: {messages_per_second:,.0f} messages/s")
+    print(
+        f"  latency at {latency_rate:,.0f} messages/s: p50 {percentiles[49] * 1000:.2f} ms, "
+        f"p95 {percentiles[94] * 1000:.2f} ms, p99 {percentiles[98] * 1000:.2f} ms"
+    )
+    print(f"  save: {save_time * 1000:.1f} ms ({number_of_chatters / save_time:,.0f} users/s)")
+    if resource is not None:
+        # ru_maxrss is in kilobytes on Linux, the peak of the whole process so far
+        print(f"  peak memory: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat load benchmark against the fake Twitch IRC server")
+    parser.add_argument("--chatters", type=int, nargs="+", default=[10, 1_000, 100_000])
+    parser.add_argument("--database-mode", default="pickle", choices=("pickle", "journal", "sqlite", "binary"))
+    parser.add_argument("--latency-rate", type=float, default=1000, help="Chat messages per second")
+    parser.add_argument("--latency-duration", type=float, default=2, help="Seconds")
+    args = parser.parse_args()
+
+    for number_of_chatters in args.chatters:
+        run(number_of_chatters, args.database_mode, args.latency_rate, args.latency_duration)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+# Micro-benchmark of the IRC line parsing, comparing the two re.split per line which were used by Pomodorotteux with
+# parse_irc_message. Run from the pomodoro folder:
+#     python -m benchmarks.irc_parser_benchmark [path/to/corpus.txt] [--repeat N]
+# The default corpus, chat_corpus.txt, is synthetic and not a recording: generated chatters (tomate_42, pomme99, ...)
+# and messages in the Twitch wire format, with tags shaped like Twitch's and made up timestamps. It exercises the same
+# code paths (tags, escapes, membership, NAMES), but the timings on real traffic should be measured on a recording
+# passed as corpus.
+import argparse
+import os
+import re
+import timeit
+
+from pomodorotteux.irc_message import parse_irc_message
+
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(__file__), "chat_corpus.txt")
+
+
+def parse_with_regex(irc_message: str):
+    # The historical approach of Pomodorotteux._twitch_callback
+    if irc_message == "PING :tmi.twitch.tv":
+        return None
+    elif len(re.split(r"^.*(Login authentication failed).*$", irc_message)) == 3:
+        return None
+    message_split = re.split(r"^:(.*)!.*@.*PRIVMSG.*#.*:(.*)$", irc_message)
+    return None if len(message_split) != 4 else message_split[1]
+
+
+def parse_with_parser(irc_message: str):
+    message = parse_irc_message(irc_message)
+    if message.command == "PRIVMSG":
+        return message.nickname
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IRC line parsing benchmark")
+    parser.add_argument("corpus", nargs="?", default=DEFAULT_CORPUS)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with open(args.corpus, "r", encoding="utf-8") as file:
+        lines = [line.rstrip("\r\n") for line in file if line.strip()]
+
+    print(f"Corpus: {args.corpus} ({len(lines)} lines)")
+    for name, function in (("re.split", parse_with_regex), ("parse_irc_message", parse_with_parser)):
+        number = max(1, 200_000 // len(lines))
+        best = min(timeit.repeat(lambda: [function(line) for line in lines], number=number, repeat=args.repeat))
+        lines_per_second = number * len(lines) / best
+        print(f"{name:>20}: {best / (number * len(lines)) * 1e6:7.3f} us/line ({lines_per_second:,.0f} lines/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+# Headless run of pomodoro-obs.py, as a benchmark and a regression test of the timer. OBS is the FakeObs stand-in whose
+# virtual clock drives the script timer and Twitch is the local fake IRC server, so thousands of session and pause
+# cycles take seconds. It checks that every phase changes within one timer tick of its due time (no drift however many
+# cycles), counts the updates of the text sources and checks that every chatter got one tomato per session, then that
+# nothing taken from OBS is left unreleased once the script is unloaded. Exits with 1 if a check fails. Run from the
+# pomodoro folder:
+#     python -m benchmarks.pomodoro_simulation [--sessions 1000] [--session-minutes 1] [--chatters 50] [--tick-ms 100]
+import argparse
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import time
+
+from pomodorotteux.configuration import TwitchConfigurationInternal
+
+from benchmarks.fake_irc_server import FakeTwitchIrcServer
+from benchmarks.fake_obspython import FakeObs
+
+
+CHANNEL = "simulation"
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "pomodoro-obs.py")
+
+
+def load_script(obs: FakeObs):
+    obs.install()
+    spec = importlib.util.spec_from_file_location("pomodoro_obs", SCRIPT_PATH)
+    script = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(script)
+    return script
+
+
+def create_scene(obs: FakeObs):
+    for name in ("Session", "Temps", "Noms", "Scores"):
+        obs.add_source(name, "text_ft2_source")
+    obs.add_source("Tomate rouge", "image_source")
+    obs.add_source("Tomate verte", "image_source")
+    obs.add_source("Sonnerie", "ffmpeg_source")
+    obs.add_scene("Pomodoro", ["Session", "Temps", "Noms", "Scores", "Tomate rouge", "Tomate verte", "Sonnerie"])
+
+
+def phase_lateness(obs: FakeObs, session_time: float, pause_time: float, number_of_sessions: int) -> list:
+    # How late each phase started (from the texts of the Session source) compared to when it was due, the first
+    # session being the reference
+    updates = [(time_, text) for time_, text in obs.sources["Session"].updates if text != "Bienvenue!"]
+    first_start = updates[0][0]
+    lateness = []
+    for index, (time_, text) in enumerate(updates):
+        cycle, is_pause = divmod(index, 2)
+        due = first_start + cycle * (session_time + pause_time) + (session_time if is_pause else 0)
+        lateness.append(time_ - due)
+    expected_texts = [
+        text
+        for session in range(1, number_of_sessions + 1)
+        for text in (f"Session {session}/{number_of_sessions}", "    Pause!")
+    ]
+    # The last pause is shown as the end
+    expected_texts[-1] = "    Bravo!"
+    if [text for _, text in updates] != expected_texts:
+        raise AssertionError("The Session source did not show the expected sequence of phases")
+    return lateness
+
+
+def run(number_of_sessions: int, session_minutes: int, pause_minutes: int, number_of_chatters: int, tick_ms: int):
+    failures = []
+    obs = FakeObs()
+    create_scene(obs)
+    script = load_script(obs)
+    script.TIMER_INTERVAL_MS = tick_ms
+    script.pomodoro.clock = obs.clock
+
+    server = FakeTwitchIrcServer()
+    server.start()
+    folder = tempfile.TemporaryDirectory()
+    config = TwitchConfigurationInternal(
+        "simulation",
+        CHANNEL,
+        os.path.join(folder.name, "database", "database.pomo"),
+        "simulation",
+        irc_server_address=server.address,
+        irc_port=server.port,
+    )
+    script.CONFIGURATION_FILE = os.path.join(folder.name, "simulation.key")
+    with open(script.CONFIGURATION_FILE, "w") as file:
+        json.dump(config.__dict__, file)
+
+    settings = obs.obs_data_create()
+    script.script_defaults(settings)
+    for name, value in (
+        ("time_pomodoro", session_minutes),
+        ("time_pause", pause_minutes),
+        ("number_session", number_of_sessions),
+        ("score_top_n", 10),
+    ):
+        obs.obs_data_set_int(settings, name, value)
+    for name, value in (
+        ("text_session", "Session"),
+        ("text_time", "Temps"),
+        ("score_names", "Noms"),
+        ("score_scores", "Scores"),
+        ("pomodoro_scene", "Pomodoro"),
+        ("red_tomato", "Tomate rouge"),
+        ("green_tomato", "Tomate verte"),
+        ("ring", "Sonnerie"),
+    ):
+        obs.obs_data_set_string(settings, name, value)
+
+    try:
+        script.script_properties()
+        script.script_update(settings)
+        obs.obs_data_release(settings)
+
+        # The Start button, then the chatters show up while Pomodorotteux is still starting in the background
+        script.start_timer(None, None)
+        pomodorotteux = script.pomodorotteux_registry.pomodorotteux
+        if not pomodorotteux.wait_until_started(30):
+            raise RuntimeError(f"Pomodorotteux did not start: {pomodorotteux.error!r}")
+        server.wait_for_join(CHANNEL)
+        server.generate_chat(CHANNEL, number_of_chatters, number_of_chatters)
+        deadline = time.monotonic() + 30
+        while pomodorotteux.number_of_connected_users < number_of_chatters and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        session_time = session_minutes * 60
+        pause_time = pause_minutes * 60
+        start = time.perf_counter()
+        obs.advance(number_of_sessions * (session_time + pause_time) + 60, until=lambda: script.pomodoro.finished)
+        elapsed = time.perf_counter() - start
+        # The last session ended the Pomodorotteux session (disconnected the users), which is written in the background
+        pomodorotteux.pomodorotteux.flush_database()
+
+        lateness = phase_lateness(obs, session_time, pause_time, number_of_sessions)
+        if min(lateness) < 0 or max(lateness) > tick_ms / 1000 + 1e-6:
+            failures.append(f"phase lateness from {min(lateness):.3f} to {max(lateness):.3f} s, over one tick")
+
+        totals = dict(pomodorotteux.pomodorotteux.leaderboard())
+        history_totals = pomodorotteux.pomodorotteux.history.user_totals()
+        wrong_totals = [
+            name
+            for name in (f"chatter_{i:06d}" for i in range(number_of_chatters))
+            if totals.get(name) != number_of_sessions or history_totals.get(name) != number_of_sessions
+        ]
+        if wrong_totals:
+            failures.append(
+                f"{len(wrong_totals)} chatters without {number_of_sessions} tomatoes, e.g. {wrong_totals[0]}"
+            )
+
+        number_of_ticks = round((obs.time - obs.sources["Session"].updates[0][0]) * 1000 / tick_ms)
+        time_updates = len(obs.sources["Temps"].updates)
+        renderer = script.pomodoro.renderer
+        script.stop_timer(None, None)
+    finally:
+        script.script_unload()
+        server.stop()
+        folder.cleanup()
+
+    if obs.number_of_live_references != 0 or obs.number_of_live_data != 0:
+        failures.append(
+            f"{obs.number_of_live_references} sources or scenes and {obs.number_of_live_data} data not released"
+        )
+
+    simulated_hours = number_of_sessions * (session_time + pause_time) / 3600
+    print(f"{number_of_sessions} sessions of {session_minutes}+{pause_minutes} min, {number_of_chatters} chatters")
+    print(
+        f"  simulated {simulated_hours:,.0f} h in {elapsed:.2f} s ({number_of_ticks / elapsed:,.0f} ticks/s "
+        f"of {tick_ms} ms)"
+    )
+    print(
+        f"  phase lateness: max {max(lateness) * 1000:.1f} ms, mean {sum(lateness) / len(lateness) * 1000:.1f} ms "
+        f"over {len(lateness)} phases"
+    )
+    print(
+        f"  text sources: {renderer.number_of_updates:,} updates, {renderer.number_of_avoided_updates:,} identical "
+        f"avoided, {time_updates:,} of the time for {number_of_ticks:,} ticks"
+    )
+    print(f"  tomatoes: {sum(totals.values()):,} awarded, chat messages sent: {len(server.received_messages)}")
+    for failure in failures:
+        print(f"  FAILED: {failure}")
+    return not failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless fast-forward simulation of the OBS Pomodoro script")
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--session-minutes", type=int, default=1)
+    parser.add_argument("--pause-minutes", type=int, default=1)
+    parser.add_argument("--chatters", type=int, default=50)
+    parser.add_argument("--tick-ms", type=int, default=100, help="Interval of the script timer")
+    args = parser.parse_args()
+
+    if not run(args.sessions, args.session_minutes, args.pause_minutes, args.chatters, args.tick_ms):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,15 +5,17 @@ from pomodorotteux import Pomodorotteux, TwitchConfiguration, PomodoroCallbacks
 
 def main():
     def has_connected_callback(name: str, users: dict):
+        pseudo = users[name].pseudo
         if users[name].initial_number_of_tomatoes == 0:
             pomo.post_message(
-                f"Message de la tomate : {name} s'est connecté(e) pour la première fois! Bienvenue parmi nous!"
+                f"Message de la tomate : {pseudo} s'est connecté(e) pour la première fois! Bienvenue parmi nous!"
             )
         else:
-            pomo.post_message(f"Message de la tomate : {name} s'est connecté(e) aux tomates!")
+            pomo.post_message(f"Message de la tomate : {pseudo} s'est connecté(e) aux tomates!")
 
     def disconnect_user_callback(name: str, users: dict):
-        pomo.post_message(f"Message de la tomate : {name} a été bien silencieux(se)! Tu es toujours là?")
+        pseudo = users[name].pseudo
+        pomo.post_message(f"Message de la tomate : {pseudo} a été bien silencieux(se)! Tu es toujours là?")
 
     def score_callback(users: dict):
         for name in users:
@@ -39,9 +41,9 @@ def main():
             pomo.add_tomato_to_connected_users()
             break
     finally:
-        # Ensure for proper disconnection from the IRC server
-        pomo.end_session()
+        # Ensure for proper disconnection from the IRC server, the database is closed after that
         pomo.save_database()
+        pomo.end_session()
 
 
 if __name__ == "__main__":
@@ -1,7 +1,84 @@
 import math
+import threading
+import time
 import obspython as obs
 
-from pomodorotteux import Pomodorotteux, TwitchConfiguration
+from pomodorotteux import BackgroundPomodorotteux, TwitchConfiguration, PomodoroCallbacks
+from pomodorotteux.chat_queue import join_names
+
+# The time is derived from a monotonic clock, the timer only needs to tick often enough for the displayed second to
+# flip close to its real boundary (the renderer drops the ticks which do not change the text)
+TIMER_INTERVAL_MS = 100
+CONFIGURATION_FILE = "my_config_file.key"
+
+
+class SourceRenderer:
+    # Texts are staged during a tick and pushed to OBS in one pass. A source is only updated (and re-rasterized by OBS)
+    # when its text differs from what it already shows, each source having its own settings object.
+    def __init__(self):
+        self.pending_texts = {}
+        self.rendered_texts = {}
+        self.source_settings = {}
+        self.number_of_updates = 0
+        self.number_of_avoided_updates = 0
+        self._lock = threading.Lock()
+
+    def set_text(self, source, text):
+        if source is None:
+            return
+        with self._lock:
+            self.pending_texts[source] = text
+
+    def flush(self):
+        with self._lock:
+            pending_texts = self.pending_texts
+            self.pending_texts = {}
+
+            for source, text in pending_texts.items():
+                if self.rendered_texts.get(source) == text:
+                    self.number_of_avoided_updates += 1
+                    continue
+
+                if source not in self.source_settings:
+                    self.source_settings[source] = obs.obs_data_create()
+                obs.obs_data_set_string(self.source_settings[source], "text", text)
+                obs.obs_source_update(source, self.source_settings[source])
+                self.rendered_texts[source] = text
+                self.number_of_updates += 1
+
+    def release(self):
+        with self._lock:
+            for settings in self.source_settings.values():
+                obs.obs_data_release(settings)
+            self.source_settings = {}
+            self.rendered_texts = {}
+            self.pending_texts = {}
+
+
+class PomodorotteuxRegistry:
+    # Keeps the Pomodorotteux for the life of the OBS process. start_timer gets the same one back as long as the
+    # configuration is unchanged and script_update leaves it alone, so neither a new session nor a setting changed in
+    # OBS reconnects to Twitch or reloads the database. script_unload releases it. It starts in the background, so the
+    # OBS interface never waits for Twitch nor the database, and a start which failed is tried again.
+    def __init__(self):
+        self.pomodorotteux = None
+        self.key = None
+
+    def acquire(self, config, callbacks, ping_time):
+        key = (config, ping_time)
+        if self.pomodorotteux is not None and self.pomodorotteux.error is None and key == self.key:
+            return self.pomodorotteux
+
+        self.release()
+        self.pomodorotteux = BackgroundPomodorotteux(config, callbacks=callbacks, ping_time=ping_time)
+        self.key = key
+        return self.pomodorotteux
+
+    def release(self):
+        if self.pomodorotteux is not None:
+            self.pomodorotteux.end_session()
+        self.pomodorotteux = None
+        self.key = None
 
 
 class Pomodoro:
@@ -12,39 +89,90 @@ class Pomodoro:
             number_session=0,
             text_session="",
             text_time="",
-            settings=None,
             red_tomato=None,
             green_tomato=None,
             ring=None,
             score_names=None,
             score_scores=None,
+            score_top_n=10,
     ):
-        self.time_session = time_session * 60
-        self.time_pause = time_pause * 60
-        self.number_session = number_session
-
-        self.text_session = text_session
-        self.text_time = text_time
-        self.settings = settings
+        self.renderer = SourceRenderer()
 
         self.is_in_initial_condition = True
         self.is_in_session = False
         self.current_session = 0
-        self.elapsed_time = 0
         self.finished = False
         self.can_pause = False
         self.is_running = False
 
-        self.red_tomato = red_tomato
-        self.green_tomato = green_tomato
-        self.ring = ring
-        obs.obs_sceneitem_set_visible(self.red_tomato, False)
-        obs.obs_sceneitem_set_visible(self.ring, False)
-        obs.obs_sceneitem_set_visible(self.green_tomato, True)
+        # Replaced by the virtual clock of the headless simulation (benchmarks/pomodoro_simulation.py)
+        self.clock = time.monotonic
+        self.phase_start_time = None
+        self.paused_time = 0
+        self.pause_start_time = None
 
         self.pomodorotteux = None
+        self.rendered_leaderboard = None
+        self.apply_settings(
+            time_session,
+            time_pause,
+            number_session,
+            text_session,
+            text_time,
+            red_tomato,
+            green_tomato,
+            ring,
+            score_names,
+            score_scores,
+            score_top_n,
+        )
+
+    def apply_settings(
+            self,
+            time_session,
+            time_pause,
+            number_session,
+            text_session,
+            text_time,
+            red_tomato,
+            green_tomato,
+            ring,
+            score_names,
+            score_scores,
+            score_top_n,
+    ):
+        # A running timer keeps its phase and elapsed time, the new durations apply to the phase in progress
+        self.time_session = time_session * 60
+        self.time_pause = time_pause * 60
+        self.number_session = number_session
+
+        self.text_session = text_session
+        self.text_time = text_time
         self.score_names = score_names
         self.score_scores = score_scores
+        self.score_top_n = score_top_n
+        # The sources may have changed, everything is rendered again
+        self.renderer.release()
+        self.rendered_leaderboard = None
+
+        self.red_tomato = red_tomato
+        self.green_tomato = green_tomato
+        self.ring = ring
+        self.show_phase()
+
+    def text_sources(self):
+        # The sources obtained with obs_get_source_by_name, which must be released ("" before the first script_update)
+        return [
+            source
+            for source in (self.text_session, self.text_time, self.score_names, self.score_scores)
+            if source is not None and source != ""
+        ]
+
+    def show_phase(self):
+        is_in_pause = not self.is_in_initial_condition and not self.is_in_session
+        obs.obs_sceneitem_set_visible(self.red_tomato, is_in_pause)
+        obs.obs_sceneitem_set_visible(self.ring, is_in_pause)
+        obs.obs_sceneitem_set_visible(self.green_tomato, not is_in_pause)
 
     def total_time(self):
         if self.is_in_session:
@@ -52,31 +180,47 @@ class Pomodoro:
         else:
             return self.time_pause
 
+    def elapsed_time(self):
+        if self.phase_start_time is None:
+            return 0
+        now = self.clock() if self.pause_start_time is None else self.pause_start_time
+        return now - self.phase_start_time - self.paused_time
+
+    def remaining_time(self):
+        return self.total_time() - self.elapsed_time()
+
+    def is_paused(self):
+        # With the Pause/Resume button, in the middle of a phase
+        return not self.is_running and self.pause_start_time is not None and not self.is_in_initial_condition
+
     def toggle_type(self):
+        # The next phase starts exactly when the previous one was due, however late this tick is
+        if self.is_in_initial_condition or self.phase_start_time is None:
+            self.phase_start_time = self.clock()
+        else:
+            self.phase_start_time += self.paused_time + self.total_time()
+        self.paused_time = 0
+
         self.is_in_initial_condition = False
         self.is_in_session = not self.is_in_session
+        self.show_phase()
         if self.is_in_session:
             self.current_session += 1
-            obs.obs_sceneitem_set_visible(self.red_tomato, False)
-            obs.obs_sceneitem_set_visible(self.ring, False)
-            obs.obs_sceneitem_set_visible(self.green_tomato, True)
         else:
-            obs.obs_sceneitem_set_visible(self.red_tomato, True)
-            obs.obs_sceneitem_set_visible(self.ring, True)
-            obs.obs_sceneitem_set_visible(self.green_tomato, False)
             if self.pomodorotteux:
                 self.pomodorotteux.add_tomato_to_connected_users()
             if self.number_session == self.current_session:
                 self.finished = True
                 if self.pomodorotteux:
-                    self.pomodorotteux.end_session()
-        self.elapsed_time = 0
+                    self.pomodorotteux.disconnect_all_users()
 
     def prepare_session(self):
         self.is_in_initial_condition = True
         self.is_in_session = False
         self.current_session = 0
-        self.elapsed_time = 0
+        self.phase_start_time = None
+        self.paused_time = 0
+        self.pause_start_time = None
         self.finished = False
         self.can_pause = True
         self.is_running = False
@@ -84,16 +228,23 @@ class Pomodoro:
     def start_timer(self, func, new_session):
         if new_session:
             self.prepare_session()
-        obs.timer_add(func, 1000)
+        elif self.pause_start_time is not None:
+            self.paused_time += self.clock() - self.pause_start_time
+            self.pause_start_time = None
+        obs.timer_add(func, TIMER_INTERVAL_MS)
         pomodoro.is_running = True
 
     def stop_timer(self, func, reset_timer):
         obs.timer_remove(func)
         if reset_timer:
-            self.elapsed_time = 0
+            self.phase_start_time = None
+            self.paused_time = 0
+            self.pause_start_time = None
+        elif self.pause_start_time is None:
+            self.pause_start_time = self.clock()
         pomodoro.is_running = False
         if pomodoro.pomodorotteux:
-            self.pomodorotteux.end_session()
+            self.pomodorotteux.disconnect_all_users()
 
     def pause_resume_timer(self, func):
         if not self.can_pause:
@@ -105,6 +256,7 @@ class Pomodoro:
 
 
 pomodoro = Pomodoro()
+pomodorotteux_registry = PomodorotteuxRegistry()
 
 
 def get_time_in_text(remaining_time):
@@ -117,34 +269,32 @@ def get_time_in_text(remaining_time):
         return f"{minutes}:{seconds}"
 
 
+def phase_text():
+    global pomodoro
+    if pomodoro.is_in_session:
+        return f"Session {pomodoro.current_session}/{pomodoro.number_session}"
+    return "    Pause!"
+
+
 def advance_time():
     global pomodoro
 
     if pomodoro.text_session is None or pomodoro.text_session is None:
         return
 
-    if pomodoro.is_in_initial_condition or pomodoro.total_time() - pomodoro.elapsed_time < 1:
+    if pomodoro.is_in_initial_condition or pomodoro.remaining_time() <= 0:
         pomodoro.toggle_type()
-        if pomodoro.is_in_session:
-            text_session = f"Session {pomodoro.current_session}/{pomodoro.number_session}"
-        else:
-            text_session = "    Pause!"
-        obs.obs_data_set_string(pomodoro.settings, "text", text_session)
-        obs.obs_source_update(pomodoro.text_session, pomodoro.settings)
+        pomodoro.renderer.set_text(pomodoro.text_session, phase_text())
 
     if pomodoro.finished:
-        obs.obs_data_set_string(pomodoro.settings, "text", " 0:00")
-        obs.obs_source_update(pomodoro.text_time, pomodoro.settings)
-
-        obs.obs_data_set_string(pomodoro.settings, "text", "    Bravo!")
-        obs.obs_source_update(pomodoro.text_session, pomodoro.settings)
+        pomodoro.renderer.set_text(pomodoro.text_time, " 0:00")
+        pomodoro.renderer.set_text(pomodoro.text_session, "    Bravo!")
         obs.timer_remove(advance_time)
     else:
-        text_to_print = get_time_in_text(pomodoro.total_time() - pomodoro.elapsed_time)
-        pomodoro.elapsed_time += 1
-
-        obs.obs_data_set_string(pomodoro.settings, "text", text_to_print)
-        obs.obs_source_update(pomodoro.text_time, pomodoro.settings)
+        # Rounded up so the full duration shows during the first second and 0:00 is never shown mid-session
+        text_to_print = get_time_in_text(math.ceil(pomodoro.remaining_time()))
+        pomodoro.renderer.set_text(pomodoro.text_time, text_to_print)
+    pomodoro.renderer.flush()
 
 
 def stop_timer(props, prop):
@@ -154,14 +304,14 @@ def stop_timer(props, prop):
     if pomodoro.text_session is None or pomodoro.text_session is None:
         return
 
-    obs.obs_data_set_string(pomodoro.settings, "text", get_time_in_text(pomodoro.time_session))
-    obs.obs_source_update(pomodoro.text_time, pomodoro.settings)
-
-    obs.obs_data_set_string(pomodoro.settings, "text", "Bienvenue!")
-    obs.obs_source_update(pomodoro.text_session, pomodoro.settings)
-
-    if pomodoro.pomodorotteux:
-        pomodoro.pomodorotteux.end_session()
+    pomodoro.renderer.set_text(pomodoro.text_time, get_time_in_text(pomodoro.time_session))
+    pomodoro.renderer.set_text(pomodoro.text_session, "Bienvenue!")
+    pomodoro.renderer.flush()
+    obs.script_log(
+        obs.LOG_INFO,
+        f"Text sources updated {pomodoro.renderer.number_of_updates} times, "
+        f"{pomodoro.renderer.number_of_avoided_updates} identical updates avoided",
+    )
 
 
 def pause_timer(props, prop):
@@ -169,38 +319,94 @@ def pause_timer(props, prop):
     pomodoro.pause_resume_timer(advance_time)
 
 
-def score_update_callback(scores: dict):
+def score_update_callback(users: dict):
     global pomodoro
-    score_names = ""
-    score_scores = ""
-    scores_sorted = dict(sorted(scores.items(), key=lambda item: item[1], reverse=True))
-    for name in scores_sorted:
-        score_names += name + "\n"
-        score_scores += str(scores_sorted[name]) + "\n"
+    if pomodoro.pomodorotteux is None:
+        # Not started yet, ready_callback renders the scores once the database is loaded
+        return
 
-    obs.obs_data_set_string(pomodoro.settings, "text", score_names)
-    obs.obs_source_update(pomodoro.score_names, pomodoro.settings)
+    leaderboard = pomodoro.pomodorotteux.leaderboard(pomodoro.score_top_n)
+    if leaderboard == pomodoro.rendered_leaderboard:
+        # Nothing visible changed, spare OBS from rendering the same texts again
+        return
+    pomodoro.rendered_leaderboard = leaderboard
 
-    obs.obs_data_set_string(pomodoro.settings, "text", score_scores)
-    obs.obs_source_update(pomodoro.score_scores, pomodoro.settings)
+    score_names = "".join(f"{name}\n" for name, _ in leaderboard)
+    score_scores = "".join(f"{total}\n" for _, total in leaderboard)
 
+    pomodoro.renderer.set_text(pomodoro.score_names, score_names)
+    pomodoro.renderer.set_text(pomodoro.score_scores, score_scores)
+    pomodoro.renderer.flush()
 
-def has_connected_callback(name: str, tomato_done: dict):
-    global pomodoro
-    if tomato_done[name] == 0:
-        pomodoro.pomodorotteux.post_message(
-            f"Message de la tomate : {name} s'est connecté(e) pour la première fois! "
+
+def first_connection_message(names: list):
+    if len(names) == 1:
+        return (
+            f"Message de la tomate : {names[0]} s'est connecté(e) pour la première fois! "
             f"La gang des Pomodorotteuses(eux) te souhaitent la bienvenue parmi nous!"
         )
+    return (
+        f"Message de la tomate : {join_names(names, 'et')} se sont connecté(e)s pour la première fois! "
+        f"La gang des Pomodorotteuses(eux) vous souhaitent la bienvenue parmi nous!"
+    )
+
+
+def connection_message(names: list):
+    if len(names) == 1:
+        return f"Message de la tomate : {names[0]} s'est connecté(e) aux tomates! Bon travail!"
+    return f"Message de la tomate : {join_names(names, 'et')} se sont connecté(e)s aux tomates! Bon travail!"
+
+
+def disconnection_message(names: list):
+    if len(names) == 1:
+        return f"Message de la tomate : {names[0]} a été bien silencieux(se)! Tu es toujours là?"
+    return (
+        f"Message de la tomate : {join_names(names, 'et')} ont été bien silencieux(ses)! Vous êtes toujours là?"
+    )
+
+
+def has_connected_callback(name: str, users: dict):
+    global pomodoro
+    # name is the user-id if the users are keyed by id, the pseudo is what is shown
+    pseudo = users[name].pseudo
+    if users[name].initial_number_of_tomatoes == 0:
+        pomodoro.pomodorotteux.post_grouped_message("first_connection", pseudo, first_connection_message)
     else:
-        pomodoro.pomodorotteux.post_message(
-            f"Message de la tomate : {name} s'est connecté(e) aux tomates! Bon travail!"
-        )
+        pomodoro.pomodorotteux.post_grouped_message("connection", pseudo, connection_message)
 
 
-def disconnect_user_callback(name: str):
+def disconnect_user_callback(name: str, users: dict):
     global pomodoro
-    pomodoro.pomodorotteux.post_message(f"Message de la tomate : {name} a été bien silencieux(se)! Tu es toujours là?")
+    pomodoro.pomodorotteux.post_grouped_message("disconnection", users[name].pseudo, disconnection_message)
+
+
+def pause_command(commands, name, pseudo: str, argument: str):
+    global pomodoro
+    # !pause, from the thread of the users: the timer is only read
+    if pomodoro.is_in_initial_condition or pomodoro.finished:
+        return "Pas de session de tomates en cours"
+    if not pomodoro.is_running:
+        return "Le minuteur est en pause"
+    remaining_time = get_time_in_text(math.ceil(pomodoro.remaining_time())).strip()
+    if pomodoro.is_in_session:
+        return f"Prochaine pause dans {remaining_time}"
+    return f"C'est la pause! Reprise dans {remaining_time}"
+
+
+def ready_callback():
+    global pomodoro
+    obs.script_log(obs.LOG_INFO, "Pomodorotteux connecté à Twitch")
+    started = pomodorotteux_registry.pomodorotteux
+    if started is not None and started.pomodorotteux.chat_commands is not None:
+        # Never cached, the remaining time changes every second
+        started.pomodorotteux.chat_commands.register("!pause", pause_command, cache=None)
+    pomodoro.rendered_leaderboard = None
+    score_update_callback({})
+
+
+def failure_callback(error: Exception):
+    # Started again with the next start_timer, the timer goes on without Twitch meanwhile
+    obs.script_log(obs.LOG_WARNING, f"Pomodorotteux non démarré : {error!r}")
 
 
 def start_timer(props, prop):
@@ -211,15 +417,23 @@ def start_timer(props, prop):
         pomodoro.start_timer(advance_time, new_session=True)
 
     try:
-        pomodoro.pomodorotteux = Pomodorotteux(
-            TwitchConfiguration.load_configuration("my_config_file.key"),
-            has_connected_callback=has_connected_callback,
-            disconnect_user_callback=disconnect_user_callback,
-            score_update_callback=score_update_callback,
+        # The same Pomodorotteux as the previous session unless the configuration file changed
+        pomodoro.pomodorotteux = pomodorotteux_registry.acquire(
+            TwitchConfiguration.load_configuration(CONFIGURATION_FILE),
+            PomodoroCallbacks(
+                has_connected_callback,
+                disconnect_user_callback,
+                score_update_callback,
+                ready=ready_callback,
+                failure=failure_callback,
+            ),
             ping_time=90*60,
         )
-    except:
-        # Just ignore the props if it fails for any reason
+        pomodoro.rendered_leaderboard = None
+        score_update_callback({})
+    except Exception as e:
+        # The timer works without Twitch (e.g. no configuration file)
+        obs.script_log(obs.LOG_WARNING, f"Pomodorotteux non démarré : {e!r}")
         pomodoro.pomodorotteux = None
 
 
@@ -229,9 +443,7 @@ def script_description():
 
 def script_update(settings):
     global pomodoro
-    if pomodoro.pomodorotteux:
-        pomodoro.pomodorotteux.end_session()
-
+    # Applied in place, a running timer goes on and the Pomodorotteux is kept
     time_session = obs.obs_data_get_int(settings, "time_pomodoro")
     time_pause = obs.obs_data_get_int(settings, "time_pause")
     number_session = obs.obs_data_get_int(settings, "number_session")
@@ -240,21 +452,58 @@ def script_update(settings):
 
     score_names = obs.obs_get_source_by_name(obs.obs_data_get_string(settings, "score_names"))
     score_scores = obs.obs_get_source_by_name(obs.obs_data_get_string(settings, "score_scores"))
+    score_top_n = obs.obs_data_get_int(settings, "score_top_n")
 
     scene = obs.obs_get_scene_by_name(obs.obs_data_get_string(settings, "pomodoro_scene"))
     red_tomato = obs.obs_scene_find_source_recursive(scene, obs.obs_data_get_string(settings, "red_tomato"))
     green_tomato = obs.obs_scene_find_source_recursive(scene, obs.obs_data_get_string(settings, "green_tomato"))
     ring = obs.obs_scene_find_source_recursive(scene, obs.obs_data_get_string(settings, "ring"))
-
-    settings = obs.obs_data_create()
-    pomodoro = Pomodoro(time_session, time_pause, number_session, text_session, text_time, settings, red_tomato, green_tomato, ring, score_names, score_scores)
-
-    stop_timer(None, None)
+    # The scene items belong to the scene, which OBS keeps
+    obs.obs_scene_release(scene)
+
+    previous_sources = pomodoro.text_sources()
+    pomodoro.apply_settings(
+        time_session,
+        time_pause,
+        number_session,
+        text_session,
+        text_time,
+        red_tomato,
+        green_tomato,
+        ring,
+        score_names,
+        score_scores,
+        score_top_n,
+    )
+    for source in previous_sources:
+        obs.obs_source_release(source)
+
+    if pomodoro.is_paused():
+        # A paused timer keeps its phase and elapsed time, shown again as the sources may have changed
+        pomodoro.renderer.set_text(pomodoro.text_session, phase_text())
+        pomodoro.renderer.set_text(pomodoro.text_time, get_time_in_text(math.ceil(pomodoro.remaining_time())))
+        pomodoro.renderer.flush()
+    elif not pomodoro.is_running:
+        # Never started (or stopped), the sources show the new durations
+        stop_timer(None, None)
+    score_update_callback({})
+
+
+def script_unload():
+    global pomodoro
+    # Nothing may outlive the script (OBS closing or the script reloaded): the timer, the IRC connection, the threads
+    obs.timer_remove(advance_time)
+    pomodorotteux_registry.release()
+    pomodoro.pomodorotteux = None
+    pomodoro.renderer.release()
+    for source in pomodoro.text_sources():
+        obs.obs_source_release(source)
 
 
 def script_defaults(settings):
     obs.obs_data_set_default_int(settings, "time_pomodoro", 0)
     obs.obs_data_set_default_int(settings, "time_pause", 0)
+    obs.obs_data_set_default_int(settings, "score_top_n", 10)
 
 
 def script_properties():
@@ -263,6 +512,7 @@ def script_properties():
     obs.obs_properties_add_int(props, "time_pomodoro", "Pomodoro time", 0, 60, 1)
     obs.obs_properties_add_int(props, "time_pause", "Pause time", 0, 60, 1)
     obs.obs_properties_add_int(props, "number_session", "Number of sessions", 0, 60, 1)
+    obs.obs_properties_add_int(props, "score_top_n", "Hall of fame size", 1, 100, 1)
 
     obs.obs_properties_add_button(props, "start_button", "Start", start_timer)
     obs.obs_properties_add_button(props, "pause_button", "Pause/Resume", pause_timer)
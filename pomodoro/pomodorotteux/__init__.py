@@ -1,4 +1,6 @@
 from .configuration import TwitchConfiguration
 from .pomorotteux import Pomodorotteux
+from .irc_engine import PomodorotteuxEngine
 from .pomodoro_callbacks import PomodoroCallbacks
 from .pomodoro_user import PomodoroUsers
+from .background_pomodorotteux import BackgroundPomodorotteux
@@ -0,0 +1,130 @@
+import threading
+from typing import Callable, Union
+
+from .configuration import TwitchConfigurationInternal
+from .irc_engine import PomodorotteuxEngine
+from .pomodoro_callbacks import PomodoroCallbacks
+from .pomorotteux import Pomodorotteux
+
+
+# Returned right away while a Pomodorotteux connects to Twitch and loads its database on its own thread, so a UI thread
+# (e.g. an OBS button) never waits on the network or the disk. The ready_callback or the failure_callback of the
+# PomodoroCallbacks tells how it went. What is asked meanwhile (tomatoes awarded, chat messages, end of a session) is
+# kept and done in order once it is ready, before anything asked after.
+class BackgroundPomodorotteux:
+    _pomodorotteux: Union[Pomodorotteux, None]
+    _pending_calls: list
+
+    error: Union[Exception, None]
+
+    def __init__(
+        self,
+        config: TwitchConfigurationInternal,
+        callbacks: PomodoroCallbacks,
+        ping_time: float = -1,
+        engine: Union[PomodorotteuxEngine, None] = None,
+    ):
+        self._pomodorotteux = None
+        self._pending_calls = []
+        self._is_ended = False
+        self.error = None
+
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(
+            target=self._start, args=(config, callbacks, ping_time, engine), name="PomodorotteuxStart", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def is_ready(self) -> bool:
+        return self._pomodorotteux is not None
+
+    @property
+    def pomodorotteux(self) -> Union[Pomodorotteux, None]:
+        return self._pomodorotteux
+
+    @property
+    def number_of_pending_tomatoes(self) -> int:
+        with self._lock:
+            return sum(1 for method, _ in self._pending_calls if method == "add_tomato_to_connected_users")
+
+    def wait_until_started(self, timeout: float = None) -> bool:
+        # True if it is ready, False if it failed (see error) or is still starting after timeout
+        self._thread.join(timeout)
+        return self.is_ready
+
+    def add_tomato_to_connected_users(self):
+        # Before it is ready, the tomato goes to the users connected once it is
+        self._call("add_tomato_to_connected_users")
+
+    def disconnect_all_users(self):
+        self._call("disconnect_all_users")
+
+    def post_message(self, message: str):
+        self._call("post_message", message)
+
+    def post_grouped_message(self, group: str, name: str, formatter: Callable):
+        self._call("post_grouped_message", group, name, formatter)
+
+    def leaderboard(self, top_n: int = None) -> list:
+        pomodorotteux = self._pomodorotteux
+        return [] if pomodorotteux is None else pomodorotteux.leaderboard(top_n)
+
+    @property
+    def number_of_connected_users(self) -> int:
+        pomodorotteux = self._pomodorotteux
+        return 0 if pomodorotteux is None else pomodorotteux.number_of_connected_users
+
+    def end_session(self):
+        # Never waits for the start, a Pomodorotteux still starting ends as soon as it is ready
+        with self._lock:
+            self._is_ended = True
+            pomodorotteux = self._pomodorotteux
+        if pomodorotteux is not None:
+            pomodorotteux.end_session()
+
+    def _call(self, method: str, *args):
+        with self._lock:
+            if self._is_ended:
+                return
+            if self._pomodorotteux is None:
+                self._pending_calls.append((method, args))
+                return
+            pomodorotteux = self._pomodorotteux
+        getattr(pomodorotteux, method)(*args)
+
+    def _start(
+        self,
+        config: TwitchConfigurationInternal,
+        callbacks: PomodoroCallbacks,
+        ping_time: float,
+        engine: Union[PomodorotteuxEngine, None],
+    ):
+        try:
+            pomodorotteux = Pomodorotteux(config, callbacks, ping_time, engine)
+        except Exception as e:
+            self.error = e
+            with self._lock:
+                self._pending_calls = []
+            if callbacks.failure_callback is not None:
+                callbacks.failure_callback(e)
+            return
+
+        while True:
+            # Not done under the lock, a callback run meanwhile may call this handle back: its call goes after them
+            with self._lock:
+                pending_calls = self._pending_calls
+                self._pending_calls = []
+                if not pending_calls:
+                    is_ended = self._is_ended
+                    if not is_ended:
+                        self._pomodorotteux = pomodorotteux
+                    break
+            for method, args in pending_calls:
+                getattr(pomodorotteux, method)(*args)
+
+        if is_ended:
+            pomodorotteux.end_session()
+            return
+        if callbacks.ready_callback is not None:
+            callbacks.ready_callback()
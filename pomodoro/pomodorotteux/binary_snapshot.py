@@ -0,0 +1,262 @@
+import mmap
+import os
+import shutil
+import struct
+import threading
+from collections.abc import MutableMapping
+from typing import Callable, Iterator, Union
+
+
+# Fixed layout, little-endian:
+#   header:  magic, version, number of users, offset of the records, offset of the ranking, offset of the names
+#   records: (name offset, name length, total number of tomatoes) sorted by utf-8 name, for binary search
+#   ranking: record indices sorted by (-total, name), for the leaderboard
+#   names:   the utf-8 names one after the other
+_MAGIC = b"POMOSNAP"
+_VERSION = 1
+_HEADER = struct.Struct("<8sIIQQQ")
+_RECORD = struct.Struct("<IIq")
+_RANK = struct.Struct("<I")
+
+# The snapshot is rewritten when the overlay holds more users than this fraction of it (or than the minimum)
+_OVERLAY_REWRITE_RATIO = 0.05
+_OVERLAY_REWRITE_MINIMUM = 1000
+
+
+# Memory-mapped binary snapshot of the users. Opening it only reads the header, the records are read (and paged in by
+# the OS) when they are looked up.
+class BinarySnapshot:
+    path: str
+    number_of_users: int
+
+    def __init__(self, path: str):
+        self.path = path
+        self.number_of_users = 0
+        self._file = None
+        self._map = None
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return
+
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.number_of_users, self._records_offset, self._ranking_offset, self._names_offset = (
+            _HEADER.unpack_from(self._map, 0)
+        )
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"{path} is not a version {_VERSION} Pomodoro snapshot")
+
+    @staticmethod
+    def path_from_database_path(database_path: str) -> str:
+        return os.path.splitext(database_path)[0] + ".pomosnap"
+
+    @staticmethod
+    def write(path: str, totals: dict):
+        encoded = sorted((name.encode("utf-8"), total) for name, total in totals.items())
+        # utf-8 bytes sort like the code points, so this is the (-total, name) order of the leaderboard
+        ranking = sorted(range(len(encoded)), key=lambda i: (-encoded[i][1], encoded[i][0]))
+
+        records_offset = _HEADER.size
+        ranking_offset = records_offset + _RECORD.size * len(encoded)
+        names_offset = ranking_offset + _RANK.size * len(encoded)
+
+        records = bytearray(_RECORD.size * len(encoded))
+        name_offset = 0
+        for i, (name, total) in enumerate(encoded):
+            _RECORD.pack_into(records, i * _RECORD.size, name_offset, len(name), total)
+            name_offset += len(name)
+
+        # Write aside and swap, a crash never leaves half a snapshot. The swap fails on Windows while the snapshot is
+        # mapped (or copied), it must be closed first, see LazySnapshotUsers.save
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(_HEADER.pack(_MAGIC, _VERSION, len(encoded), records_offset, ranking_offset, names_offset))
+            file.write(records)
+            file.write(struct.pack(f"<{len(ranking)}I", *ranking))
+            file.write(b"".join(name for name, _ in encoded))
+        os.replace(tmp_path, path)
+
+    def find(self, name: str) -> int:
+        # Index of the record of name, -1 if it is not in the snapshot
+        key = name.encode("utf-8")
+        low, high = 0, self.number_of_users
+        while low < high:
+            middle = (low + high) // 2
+            current = self._name_bytes(middle)
+            if current < key:
+                low = middle + 1
+            elif current > key:
+                high = middle
+            else:
+                return middle
+        return -1
+
+    def name(self, index: int) -> str:
+        return self._name_bytes(index).decode("utf-8")
+
+    def total(self, index: int) -> int:
+        return _RECORD.unpack_from(self._map, self._records_offset + index * _RECORD.size)[2]
+
+    def names(self) -> Iterator[str]:
+        for index in range(self.number_of_users):
+            yield self.name(index)
+
+    def ranking(self) -> Iterator[int]:
+        # Record indices from the best user to the worst
+        for rank in range(self.number_of_users):
+            yield _RANK.unpack_from(self._map, self._ranking_offset + rank * _RANK.size)[0]
+
+    def backup(self):
+        if os.path.exists(self.path):
+            shutil.copyfile(self.path, self.path + ".bak")
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = None
+
+    def _name_bytes(self, index: int) -> bytes:
+        name_offset, name_length, _ = _RECORD.unpack_from(self._map, self._records_offset + index * _RECORD.size)
+        start = self._names_offset + name_offset
+        return self._map[start : start + name_length]
+
+
+# Users of a BinarySnapshot, materialized as PomodoroUser the first time they are accessed (on_load is then called).
+# Saving only writes the users whose total changed since the snapshot was written, in an overlay (a smaller snapshot
+# next to it) which is loaded with it, and rewrites the snapshot once the overlay gets too big. The snapshot is only
+# read from the thread accessing the users, which is also the one saving (it is then closed to be replaced).
+class LazySnapshotUsers(MutableMapping):
+    snapshot: BinarySnapshot
+    overlay_path: str
+
+    def __init__(self, snapshot: BinarySnapshot, user_class, on_load: Union[Callable, None] = None):
+        self.snapshot = snapshot
+        self.overlay_path = LazySnapshotUsers.overlay_path_from_snapshot_path(snapshot.path)
+        self._user_class = user_class
+        self._on_load = on_load
+        self._loaded = {}
+        self._number_of_loaded_from_snapshot = 0
+        self._backup_thread = None
+
+        # Not kept mapped, it is replaced at each save
+        overlay = BinarySnapshot(self.overlay_path)
+        try:
+            for index in range(overlay.number_of_users):
+                self._load(overlay.name(index), overlay.total(index))
+        finally:
+            overlay.close()
+
+    @staticmethod
+    def overlay_path_from_snapshot_path(snapshot_path: str) -> str:
+        return snapshot_path + ".overlay"
+
+    @property
+    def loaded_users(self) -> dict:
+        return self._loaded
+
+    def compiled_totals(self) -> dict:
+        # Everyone's total as it should be saved, reading the snapshot only for the users which were not loaded
+        totals = {}
+        for index in range(self.snapshot.number_of_users):
+            name = self.snapshot.name(index)
+            if name not in self._loaded:
+                totals[name] = self.snapshot.total(index)
+        for name, user in list(self._loaded.items()):
+            totals[name] = user.total_number_of_tomatoes
+        return totals
+
+    def save(self) -> str:
+        # Returns the path written
+        self._wait_for_backup()
+        changed_totals = self._changed_totals()
+        # Written first even when the snapshot is rewritten, with the same totals, so a crash in between loses nothing
+        BinarySnapshot.write(self.overlay_path, changed_totals)
+        rewrite_size = max(_OVERLAY_REWRITE_MINIMUM, self.snapshot.number_of_users * _OVERLAY_REWRITE_RATIO)
+        if len(changed_totals) <= rewrite_size:
+            return self.overlay_path
+
+        totals = self.compiled_totals()
+        self.snapshot.close()
+        try:
+            BinarySnapshot.write(self.snapshot.path, totals)
+        finally:
+            # The previous one if the write failed
+            self.snapshot = BinarySnapshot(self.snapshot.path)
+        self._number_of_loaded_from_snapshot = len(self._loaded)
+        os.remove(self.overlay_path)
+        return self.snapshot.path
+
+    def start_backup(self):
+        # Snapshots are never modified in place, so it can be copied without blocking the start
+        self._backup_thread = threading.Thread(target=self._backup, daemon=True)
+        self._backup_thread.start()
+
+    def _backup(self):
+        self.snapshot.backup()
+        if os.path.exists(self.overlay_path):
+            shutil.copyfile(self.overlay_path, self.overlay_path + ".bak")
+
+    def close(self):
+        self._wait_for_backup()
+        self.snapshot.close()
+
+    def _changed_totals(self) -> dict:
+        # Of the loaded users, those which are not in the snapshot or with another total
+        totals = {}
+        for name, user in list(self._loaded.items()):
+            index = self.snapshot.find(name)
+            if index < 0 or self.snapshot.total(index) != user.total_number_of_tomatoes:
+                totals[name] = user.total_number_of_tomatoes
+        return totals
+
+    def _wait_for_backup(self):
+        if self._backup_thread is not None:
+            self._backup_thread.join()
+            self._backup_thread = None
+
+    def snapshot_ranking(self) -> Iterator[tuple]:
+        # (-total, name) of the users which were not loaded, best first
+        for index in self.snapshot.ranking():
+            name = self.snapshot.name(index)
+            if name not in self._loaded:
+                yield -self.snapshot.total(index), name
+
+    def __getitem__(self, name: str):
+        if name in self._loaded:
+            return self._loaded[name]
+
+        index = self.snapshot.find(name)
+        if index < 0:
+            raise KeyError(name)
+        return self._load(name, self.snapshot.total(index))
+
+    def _load(self, name: str, total: int):
+        user = self._user_class(_pseudo=name, _initial_number_of_tomatoes=total)
+        user.disconnect()
+        self[name] = user
+        if self._on_load is not None:
+            self._on_load(name, user)
+        return user
+
+    def __setitem__(self, name: str, user):
+        if name not in self._loaded and self.snapshot.find(name) >= 0:
+            self._number_of_loaded_from_snapshot += 1
+        self._loaded[name] = user
+
+    def __delitem__(self, name: str):
+        raise TypeError("Users cannot be removed from a snapshot, clear the database instead")
+
+    def __contains__(self, name) -> bool:
+        return name in self._loaded or self.snapshot.find(name) >= 0
+
+    def __iter__(self):
+        yield from list(self._loaded)
+        for name in self.snapshot.names():
+            if name not in self._loaded:
+                yield name
+
+    def __len__(self) -> int:
+        return self.snapshot.number_of_users + len(self._loaded) - self._number_of_loaded_from_snapshot
+
+    def __repr__(self):
+        return f"LazySnapshotUsers({len(self)} users, {len(self._loaded)} loaded)"
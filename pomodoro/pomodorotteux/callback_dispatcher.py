@@ -0,0 +1,156 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Union
+
+from .metrics import PomodoroMetrics
+
+
+OVERFLOW_POLICIES = ("drop", "drop_oldest", "block")
+
+_logger = logging.getLogger(__name__)
+
+
+# Runs the PomodoroCallbacks on a dedicated thread, so a slow callback (e.g. updating the OBS sources or writing to a
+# socket) never holds the users back. The queue is bounded by capacity, when it is full the overflow policy either
+# drops the new callback ("drop"), drops the oldest one waiting ("drop_oldest") or makes the caller wait ("block").
+# Callbacks dispatched with dispatch_latest (the score updates) only keep the newest arguments while they wait, so only
+# the newest state is rendered, and they are never dropped. A capacity of 0 (or once stopped) runs the callbacks right
+# away on the calling thread.
+class CallbackDispatcher:
+    _capacity: int
+    _overflow_policy: str
+    _metrics: Union[PomodoroMetrics, None]
+
+    number_of_dropped_callbacks: int
+    number_of_coalesced_callbacks: int
+
+    def __init__(
+        self, capacity: int = 1000, overflow_policy: str = "drop", metrics: Union[PomodoroMetrics, None] = None
+    ):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow_policy '{overflow_policy}', expected one of {OVERFLOW_POLICIES}")
+        self._capacity = capacity
+        self._overflow_policy = overflow_policy
+        self._metrics = metrics
+
+        self.number_of_dropped_callbacks = 0
+        self.number_of_coalesced_callbacks = 0
+
+        self._condition = threading.Condition()
+        # (metric name, callback, args, dispatch time), or the key of a latest-only callback
+        self._callbacks = deque()
+        self._latest = {}
+        self._is_running_callback = False
+        self._keep_running = True
+        self._thread = None
+        if capacity > 0:
+            self._thread = threading.Thread(target=self._run, name="CallbackDispatcher", daemon=True)
+            self._thread.start()
+
+    @property
+    def depth(self) -> int:
+        return len(self._callbacks)
+
+    def dispatch(self, metric_name: str, callback: Callable, *args):
+        if not self._is_dispatching:
+            self._run_callback(metric_name, callback, args, time.perf_counter())
+            return
+
+        with self._condition:
+            while self._keep_running and len(self._callbacks) >= self._capacity:
+                if self._overflow_policy == "block":
+                    self._condition.wait()
+                    continue
+
+                index = None
+                if self._overflow_policy == "drop_oldest":
+                    # The oldest which is not a latest-only callback, those are never dropped
+                    index = next((i for i, entry in enumerate(self._callbacks) if not isinstance(entry, str)), None)
+                self.number_of_dropped_callbacks += 1
+                if self._metrics is not None:
+                    self._metrics.callbacks_dropped.inc()
+                if index is None:
+                    # Dropping the new one
+                    return
+                del self._callbacks[index]
+            self._callbacks.append((metric_name, callback, args, time.perf_counter()))
+            self._condition.notify_all()
+
+    def dispatch_latest(self, metric_name: str, callback: Callable, *args, key: str = None):
+        # Replaces the arguments of the callback of the same key (the metric name by default, e.g. one per channel when
+        # the dispatcher is shared) if it is still waiting, it then keeps its place in the queue
+        if not self._is_dispatching:
+            self._run_callback(metric_name, callback, args, time.perf_counter())
+            return
+
+        key = metric_name if key is None else key
+        with self._condition:
+            if key in self._latest:
+                dispatch_time = self._latest[key][3]
+                self._latest[key] = (metric_name, callback, args, dispatch_time)
+                self.number_of_coalesced_callbacks += 1
+                return
+            # Never dropped nor blocking: it is a single entry whatever the number of updates
+            self._latest[key] = (metric_name, callback, args, time.perf_counter())
+            self._callbacks.append(key)
+            self._condition.notify_all()
+
+    @property
+    def _is_dispatching(self) -> bool:
+        return self._thread is not None and self._keep_running
+
+    def wait_until_idle(self):
+        if self._thread is None or threading.current_thread() is self._thread:
+            return
+        with self._condition:
+            self._condition.wait_for(lambda: not self._callbacks and not self._is_running_callback)
+
+    def stop(self):
+        # The callbacks already dispatched are run before it returns
+        if self._thread is None:
+            return
+        with self._condition:
+            self._keep_running = False
+            self._condition.notify_all()
+        if threading.current_thread() is not self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._keep_running and not self._callbacks:
+                    self._condition.wait()
+                if not self._callbacks:
+                    return
+                entry = self._callbacks.popleft()
+                if isinstance(entry, str):
+                    metric_name, callback, args, dispatch_time = self._latest.pop(entry)
+                else:
+                    metric_name, callback, args, dispatch_time = entry
+                self._is_running_callback = True
+                # Room was made for a blocked caller
+                self._condition.notify_all()
+
+            try:
+                self._run_callback(metric_name, callback, args, dispatch_time)
+            except Exception:
+                # A failing callback must not stop the next ones
+                _logger.exception("The %s callback failed", metric_name)
+            finally:
+                with self._condition:
+                    self._is_running_callback = False
+                    self._condition.notify_all()
+
+    def _run_callback(self, metric_name: str, callback: Callable, args: tuple, dispatch_time: float):
+        if self._metrics is None:
+            callback(*args)
+            return
+
+        start = time.perf_counter()
+        try:
+            callback(*args)
+        finally:
+            self._metrics.callback_queue_seconds[metric_name].observe(start - dispatch_time)
+            self._metrics.callback_seconds[metric_name].observe(time.perf_counter() - start)
@@ -0,0 +1,193 @@
+import time
+from typing import Callable, Union
+
+from .chat_queue import TokenBucket
+from .pomodoro_user import PomodoroUsers
+
+
+# Above that many users with a cooldown in progress, those whose cooldown is over are forgotten
+_MAX_USER_BUCKETS = 10000
+CACHE_MODES = ("user", "channel", None)
+
+
+class _ChatCommand:
+    __slots__ = ("name", "handler", "user_cooldown", "global_limiter", "cache")
+
+    name: str
+    handler: Callable
+    user_cooldown: float
+    global_limiter: TokenBucket
+    cache: Union[str, None]
+
+    def __init__(self, name: str, handler: Callable, user_cooldown: float, global_limiter: TokenBucket, cache):
+        self.name = name
+        self.handler = handler
+        self.user_cooldown = user_cooldown
+        self.global_limiter = global_limiter
+        self.cache = cache
+
+
+# Commands of the chat (!tomates, !top...) answered by the bot. The first word of a chat message is looked up in a dict
+# of the command names and aliases, so a message which is not a command costs a single lookup whatever the number of
+# commands. Each command is limited per user (once every user_cooldown seconds) and for the whole channel (global_uses
+# per global_period seconds), both with token buckets: the uses over the limits are ignored on the IRC thread, so a raid
+# spamming the same command gets a few replies and costs little more than the lookups.
+# The handlers run on the thread modifying the users (after the interaction of the message itself) and their reply is
+# cached for the user ("user") or for everyone ("channel") until the tomatoes change (PomodoroUsers.tomatoes_version).
+# handler(commands, name, pseudo, argument) returns the reply or None, name being how the users are keyed.
+class ChatCommands:
+    _users: PomodoroUsers
+    _reply: Callable
+    _name_of_login: Callable
+    _commands: dict
+
+    number_of_commands: int
+    number_of_ignored_commands: int
+    number_of_cached_replies: int
+
+    def __init__(
+        self, users: PomodoroUsers, reply: Callable, name_of_login: Callable, clock: Callable = time.monotonic
+    ):
+        # reply(message) posts to the chat, name_of_login(login) gives how the users are keyed (None if unknown)
+        self._users = users
+        self._reply = reply
+        self._name_of_login = name_of_login
+        self._clock = clock
+        self._commands = {}
+        self._user_buckets = {}
+        self._cached_replies = {}
+        self._cache_version = None
+
+        self.number_of_commands = 0
+        self.number_of_ignored_commands = 0
+        self.number_of_cached_replies = 0
+
+    @property
+    def users(self) -> PomodoroUsers:
+        return self._users
+
+    @property
+    def names(self) -> list:
+        return sorted(self._commands)
+
+    def register(
+        self,
+        names: Union[str, list],
+        handler: Callable,
+        user_cooldown: float = 30,
+        global_uses: int = 5,
+        global_period: float = 30,
+        cache: Union[str, None] = "user",
+    ):
+        # names is the command (e.g. "!top") or the list of the command and its aliases
+        if cache not in CACHE_MODES:
+            raise ValueError(f"Unknown cache '{cache}', expected one of {CACHE_MODES}")
+        names = [names] if isinstance(names, str) else names
+        command = _ChatCommand(
+            names[0].lower(), handler, user_cooldown, TokenBucket(global_uses, global_period, self._clock), cache
+        )
+        for name in names:
+            self._commands[name.lower()] = command
+
+    def handle(self, name, pseudo: str, text: str) -> bool:
+        # Called on the IRC thread for each chat message, True if it was a command (answered or not)
+        if not text or text[0] != "!":
+            return False
+        word, _, argument = text.partition(" ")
+        command = self._commands.get(word.lower())
+        if command is None:
+            return False
+
+        self.number_of_commands += 1
+        if not self._consume_cooldowns(command, name):
+            self.number_of_ignored_commands += 1
+            return True
+        self._users.post(self._answer, command, name, pseudo, argument.strip())
+        return True
+
+    def name_of_login(self, login: str):
+        return self._name_of_login(login.lstrip("@").lower())
+
+    def _consume_cooldowns(self, command: _ChatCommand, name) -> bool:
+        key = (command.name, name)
+        user_bucket = self._user_buckets.get(key)
+        if user_bucket is not None and user_bucket.time_until_available() > 0:
+            return False
+        if not command.global_limiter.try_consume():
+            return False
+        if command.user_cooldown <= 0:
+            return True
+
+        if user_bucket is None:
+            if len(self._user_buckets) >= _MAX_USER_BUCKETS:
+                self._forget_idle_users()
+            user_bucket = TokenBucket(1, command.user_cooldown, self._clock)
+            self._user_buckets[key] = user_bucket
+        user_bucket.try_consume()
+        return True
+
+    def _forget_idle_users(self):
+        # A full bucket behaves as a new one
+        self._user_buckets = {
+            key: bucket for key, bucket in self._user_buckets.items() if bucket.time_until_available(1) > 0
+        }
+
+    def _answer(self, command: _ChatCommand, name, pseudo: str, argument: str):
+        if command.cache is None:
+            reply = command.handler(self, name, pseudo, argument)
+        else:
+            if self._cache_version != self._users.tomatoes_version:
+                self._cached_replies = {}
+                self._cache_version = self._users.tomatoes_version
+            key = (command.name, name if command.cache == "user" else None, argument.lower())
+            if key in self._cached_replies:
+                reply = self._cached_replies[key]
+                self.number_of_cached_replies += 1
+            else:
+                reply = command.handler(self, name, pseudo, argument)
+                self._cached_replies[key] = reply
+        if reply:
+            self._reply(reply)
+
+
+def _tomatoes_command(commands: ChatCommands, name, pseudo: str, argument: str) -> str:
+    # !tomates [pseudo]
+    login = argument.split()[0] if argument else None
+    target = name if login is None else commands.name_of_login(login)
+    user = None if target is None else commands.users.user(target)
+    if user is None:
+        return f"@{pseudo} : {pseudo if login is None else login.lstrip('@')} n'a pas encore de tomate"
+    if target == name:
+        return (
+            f"@{pseudo} : tu as fait {user.number_of_tomato_done} tomate(s) aujourd'hui, "
+            f"{user.total_number_of_tomatoes} au total"
+        )
+    return (
+        f"@{pseudo} : {user.pseudo} a fait {user.number_of_tomato_done} tomate(s) aujourd'hui, "
+        f"{user.total_number_of_tomatoes} au total"
+    )
+
+
+def _top_command(commands: ChatCommands, name, pseudo: str, argument: str) -> str:
+    # !top
+    leaderboard = commands.users.leaderboard(5)
+    if not leaderboard:
+        return "Personne n'a encore fait de tomate"
+    return "Top des tomates : " + ", ".join(
+        f"{rank}. {user_pseudo} ({total})" for rank, (user_pseudo, total) in enumerate(leaderboard, 1)
+    )
+
+
+def _streak_command(commands: ChatCommands, name, pseudo: str, argument: str) -> str:
+    # !streak
+    streak = commands.users.streak(name)
+    if streak == 0:
+        return f"@{pseudo} : pas de série en cours, reste connecté(e) jusqu'à la prochaine tomate!"
+    return f"@{pseudo} : {streak} tomate(s) d'affilée!"
+
+
+def register_tomato_commands(commands: ChatCommands):
+    # !pause depends on the timer, it is registered by the application running it (see pomodoro-obs.py)
+    commands.register(["!tomates", "!tomate"], _tomatoes_command)
+    commands.register("!top", _top_command, cache="channel")
+    commands.register("!streak", _streak_command)
@@ -0,0 +1,219 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, Union
+
+
+class TokenBucket:
+    # Allows bursts of up to capacity events, refilled continuously at capacity tokens per refill_period seconds
+    capacity: float
+    refill_period: float
+
+    def __init__(self, capacity: float, refill_period: float, clock: Callable = time.monotonic):
+        self.capacity = capacity
+        self.refill_period = refill_period
+        self._clock = clock
+        self._tokens = capacity
+        self._last_refill = clock()
+
+    def try_consume(self, tokens: float = 1) -> bool:
+        self._refill()
+        if self._tokens < tokens:
+            return False
+        self._tokens -= tokens
+        return True
+
+    def time_until_available(self, tokens: float = 1) -> float:
+        self._refill()
+        if self._tokens >= tokens:
+            return 0
+        return (tokens - self._tokens) * self.refill_period / self.capacity
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.capacity / self.refill_period)
+        self._last_refill = now
+
+
+class SlidingWindowLimiter:
+    # Allows at most max_events in any period seconds, keeping the times of the last max_events events. Unlike a
+    # TokenBucket it never allows more than max_events in a window, as the server limits (e.g. Twitch) count them
+    max_events: int
+    period: float
+
+    def __init__(self, max_events: int, period: float, clock: Callable = time.monotonic):
+        self.max_events = max_events
+        self.period = period
+        self._clock = clock
+        self._event_times = deque(maxlen=max_events)
+
+    def try_consume(self) -> bool:
+        if self.time_until_available() > 0:
+            return False
+        self._event_times.append(self._clock())
+        return True
+
+    def time_until_available(self) -> float:
+        # The oldest of the last max_events events has to leave the window
+        if len(self._event_times) < self.max_events:
+            return 0
+        return max(self._event_times[0] + self.period - self._clock(), 0)
+
+
+def join_names(names: list, conjunction: str = "and") -> str:
+    if len(names) == 1:
+        return names[0]
+    return f"{', '.join(names[:-1])} {conjunction} {names[-1]}"
+
+
+class _GroupedMessage:
+    __slots__ = ("key", "names", "formatter")
+
+    def __init__(self, key: tuple, formatter: Callable):
+        self.key = key
+        self.names = []
+        self.formatter = formatter
+
+
+# Chat messages waiting to be sent, each to a target (the channel). A single writer thread sends them in order while
+# respecting the server rate limit, so posting never blocks. Grouped messages (e.g. greetings) of the same target and
+# group which are still waiting are merged into one message listing all the names. The messages of a target for which
+# can_send is False (e.g. its connection is being reopened) keep their place while those of the other targets are sent,
+# wake() tells the writer to look at them again.
+class OutboundMessageQueue:
+    _send: Callable
+    _can_send: Union[Callable, None]
+    _rate_limiter: SlidingWindowLimiter
+    _max_message_length: int
+
+    number_of_sent_messages: int
+    number_of_merged_messages: int
+
+    def __init__(
+        self,
+        send: Callable,
+        messages_per_period: int = 20,
+        period: float = 30,
+        max_message_length: int = 500,
+        can_send: Union[Callable, None] = None,
+    ):
+        self._send = send
+        self._can_send = can_send
+        self._rate_limiter = SlidingWindowLimiter(messages_per_period, period)
+        self._max_message_length = max_message_length
+
+        self.number_of_sent_messages = 0
+        self.number_of_merged_messages = 0
+
+        self._condition = threading.Condition()
+        self._messages = deque()
+        self._pending_groups = {}
+        self._keep_running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def depth(self) -> int:
+        return len(self._messages)
+
+    def post(self, target: str, message: str):
+        with self._condition:
+            self._messages.append((target, message))
+            self._condition.notify()
+
+    def post_grouped(self, target: str, group: str, name: str, formatter: Callable):
+        # formatter receives the list of names and returns the message to send
+        key = (target, group)
+        with self._condition:
+            if key in self._pending_groups:
+                self._pending_groups[key].names.append(name)
+                self.number_of_merged_messages += 1
+                return
+
+            grouped_message = _GroupedMessage(key, formatter)
+            grouped_message.names.append(name)
+            self._pending_groups[key] = grouped_message
+            self._messages.append(grouped_message)
+            self._condition.notify()
+
+    def clear(self, target: str = None):
+        # Drop what is waiting for target (or everything if None)
+        with self._condition:
+            if target is None:
+                self._messages.clear()
+                self._pending_groups = {}
+                return
+
+            self._messages = deque(item for item in self._messages if self._target_of(item) != target)
+            self._pending_groups = {key: item for key, item in self._pending_groups.items() if key[0] != target}
+
+    def wake(self):
+        # A target may be sent to again
+        with self._condition:
+            self._condition.notify()
+
+    def stop(self):
+        with self._condition:
+            self._keep_running = False
+            self._condition.notify()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                index = self._next_sendable_index()
+                while self._keep_running and index is None:
+                    self._condition.wait()
+                    index = self._next_sendable_index()
+                if not self._keep_running:
+                    return
+
+                waiting_time = self._rate_limiter.time_until_available()
+                if waiting_time > 0:
+                    # More messages can be merged while waiting for the rate limit
+                    self._condition.wait(waiting_time)
+                    continue
+
+                self._rate_limiter.try_consume()
+                target, message = self._pop_message(index)
+            self._send(target, message)
+            self.number_of_sent_messages += 1
+
+    @staticmethod
+    def _target_of(item) -> str:
+        return item.key[0] if isinstance(item, _GroupedMessage) else item[0]
+
+    def _next_sendable_index(self) -> Union[int, None]:
+        # The first message whose target can be sent to, None if there is none
+        if self._can_send is None:
+            return 0 if self._messages else None
+        blocked_targets = set()
+        for index, item in enumerate(self._messages):
+            target = self._target_of(item)
+            if target in blocked_targets:
+                continue
+            if self._can_send(target):
+                return index
+            blocked_targets.add(target)
+        return None
+
+    def _pop_message(self, index: int) -> tuple:
+        item = self._messages[index]
+        del self._messages[index]
+        if not isinstance(item, _GroupedMessage):
+            return item
+
+        del self._pending_groups[item.key]
+        message = item.formatter(item.names)
+        number_of_names = len(item.names)
+        while len(message) > self._max_message_length and number_of_names > 1:
+            number_of_names -= 1
+            message = item.formatter(item.names[:number_of_names])
+
+        if number_of_names < len(item.names):
+            # Too long for a single chat message, the remaining names go first in line
+            remaining = _GroupedMessage(item.key, item.formatter)
+            remaining.names = item.names[number_of_names:]
+            self._pending_groups[item.key] = remaining
+            self._messages.insert(index, remaining)
+        return item.key[0], message
@@ -0,0 +1,139 @@
+import sys
+from array import array
+from collections.abc import MutableMapping
+
+
+class PomodoroUserView:
+    # Same interface as PomodoroUser, reading and writing a row of a ColumnarUsers store
+    __slots__ = ("_store", "_row")
+
+    def __init__(self, store, row: int):
+        self._store = store
+        self._row = row
+
+    @property
+    def pseudo(self) -> str:
+        return self._store.names[self._row]
+
+    @property
+    def is_connected(self) -> bool:
+        return self._row in self._store.connected_rows
+
+    @is_connected.setter
+    def is_connected(self, value: bool):
+        if value:
+            self._store.connected_rows.add(self._row)
+        else:
+            self._store.connected_rows.discard(self._row)
+
+    @property
+    def initial_number_of_tomatoes(self) -> int:
+        return self._store.initial_number_of_tomatoes[self._row]
+
+    @initial_number_of_tomatoes.setter
+    def initial_number_of_tomatoes(self, value: int):
+        self._store.initial_number_of_tomatoes[self._row] = value
+
+    @property
+    def number_of_tomato_done(self) -> int:
+        return self._store.number_of_tomato_done[self._row]
+
+    @number_of_tomato_done.setter
+    def number_of_tomato_done(self, value: int):
+        self._store.number_of_tomato_done[self._row] = value
+
+    @property
+    def last_time_interacted(self) -> float:
+        return self._store.last_time_interacted[self._row]
+
+    @last_time_interacted.setter
+    def last_time_interacted(self, value: float):
+        self._store.last_time_interacted[self._row] = value
+
+    @property
+    def total_number_of_tomatoes(self):
+        return self.initial_number_of_tomatoes + self.number_of_tomato_done
+
+    def compile_tomatoes(self):
+        self.initial_number_of_tomatoes += self.number_of_tomato_done
+        self.number_of_tomato_done = 0
+
+    def disconnect(self):
+        self.is_connected = False
+        self.last_time_interacted = 0
+
+    def __repr__(self):
+        return f"PomodoroUserView({self.pseudo}, {self.total_number_of_tomatoes})"
+
+
+# Compact store of the users: the interned names map to row indices and each field is an array column. The connected
+# users are kept as a set of rows so awarding tomatoes only touches them, while compiling and disconnecting everyone are
+# whole-column operations. Indexing by name returns a PomodoroUserView, so it can be used in place of the dict of
+# PomodoroUser.
+class ColumnarUsers(MutableMapping):
+    names: list
+    initial_number_of_tomatoes: array
+    number_of_tomato_done: array
+    last_time_interacted: array
+    connected_rows: set
+
+    def __init__(self):
+        self._row_of_name = {}
+        self.names = []
+        self.initial_number_of_tomatoes = array("q")
+        self.number_of_tomato_done = array("q")
+        self.last_time_interacted = array("d")
+        self.connected_rows = set()
+
+    @staticmethod
+    def from_users(users: dict):
+        output = ColumnarUsers()
+        for name, user in users.items():
+            output[name] = user
+        return output
+
+    def add_tomato_to_connected_users(self) -> list:
+        number_of_tomato_done = self.number_of_tomato_done
+        for row in self.connected_rows:
+            number_of_tomato_done[row] += 1
+        return [self.names[row] for row in self.connected_rows]
+
+    def disconnect_all_users(self):
+        self.connected_rows = set()
+        self.last_time_interacted = array("d", bytes(self.last_time_interacted.itemsize * len(self.names)))
+
+    def __getitem__(self, name: str) -> PomodoroUserView:
+        return PomodoroUserView(self, self._row_of_name[name])
+
+    def __setitem__(self, name: str, user):
+        if name in self._row_of_name:
+            row = self._row_of_name[name]
+        else:
+            name = sys.intern(name)
+            row = len(self.names)
+            self._row_of_name[name] = row
+            self.names.append(name)
+            self.initial_number_of_tomatoes.append(0)
+            self.number_of_tomato_done.append(0)
+            self.last_time_interacted.append(0)
+
+        view = PomodoroUserView(self, row)
+        view.initial_number_of_tomatoes = user.initial_number_of_tomatoes
+        view.number_of_tomato_done = user.number_of_tomato_done
+        view.last_time_interacted = user.last_time_interacted
+        view.is_connected = user.is_connected
+
+    def __delitem__(self, name: str):
+        raise TypeError("Users cannot be removed from a ColumnarUsers store, clear the database instead")
+
+    def __contains__(self, name) -> bool:
+        return name in self._row_of_name
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __repr__(self):
+        return f"ColumnarUsers({len(self.names)} users, {len(self.connected_rows)} connected)"
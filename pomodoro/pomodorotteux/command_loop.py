@@ -0,0 +1,105 @@
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Callable, Union
+
+
+_logger = logging.getLogger(__name__)
+
+
+# Runs the commands submitted from any thread one after the other on its own thread, so the state they modify has a
+# single writer and needs no lock. A command can ask for a function to run once the pending commands are done (e.g. to
+# publish read-only snapshots for the other threads), see run_when_idle. A command submitted from the loop itself, or
+# after stop(), runs right away on the calling thread. Several owners (e.g. the users of several channels) can share a
+# loop, each asks for its own functions.
+class CommandLoop:
+    def __init__(self, name: str = "CommandLoop"):
+        # function: None, in the order they were asked for
+        self._idle_functions = {}
+
+        self._commands = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._keep_running = True
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    @property
+    def in_loop(self) -> bool:
+        return threading.current_thread() is self._thread
+
+    def post(self, function: Callable, *args):
+        # Returns without waiting for the command to run, nor any way to get its result (the cheapest)
+        self._enqueue(None, function, args)
+
+    def submit(self, function: Callable, *args) -> Future:
+        # Returns without waiting for the command to run
+        future = Future()
+        self._enqueue(future, function, args)
+        return future
+
+    def call(self, function: Callable, *args):
+        # Waits for the command (and everything submitted before it) and returns its result
+        return self.submit(function, *args).result()
+
+    def wait_for_pending_commands(self):
+        self.call(lambda: None)
+
+    def run_when_idle(self, function: Callable):
+        # From a command, function runs once after the pending commands however many of them ask. Right away otherwise
+        if not self.in_loop:
+            function()
+            return
+        self._idle_functions[function] = None
+
+    def stop(self):
+        with self._lock:
+            if not self._keep_running:
+                return
+            self._keep_running = False
+            self._commands.put(None)
+        if not self.in_loop:
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            command = self._commands.get()
+            while command is not None:
+                self._execute(*command)
+                try:
+                    command = self._commands.get_nowait()
+                except queue.Empty:
+                    break
+            # Those asked for by an idle function too
+            while self._idle_functions:
+                functions, self._idle_functions = self._idle_functions, {}
+                for function in functions:
+                    try:
+                        function()
+                    except Exception:
+                        # The loop must outlive it, every call waiting for a command would hang otherwise
+                        _logger.exception("An idle function of %s failed", self._thread.name)
+            if command is None:
+                return
+
+    def _enqueue(self, future: Union[Future, None], function: Callable, args: tuple):
+        with self._lock:
+            if self._keep_running and not self.in_loop:
+                self._commands.put((future, function, args))
+                return
+        self._execute(future, function, args)
+
+    def _execute(self, future: Union[Future, None], function: Callable, args: tuple):
+        if future is not None and not future.set_running_or_notify_cancel():
+            return
+        try:
+            result = function(*args)
+        except Exception as e:
+            if future is None:
+                # Posted, nobody waits for the result
+                _logger.exception("A command of %s failed", self._thread.name)
+            else:
+                future.set_exception(e)
+            return
+        if future is not None:
+            future.set_result(result)
@@ -1,6 +1,7 @@
 from pathlib import Path
-from dataclasses import dataclass
+from dataclasses import dataclass, replace
 import json
+import os
 
 
 @dataclass
@@ -11,6 +12,29 @@ class TwitchConfigurationInternal:
     oauth_key: str = None
     irc_server_address: str = "irc.chat.twitch.tv"
     irc_port: int = 6667
+    database_mode: str = "pickle"  # "pickle", "journal", "sqlite" or "binary"
+    journal_compaction_threshold: int = 1000
+    user_store: str = "objects"  # "objects" or "columnar"
+    save_coalescing_window: float = 1.0  # Seconds, 0 saves synchronously on every change
+    chat_messages_per_period: int = 20  # Twitch allows 20 messages per 30 seconds (100 if the bot is moderator)
+    chat_rate_period: float = 30
+    channels_per_connection: int = 50
+    reconnect_initial_delay: float = 1  # Seconds, doubled after each failed attempt to reconnect
+    reconnect_max_delay: float = 120
+    # Twitch sends a PING about every 5 minutes, a connection silent for longer is probed, then reopened
+    server_silence_timeout: float = 360
+    # JOIN/PART/NAMES connect and disconnect the users, even those who never talk (Twitch only sends them for channels
+    # under 1000 chatters, the others are still seen when they talk)
+    presence_from_membership: bool = True
+    tomato_history: bool = True  # Keeps the tomatoes of each session (see TomatoHistory) next to the database
+    chat_commands: bool = True  # Answer !tomates, !top and !streak (and those registered by the application)
+    # "login" or "user_id", the IRCv3 user-id tag which does not change when a user is renamed. A user of a database
+    # keyed by login is moved to their id the first time they talk
+    user_key: str = "login"
+    callback_queue_size: int = 1000  # 0 runs the callbacks on the thread modifying the users
+    callback_overflow_policy: str = "drop"  # "drop", "drop_oldest" or "block", the score updates are always coalesced
+    metrics_file_path: str = None  # Prometheus text file, rewritten every metrics_interval seconds
+    metrics_interval: float = 15
 
     def __post_init__(self):
         if self.nickname is None:
@@ -24,8 +48,42 @@ class TwitchConfigurationInternal:
                 "channel_editor&token_type=bearer"
             )
 
+        if self.database_mode not in ("pickle", "journal", "sqlite", "binary"):
+            raise ValueError(
+                f"Unknown database_mode '{self.database_mode}', expected 'pickle', 'journal', 'sqlite' or 'binary'"
+            )
+        if self.user_store not in ("objects", "columnar"):
+            raise ValueError(f"Unknown user_store '{self.user_store}', expected 'objects' or 'columnar'")
+        if self.database_mode == "binary" and self.user_store != "objects":
+            raise ValueError("The 'binary' database_mode loads the users lazily and requires the 'objects' user_store")
+        if self.callback_overflow_policy not in ("drop", "drop_oldest", "block"):
+            raise ValueError(
+                f"Unknown callback_overflow_policy '{self.callback_overflow_policy}', "
+                f"expected 'drop', 'drop_oldest' or 'block'"
+            )
+        if self.user_key not in ("login", "user_id"):
+            raise ValueError(f"Unknown user_key '{self.user_key}', expected 'login' or 'user_id'")
+        if self.user_key == "user_id" and (
+            self.database_mode not in ("pickle", "journal") or self.user_store != "objects"
+        ):
+            raise ValueError(
+                "The 'user_id' user_key keeps the pseudo of each user, which requires the 'pickle' or 'journal' "
+                "database_mode and the 'objects' user_store"
+            )
+        if self.reconnect_initial_delay <= 0 or self.reconnect_max_delay < self.reconnect_initial_delay:
+            raise ValueError("reconnect_initial_delay must be positive and not over reconnect_max_delay")
+        if self.server_silence_timeout <= 0:
+            raise ValueError("server_silence_timeout must be positive")
+        if self.metrics_interval <= 0:
+            raise ValueError("metrics_interval must be positive")
+
         self.oauth_key = self.oauth_key if self.oauth_key[:6] == "oauth:" else "oauth:" + self.oauth_key
 
+    def channel_config(self, channel_name: str):
+        # Same account and server for another channel, with its own database next to this one
+        root, extension = os.path.splitext(self.database_path)
+        return replace(self, channel_name=channel_name, database_path=f"{root}.{channel_name}{extension}")
+
 
 class TwitchConfiguration:
     @staticmethod
@@ -35,11 +93,14 @@ class TwitchConfiguration:
         nickname: str = None,
         database_path: str = None,
         oauth_key: str = None,
+        database_mode: str = "pickle",
     ):
         if database_path is None:
             database_path = str(Path.home()) + "/.config/Pomodoro/database.pomo"
 
-        config = TwitchConfigurationInternal(nickname, channel_name, database_path, oauth_key)
+        config = TwitchConfigurationInternal(
+            nickname, channel_name, database_path, oauth_key, database_mode=database_mode
+        )
         with open(path, "w") as f:
             json.dump(config.__dict__, f, indent=2)
 
@@ -0,0 +1,190 @@
+import json
+import os
+import pickle
+import threading
+from typing import Callable, Iterator
+
+
+# Append-only journal of the events modifying a PomodoroUsers database. The pickle file at the database path is used as
+# the snapshot and the journal is stored next to it. When the journal grows over the compaction threshold, it is rotated
+# and folded into the snapshot by a background thread. dump_users writes the users given to checkpoint in the snapshot.
+# Each journal segment starts with its generation and the snapshot ends with the generation of the last segment folded
+# into it (a second pickle after the users, so it still loads as a pickle database). The snapshot is replaced before
+# the segments it contains are removed, a crash in between leaves segments which replay() skips instead of counting
+# their tomatoes twice. replay() is called first, it opens the journal.
+class DatabaseJournal:
+    _snapshot_path: str
+    _journal_path: str
+    _compacting_path: str
+    _apply_record: Callable
+    _dump_users: Callable
+    _compaction_threshold: int
+    _number_of_records: int
+    # Of the live journal
+    _generation: int
+
+    def __init__(
+        self,
+        snapshot_path: str,
+        apply_record: Callable,
+        compaction_threshold: int = 1000,
+        dump_users: Callable = pickle.dump,
+    ):
+        self._snapshot_path = snapshot_path
+        self._journal_path = snapshot_path + ".journal"
+        self._compacting_path = self._journal_path + ".compacting"
+        self._apply_record = apply_record
+        self._dump_users = dump_users
+        self._compaction_threshold = compaction_threshold
+
+        self._lock = threading.Lock()
+        self._compaction_thread = None
+        self._file = None
+        self._number_of_records = 0
+        self._generation = 0
+
+    def replay(self) -> dict:
+        # The snapshot, then the segment which was being compacted (if any), then the live journal, each segment only if
+        # the snapshot does not contain it yet
+        users, snapshot_generation = self._load_snapshot()
+        last_generation = snapshot_generation
+        segments = [self._read_segment(path) for path in (self._compacting_path, self._journal_path)]
+        for generation, records in segments:
+            if generation is not None and generation <= snapshot_generation:
+                continue
+            for record in records:
+                self._apply_record(users, record)
+            if generation is not None:
+                last_generation = generation
+
+        generation, records = segments[-1]
+        if generation is not None and generation > snapshot_generation:
+            self._generation = generation
+            self._file = open(self._journal_path, "a", encoding="utf-8")
+            self._number_of_records = len(records)
+        else:
+            # A new journal, one already in the snapshot (whose records would be skipped with it) or one written before
+            # the segments were numbered (whose records are kept after a header)
+            self._open_new_journal(last_generation + 1, records if generation is None else ())
+        return users
+
+    def record_connection(self, name: str, pseudo: str = None):
+        # The pseudo is only written when it is not the name (users keyed by id)
+        record = {"connect": name}
+        if pseudo is not None and pseudo != name:
+            record["pseudo"] = pseudo
+        self._append(record)
+
+    def record_tomatoes(self, names: list):
+        self._append({"tomato": names})
+
+    def record_new_key(self, old_name: str, new_name: str):
+        self._append({"rekey": [old_name, new_name]})
+
+    def record_clear(self):
+        self._append({"clear": True})
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def checkpoint(self, users: dict):
+        # Write the full database as the new snapshot and restart from an empty journal
+        with self._lock:
+            self.wait_for_compaction()
+            self._write_snapshot(users, self._generation)
+            self._file.close()
+            self._open_new_journal(self._generation + 1)
+            if os.path.exists(self._compacting_path):
+                os.remove(self._compacting_path)
+
+    def compact(self):
+        with self._lock:
+            if self._compaction_thread is not None and self._compaction_thread.is_alive():
+                return
+            # If a previous compaction was interrupted, fold its segment first and rotate next time
+            if not os.path.exists(self._compacting_path):
+                self._file.close()
+                os.replace(self._journal_path, self._compacting_path)
+                self._open_new_journal(self._generation + 1)
+
+            self._compaction_thread = threading.Thread(target=self._compact_rotated_segment, daemon=True)
+            self._compaction_thread.start()
+
+    def wait_for_compaction(self):
+        thread = self._compaction_thread
+        if thread is not None:
+            thread.join()
+
+    def close(self):
+        self.wait_for_compaction()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+
+    def _append(self, record: dict):
+        line = json.dumps(record, separators=(",", ":")) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._number_of_records += 1
+            should_compact = self._number_of_records >= self._compaction_threshold
+        if should_compact:
+            self.compact()
+
+    def _compact_rotated_segment(self):
+        users, snapshot_generation = self._load_snapshot()
+        generation, records = self._read_segment(self._compacting_path)
+        if generation is None or generation > snapshot_generation:
+            for record in records:
+                self._apply_record(users, record)
+            self._write_snapshot(users, snapshot_generation if generation is None else generation)
+        os.remove(self._compacting_path)
+
+    def _open_new_journal(self, generation: int, records: list = ()):
+        self._generation = generation
+        self._file = open(self._journal_path, "w", encoding="utf-8")
+        for record in ({"generation": generation}, *records):
+            self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._file.flush()
+        self._number_of_records = len(records)
+
+    def _load_snapshot(self) -> tuple:
+        # (users, generation of the last segment it contains)
+        if not os.path.exists(self._snapshot_path):
+            return {}, 0
+        with open(self._snapshot_path, "rb") as file:
+            users = pickle.load(file)
+            try:
+                return users, pickle.load(file)
+            except EOFError:
+                # Written by the pickle database, or before the segments were numbered
+                return users, 0
+
+    def _write_snapshot(self, users: dict, generation: int):
+        # Write aside and swap so a crash never leaves a half written snapshot
+        tmp_path = self._snapshot_path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            self._dump_users(users, file)
+            pickle.dump(generation, file)
+        os.replace(tmp_path, self._snapshot_path)
+
+    @staticmethod
+    def _read_segment(path: str) -> tuple:
+        # (generation, records), the generation is None if the segment is empty or was written before they were
+        # numbered
+        records = list(DatabaseJournal._read_records(path))
+        if records and "generation" in records[0]:
+            return records[0]["generation"], records[1:]
+        return None, records
+
+    @staticmethod
+    def _read_records(path: str) -> Iterator[dict]:
+        if not os.path.exists(path):
+            return
+        with open(path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn last line from a crash, everything before it is valid
+                    return
@@ -0,0 +1,100 @@
+import logging
+import threading
+import time
+from typing import Callable, Union
+
+
+_logger = logging.getLogger(__name__)
+
+
+# Write-behind saving of the database. Mutations only mark the database as dirty, a background thread waits for the
+# coalescing window to pass and then writes all of them at once, so disk stalls never block the IRC or OBS threads. A
+# failed write is logged and tried again after the next window. Several databases (e.g. those of the channels of one
+# engine) can share a persister, each marking itself dirty with its own flush function.
+class DatabasePersister:
+    _flush_function: Union[Callable, None]
+    _coalescing_window: float
+
+    last_flush_latency: float
+    number_of_flushes: int
+    coalesced_writes: int
+
+    def __init__(self, flush_function: Union[Callable, None] = None, coalescing_window: float = 1.0):
+        # flush_function is the one of mark_dirty when it is not given
+        self._flush_function = flush_function
+        self._coalescing_window = coalescing_window
+
+        self.last_flush_latency = 0
+        self.number_of_flushes = 0
+        self.coalesced_writes = 0
+
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        # flush function: number of writes it will save
+        self._pending_writes = {}
+        self._keep_running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @property
+    def is_dirty(self) -> bool:
+        return bool(self._pending_writes)
+
+    def mark_dirty(self, flush_function: Callable = None):
+        flush_function = self._flush_function if flush_function is None else flush_function
+        with self._condition:
+            self._pending_writes[flush_function] = self._pending_writes.get(flush_function, 0) + 1
+            self._condition.notify()
+
+    def flush(self):
+        # Synchronously write whatever is pending, from any thread. The first failure is raised once the others are
+        # written
+        with self._flush_lock:
+            with self._condition:
+                pending_writes, self._pending_writes = self._pending_writes, {}
+            if not pending_writes:
+                return
+
+            start = time.perf_counter()
+            error = None
+            for flush_function, number_of_writes in pending_writes.items():
+                try:
+                    flush_function()
+                except Exception as e:
+                    # Still to be written
+                    with self._condition:
+                        self._pending_writes[flush_function] = (
+                            self._pending_writes.get(flush_function, 0) + number_of_writes
+                        )
+                    error = e if error is None else error
+                    continue
+                self.coalesced_writes += number_of_writes - 1
+            if error is not None:
+                raise error
+            self.last_flush_latency = time.perf_counter() - start
+            self.number_of_flushes += 1
+
+    def stop(self):
+        with self._condition:
+            self._keep_running = False
+            self._condition.notify()
+        self._thread.join()
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._keep_running and not self._pending_writes:
+                    self._condition.wait()
+                if not self._keep_running:
+                    return
+
+                # Let the mutations pile up for the coalescing window (stop() cuts it short)
+                deadline = time.monotonic() + self._coalescing_window
+                while self._keep_running and time.monotonic() < deadline:
+                    self._condition.wait(deadline - time.monotonic())
+            try:
+                self.flush()
+            except Exception:
+                # E.g. a full disk, tried again after the next coalescing window
+                _logger.exception("Saving the database failed")
@@ -0,0 +1,137 @@
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+
+
+# SQLite (WAL) storage of the users. Each interaction is a row-level upsert/update, the changes are committed when the
+# database is flushed (so the write-behind persister groups them in a single transaction) and the leaderboard is a query
+# on the tomatoes index. It has the same record_* interface as DatabaseJournal. The user_version of the file is set when
+# it is created, so a table emptied by a clear is not taken for a new database.
+class SqliteDatabase:
+    _path: str
+
+    is_new: bool
+
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS users ("
+            "pseudo TEXT PRIMARY KEY NOT NULL, "
+            "total_number_of_tomatoes INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS users_by_tomatoes ON users (total_number_of_tomatoes DESC, pseudo)"
+        )
+        # A table filled before the version was set (or by migrate_from_pickle) is not new either
+        version = self._connection.execute("PRAGMA user_version").fetchone()[0]
+        self.is_new = version == 0 and self._connection.execute("SELECT 1 FROM users LIMIT 1").fetchone() is None
+        self._connection.execute("PRAGMA user_version = 1")
+        self._connection.commit()
+
+    @staticmethod
+    def path_from_database_path(database_path: str) -> str:
+        return os.path.splitext(database_path)[0] + ".sqlite"
+
+    def load_totals(self) -> dict:
+        with self._lock:
+            return dict(self._connection.execute("SELECT pseudo, total_number_of_tomatoes FROM users"))
+
+    def leaderboard(self, top_n: int = None) -> list:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT pseudo, total_number_of_tomatoes FROM users "
+                "ORDER BY total_number_of_tomatoes DESC, pseudo LIMIT ?",
+                (-1 if top_n is None else top_n,),
+            ).fetchall()
+
+    def record_connection(self, name: str, pseudo: str = None):
+        # The users are keyed by name in this database, so the pseudo is the name
+        with self._lock:
+            self._connection.execute("INSERT OR IGNORE INTO users (pseudo) VALUES (?)", (name,))
+
+    def record_tomatoes(self, names: list):
+        with self._lock:
+            self._connection.executemany(
+                "INSERT INTO users (pseudo, total_number_of_tomatoes) VALUES (?, 1) "
+                "ON CONFLICT (pseudo) DO UPDATE SET total_number_of_tomatoes = total_number_of_tomatoes + 1",
+                ((name,) for name in names),
+            )
+
+    def record_clear(self):
+        with self._lock:
+            self._connection.execute("DELETE FROM users")
+
+    def flush(self):
+        with self._lock:
+            self._connection.commit()
+
+    def checkpoint(self, users):
+        # Make the table match the users (the names are copied as the IRC thread may add users meanwhile)
+        names = list(users)
+        with self._lock:
+            self._connection.execute("DELETE FROM users")
+            self._connection.executemany(
+                "INSERT INTO users (pseudo, total_number_of_tomatoes) VALUES (?, ?)",
+                ((name, users[name].total_number_of_tomatoes) for name in names),
+            )
+            self._connection.commit()
+
+    def backup(self):
+        with self._lock:
+            self._connection.commit()
+            destination = sqlite3.connect(self._path + ".bak")
+            try:
+                self._connection.backup(destination)
+            finally:
+                destination.close()
+
+    def close(self):
+        with self._lock:
+            self._connection.commit()
+            self._connection.close()
+
+    def migrate_from_pickle(self, pickle_path: str) -> int:
+        # One-shot import of a pickle database and of its backup. Both are snapshots of ever growing counters, so a user
+        # found in both keeps the largest total. Returns the number of users imported
+        totals = {}
+        for path in (pickle_path + ".bak", pickle_path):
+            if not os.path.exists(path):
+                continue
+            with open(path, "rb") as file:
+                users = pickle.load(file)
+            for name, user in users.items():
+                totals[name] = max(totals.get(name, 0), user.total_number_of_tomatoes)
+
+        with self._lock:
+            self._connection.executemany(
+                "INSERT INTO users (pseudo, total_number_of_tomatoes) VALUES (?, ?) "
+                "ON CONFLICT (pseudo) DO UPDATE SET total_number_of_tomatoes = "
+                "MAX(total_number_of_tomatoes, excluded.total_number_of_tomatoes)",
+                totals.items(),
+            )
+            self._connection.commit()
+        return len(totals)
+
+
+def main():
+    # python -m pomodorotteux.database_sqlite path/to/database.pomo [path/to/database.sqlite]
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python -m pomodorotteux.database_sqlite PICKLE_DATABASE [SQLITE_DATABASE]")
+        sys.exit(1)
+
+    pickle_path = sys.argv[1]
+    sqlite_path = sys.argv[2] if len(sys.argv) == 3 else SqliteDatabase.path_from_database_path(pickle_path)
+    database = SqliteDatabase(sqlite_path)
+    number_of_users = database.migrate_from_pickle(pickle_path)
+    database.close()
+    print(f"Imported {number_of_users} users from {pickle_path} into {sqlite_path}")
+
+
+if __name__ == "__main__":
+    main()
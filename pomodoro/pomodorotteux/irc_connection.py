@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import threading
+from typing import Callable, Union
+
+
+_logger = logging.getLogger(__name__)
+
+
+# IRC connection driven by an asyncio event loop running in its own thread. Incoming data is framed into complete lines
+# (partial lines are carried over between reads) and handed to on_line as soon as they arrive. The public methods are
+# synchronous and thread-safe so they can be called from the OBS script or any other thread. on_disconnect is called
+# when the connection is lost (closed by the server or failing), never when it is closed with close().
+class IrcConnection:
+    _address: str
+    _port: int
+    _on_line: Callable
+    _on_disconnect: Union[Callable, None]
+    _loop: asyncio.AbstractEventLoop
+    _writer: Union[asyncio.StreamWriter, None]
+
+    def __init__(self, address: str, port: int, on_line: Callable, on_disconnect: Union[Callable, None] = None):
+        self._address = address
+        self._port = port
+        self._on_line = on_line
+        self._on_disconnect = on_disconnect
+        self._is_closing = False
+        self._writer = None
+        self._read_task = None
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+
+    @property
+    def is_connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    def connect(self, timeout: float = 10):
+        self._thread.start()
+        try:
+            asyncio.run_coroutine_threadsafe(self._open(), self._loop).result(timeout)
+        except Exception:
+            self._stop_loop()
+            raise
+
+    def send(self, command: str):
+        # Queued on the event loop, the caller never waits for the socket
+        if self._loop.is_closed():
+            return
+        self._loop.call_soon_threadsafe(self._write, (command + "\r\n").encode())
+
+    def close(self, timeout: float = 5):
+        self._is_closing = True
+        if not self._thread.is_alive():
+            return
+        if threading.current_thread() is self._thread:
+            # Called from a line callback, the loop cannot wait on itself
+            self._loop.create_task(self._close()).add_done_callback(lambda _: self._loop.stop())
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._close(), self._loop).result(timeout)
+        finally:
+            self._stop_loop()
+
+    async def _open(self):
+        reader, self._writer = await asyncio.open_connection(self._address, self._port)
+        self._read_task = self._loop.create_task(self._read_lines(reader))
+
+    async def _read_lines(self, reader: asyncio.StreamReader):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    # The server closed the connection
+                    break
+                self._on_line(line.decode("utf-8", errors="replace").rstrip("\r\n"))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # on_disconnect is still called, the connection is reopened
+            _logger.exception("Reading from %s:%d failed", self._address, self._port)
+        finally:
+            if self._writer is not None:
+                self._writer.close()
+            if not self._is_closing and self._on_disconnect is not None:
+                self._on_disconnect()
+
+    async def _close(self):
+        if self._writer is None:
+            return
+        if not self._writer.is_closing():
+            self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except ConnectionError:
+            pass
+        if self._read_task is not None:
+            self._read_task.cancel()
+
+    def _write(self, data: bytes):
+        if self.is_connected:
+            self._writer.write(data)
+
+    def _stop_loop(self):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
@@ -0,0 +1,391 @@
+import logging
+import random
+import threading
+import time
+from functools import partial
+from typing import Callable, Union
+
+from .chat_queue import OutboundMessageQueue, SlidingWindowLimiter
+from .configuration import TwitchConfigurationInternal
+from .irc_connection import IrcConnection
+from .irc_message import parse_irc_message
+from .metrics import PomodoroMetrics
+from .pomodoro_user import UsersWorkers
+
+
+_logger = logging.getLogger(__name__)
+
+# Seconds given to the server to answer the PING sent to a silent connection
+_PING_REPLY_TIMEOUT = 10
+# Seconds given to the server to accept (or refuse) the OAuth key of a new connection
+_AUTHENTICATION_TIMEOUT = 10
+_AUTHENTICATION_FAILED_MESSAGE = (
+    "Unable to connect to Twitch, need another OAuth key?\n"
+    "Visit: https://twitchapps.com/tmi/#access_token=7ld7okcsiozvkrcjdwt3z9y31ajrzk&"
+    "scope=chat%3Aread+chat%3Aedit+channel%3Amoderate+whispers%3Aread+whispers%3Aedit+"
+    "channel_editor&token_type=bearer"
+)
+
+
+class _PooledConnection:
+    __slots__ = (
+        "connection",
+        "channels",
+        "last_received",
+        "last_probe",
+        "needs_reconnection",
+        "failed_attempts",
+        "next_attempt",
+        "authentication_failed",
+        "authentication_answered",
+    )
+
+    connection: IrcConnection
+    channels: set
+    # time.monotonic() of the last line received and of the last PING sent to check the connection
+    last_received: float
+    last_probe: float
+    needs_reconnection: bool
+    failed_attempts: int
+    next_attempt: float
+    authentication_failed: bool
+    # Set once the server accepted (001) or refused (NOTICE) the OAuth key
+    authentication_answered: threading.Event
+
+    def __init__(self):
+        self.connection = None
+        self.channels = set()
+        self.last_received = time.monotonic()
+        self.last_probe = 0
+        self.needs_reconnection = False
+        self.failed_attempts = 0
+        self.next_attempt = 0
+        self.authentication_failed = False
+        self.authentication_answered = threading.Event()
+
+
+# Shared Twitch IRC engine. Channels are spread over a small pool of connections (channels_per_connection each) and the
+# incoming messages are routed to the Pomodorotteux of their channel. A single outbound queue, a single liveness thread
+# and a single set of UsersWorkers (configured by the config of the engine) serve every channel. With metrics, a
+# reporting thread also publishes them every metrics_interval seconds.
+# A supervisor thread reopens the connections which are lost, asked to by the server (RECONNECT) or silent for too long,
+# then authenticates and joins their channels again. The users of the channels and the outbound queue are left as they
+# are, the chat messages of a channel wait for its connection to be back.
+class PomodorotteuxEngine:
+    _config: TwitchConfigurationInternal
+    _outbound_messages: OutboundMessageQueue
+    _metrics: Union[PomodoroMetrics, None]
+    _users_workers: Union[UsersWorkers, None]
+
+    number_of_reconnections: int
+
+    def __init__(self, config: TwitchConfigurationInternal, metrics: Union[PomodoroMetrics, None] = None):
+        self._config = config
+        self._metrics = metrics
+        self._users_workers = None
+        self.number_of_reconnections = 0
+
+        self._lock = threading.Lock()
+        self._connections = []
+        self._connection_of_channel = {}
+        self._channels = {}
+        # Twitch allows 20 JOIN per 10 seconds
+        self._join_rate_limiter = SlidingWindowLimiter(20, 10)
+
+        self._outbound_messages = OutboundMessageQueue(
+            self._send_chat_message,
+            can_send=self._can_send_chat_message,
+            messages_per_period=self._config.chat_messages_per_period,
+            period=self._config.chat_rate_period,
+        )
+
+        self._keep_running = True
+        self._liveness_changed = threading.Event()
+        self._liveness_thread = threading.Thread(target=self._ping_connected_users, daemon=True)
+        self._liveness_thread.start()
+        self._supervision_needed = threading.Event()
+        self._supervisor_thread = threading.Thread(target=self._supervise_connections, daemon=True)
+        self._supervisor_thread.start()
+
+        self._closing = threading.Event()
+        self._metrics_thread = None
+        if self._metrics is not None:
+            self._metrics_thread = threading.Thread(target=self._report_metrics_periodically, daemon=True)
+            self._metrics_thread.start()
+
+    @property
+    def outbound_messages(self) -> OutboundMessageQueue:
+        return self._outbound_messages
+
+    @property
+    def metrics(self) -> Union[PomodoroMetrics, None]:
+        return self._metrics
+
+    @property
+    def channels(self) -> list:
+        return list(self._channels)
+
+    @property
+    def users_workers(self) -> UsersWorkers:
+        # Created for the first channel sharing the engine
+        with self._lock:
+            if self._users_workers is None:
+                self._users_workers = UsersWorkers(self._config, self._metrics)
+            return self._users_workers
+
+    def join_channel(self, pomodorotteux):
+        channel_name = pomodorotteux.channel_name
+        with self._lock:
+            pooled = next(
+                (c for c in self._connections if len(c.channels) < self._config.channels_per_connection), None
+            )
+            if pooled is None:
+                pooled = self._open_connection()
+            pooled.channels.add(channel_name)
+            self._connection_of_channel[channel_name] = pooled
+            self._channels[channel_name] = pomodorotteux
+
+        time.sleep(self._join_rate_limiter.time_until_available())
+        self._join_rate_limiter.try_consume()
+        pooled.connection.send(f"JOIN #{channel_name}")
+        self._liveness_changed.set()
+
+        # A refused OAuth key only shows once connected, the join fails then rather than leaving a bot which never works
+        if not pooled.authentication_answered.wait(_AUTHENTICATION_TIMEOUT):
+            raise TimeoutError(f"Twitch did not answer the authentication within {_AUTHENTICATION_TIMEOUT} seconds")
+        if pooled.authentication_failed:
+            raise ConnectionError(_AUTHENTICATION_FAILED_MESSAGE)
+
+    def part_channel(self, channel_name: str):
+        self._outbound_messages.clear(channel_name)
+        with self._lock:
+            self._channels.pop(channel_name, None)
+            pooled = self._connection_of_channel.pop(channel_name, None)
+            if pooled is None:
+                return
+            pooled.channels.discard(channel_name)
+            pooled.connection.send(f"PART #{channel_name}")
+            if not pooled.channels:
+                # Nothing left to listen to on this connection
+                self._connections.remove(pooled)
+                pooled.connection.close()
+
+    def post_message(self, channel_name: str, message: str):
+        self._outbound_messages.post(channel_name, message)
+
+    def post_grouped_message(self, channel_name: str, group: str, name: str, formatter: Callable):
+        self._outbound_messages.post_grouped(channel_name, group, name, formatter)
+
+    def close(self):
+        self._closing.set()
+        if self._metrics_thread is not None:
+            self._metrics_thread.join()
+            # The final state (e.g. the last save), while the channels are still there
+            self.report_metrics()
+
+        for channel_name in self.channels:
+            self.part_channel(channel_name)
+        with self._lock:
+            self._keep_running = False
+        self._liveness_changed.set()
+        self._supervision_needed.set()
+        self._outbound_messages.stop()
+        if self._users_workers is not None:
+            self._users_workers.close()
+
+    def report_metrics(self):
+        # Samples the gauges, then hands the metrics to the Prometheus file and to the callbacks of the channels
+        if self._metrics is None:
+            return
+        self._metrics.outbound_queue_depth = self._outbound_messages.depth
+        channels = list(self._channels.values())
+        for pomodorotteux in channels:
+            self._metrics.connected_users[pomodorotteux.channel_name] = pomodorotteux.number_of_connected_users
+
+        if self._config.metrics_file_path is not None:
+            self._metrics.write_prometheus_file(self._config.metrics_file_path)
+        for pomodorotteux in channels:
+            pomodorotteux.report_metrics(self._metrics)
+
+    def _open_connection(self) -> _PooledConnection:
+        pooled = _PooledConnection()
+        pooled.connection = self._connect(pooled)
+        self._connections.append(pooled)
+        return pooled
+
+    def _connect(self, pooled: _PooledConnection) -> IrcConnection:
+        connection = IrcConnection(
+            self._config.irc_server_address,
+            self._config.irc_port,
+            partial(self._twitch_callback, pooled),
+            partial(self._connection_lost, pooled),
+        )
+        connection.connect()
+        # The tags (user-id, display-name...) and the commands (RECONNECT, NOTICE...) are always useful, the membership
+        # (JOIN/PART/NAMES of the other users) only if the presence comes from it
+        capabilities = "twitch.tv/tags twitch.tv/commands"
+        if self._config.presence_from_membership:
+            capabilities += " twitch.tv/membership"
+        connection.send(f"CAP REQ :{capabilities}")
+        connection.send(f"PASS {self._config.oauth_key}")
+        connection.send(f"NICK {self._config.nickname}")
+        return connection
+
+    def _can_send_chat_message(self, channel_name: str) -> bool:
+        # Called by the outbound writer, the messages of a channel whose connection is down are kept until the
+        # reconnection wakes it, without holding back the other channels. Those that would be dropped are sendable.
+        pooled = self._connection_of_channel.get(channel_name)
+        if pooled is None or pooled.authentication_failed or not self._keep_running:
+            return True
+        return not pooled.needs_reconnection and pooled.connection.is_connected
+
+    def _send_chat_message(self, channel_name: str, message: str):
+        with self._lock:
+            pooled = self._connection_of_channel.get(channel_name)
+            if pooled is None or pooled.authentication_failed or not self._keep_running:
+                return
+        pooled.connection.send(f"PRIVMSG #{channel_name} :{message}")
+
+    def _connection_lost(self, pooled: _PooledConnection):
+        # Called from the connection thread, it only flags the connection for the supervisor
+        if pooled.needs_reconnection:
+            return
+        pooled.next_attempt = time.monotonic() + self._reconnection_delay(0)
+        pooled.needs_reconnection = True
+        self._supervision_needed.set()
+
+    def _reconnection_delay(self, failed_attempts: int) -> float:
+        # Exponential backoff with full jitter, so the connections (and the other bots after a Twitch outage) do not
+        # all come back at the same time
+        delay = min(self._config.reconnect_initial_delay * 2**failed_attempts, self._config.reconnect_max_delay)
+        return random.uniform(0, delay)
+
+    def _supervise_connections(self):
+        while self._keep_running:
+            self._supervision_needed.clear()
+            timeout = self._config.server_silence_timeout
+            with self._lock:
+                connections = list(self._connections)
+            for pooled in connections:
+                if not self._keep_running:
+                    return
+                wait = self._check_connection(pooled)
+                if wait is not None:
+                    timeout = min(timeout, wait)
+            self._supervision_needed.wait(timeout)
+
+    def _check_connection(self, pooled: _PooledConnection) -> Union[float, None]:
+        # Returns the seconds until the connection has to be checked again (None if never)
+        if pooled.authentication_failed:
+            # Another attempt would fail the same way
+            return None
+
+        now = time.monotonic()
+        if not pooled.needs_reconnection:
+            silence = now - pooled.last_received
+            if silence < self._config.server_silence_timeout:
+                return self._config.server_silence_timeout - silence
+            if pooled.last_probe < pooled.last_received:
+                # Any answer (the PONG or anything else) shows the connection is still alive
+                pooled.last_probe = now
+                pooled.connection.send("PING :tmi.twitch.tv")
+                return _PING_REPLY_TIMEOUT
+            if now - pooled.last_probe < _PING_REPLY_TIMEOUT:
+                return _PING_REPLY_TIMEOUT - (now - pooled.last_probe)
+            self._connection_lost(pooled)
+
+        if now < pooled.next_attempt:
+            return pooled.next_attempt - now
+        self._reconnect(pooled)
+        return 0 if pooled.needs_reconnection else None
+
+    def _reconnect(self, pooled: _PooledConnection):
+        try:
+            pooled.connection.close()
+            connection = self._connect(pooled)
+        except Exception as e:
+            # Server unreachable or timed out (concurrent.futures.TimeoutError is no OSError before Python 3.11), tried
+            # again later. Nothing may escape, the supervisor thread would end
+            _logger.warning("Reconnecting to Twitch failed: %r", e)
+            pooled.failed_attempts += 1
+            pooled.next_attempt = time.monotonic() + self._reconnection_delay(pooled.failed_attempts)
+            return
+
+        with self._lock:
+            is_used = pooled in self._connections and self._keep_running
+            if is_used:
+                pooled.connection = connection
+                pooled.last_received = time.monotonic()
+                pooled.needs_reconnection = False
+                pooled.failed_attempts = 0
+                channel_names = list(pooled.channels)
+        if not is_used:
+            # Its channels were parted meanwhile
+            connection.close()
+            return
+        self._outbound_messages.wake()
+
+        self.number_of_reconnections += 1
+        if self._metrics is not None:
+            self._metrics.irc_reconnections.inc()
+        for channel_name in channel_names:
+            pomodorotteux = self._channels.get(channel_name)
+            if pomodorotteux is not None:
+                pomodorotteux.handle_reconnection()
+            time.sleep(self._join_rate_limiter.time_until_available())
+            self._join_rate_limiter.try_consume()
+            connection.send(f"JOIN #{channel_name}")
+
+    def _ping_connected_users(self):
+        while self._keep_running:
+            self._liveness_changed.clear()
+            timeout = None
+            for pomodorotteux in list(self._channels.values()):
+                if pomodorotteux.ping_time <= 0:
+                    continue
+                next_deadline = pomodorotteux.check_if_users_are_alive()
+                # Users connecting meanwhile are due after everyone already scheduled, so waiting for the earliest
+                # deadline (or a full ping time if no one is connected) never makes a disconnection late
+                wait = pomodorotteux.ping_time if next_deadline is None else max(next_deadline - time.time(), 0)
+                timeout = wait if timeout is None else min(timeout, wait)
+            self._liveness_changed.wait(timeout)
+
+    def _report_metrics_periodically(self):
+        while not self._closing.wait(self._config.metrics_interval):
+            self.report_metrics()
+
+    def _twitch_callback(self, pooled: _PooledConnection, irc_message: str):
+        # Called by the IRC connections for each complete line received
+        pooled.last_received = time.monotonic()
+        if self._metrics is None:
+            message = parse_irc_message(irc_message)
+        else:
+            start = time.perf_counter()
+            message = parse_irc_message(irc_message)
+            self._metrics.irc_parse_seconds.observe(time.perf_counter() - start)
+            self._metrics.irc_lines_received.inc()
+            # The line without its \r\n
+            self._metrics.irc_bytes_received.inc(len(irc_message.encode()) + 2)
+
+        # Keep liaison alive
+        if message.command == "PING":
+            pooled.connection.send(f"PONG :{message.trailing}")
+        elif message.command == "RECONNECT":
+            # The server is about to restart
+            self._connection_lost(pooled)
+        elif message.command == "001":
+            pooled.authentication_answered.set()
+        elif message.command == "NOTICE" and message.trailing and "Login authentication failed" in message.trailing:
+            pooled.authentication_failed = True
+            pooled.authentication_answered.set()
+            raise ConnectionError(_AUTHENTICATION_FAILED_MESSAGE)
+        elif message.command == "PRIVMSG":
+            pomodorotteux = self._channels.get(message.channel)
+            if pomodorotteux is not None:
+                pomodorotteux.handle_chat_message(message)
+        elif message.command in ("JOIN", "PART", "353", "366"):
+            # 353 is the NAMES list sent after joining: <nick> = #<channel> :<names>, 366 its end: <nick> #<channel>
+            channel = message.channel if message.command in ("JOIN", "PART") else message.params[-1][1:]
+            pomodorotteux = self._channels.get(channel)
+            if pomodorotteux is not None:
+                pomodorotteux.handle_membership_message(message)
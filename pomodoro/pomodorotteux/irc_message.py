@@ -0,0 +1,112 @@
+from typing import Union
+
+
+_TAG_ESCAPES = {":": ";", "s": " ", "\\": "\\", "r": "\r", "n": "\n"}
+
+
+# Lightweight representation of one IRC line: [@tags] [:prefix] command [params...] [:trailing]
+# The IRCv3 tags are only split into a dict the first time they are accessed.
+class IrcMessage:
+    __slots__ = ("_raw_tags", "_tags", "prefix", "command", "params", "trailing")
+
+    prefix: Union[str, None]
+    command: str
+    params: list
+    trailing: Union[str, None]
+
+    def __init__(self, raw_tags, prefix, command, params, trailing):
+        self._raw_tags = raw_tags
+        self._tags = None
+        self.prefix = prefix
+        self.command = command
+        self.params = params
+        self.trailing = trailing
+
+    @property
+    def tags(self) -> Union[dict, None]:
+        if self._tags is None and self._raw_tags is not None:
+            self._tags = _parse_tags(self._raw_tags)
+        return self._tags
+
+    @property
+    def nickname(self) -> Union[str, None]:
+        # The prefix is nick!user@host for users and only the host for the server
+        if self.prefix is None:
+            return None
+        end = self.prefix.find("!")
+        return self.prefix if end < 0 else self.prefix[:end]
+
+    @property
+    def channel(self) -> Union[str, None]:
+        if self.params and self.params[0][:1] == "#":
+            return self.params[0][1:]
+        return None
+
+    def __repr__(self):
+        return (
+            f"IrcMessage(tags={self.tags}, prefix={self.prefix}, command={self.command}, "
+            f"params={self.params}, trailing={self.trailing})"
+        )
+
+
+def parse_irc_message(line: str) -> IrcMessage:
+    # Single left to right pass using find/slicing only, each part of the line is looked at once
+    position = 0
+    raw_tags = None
+    if line[:1] == "@":
+        end = line.find(" ")
+        if end < 0:
+            end = len(line)
+        raw_tags = line[1:end]
+        position = _skip_spaces(line, end)
+
+    prefix = None
+    if line[position : position + 1] == ":":
+        end = line.find(" ", position)
+        if end < 0:
+            end = len(line)
+        prefix = line[position + 1 : end]
+        position = _skip_spaces(line, end)
+
+    trailing = None
+    trailing_start = line.find(" :", position)
+    if trailing_start >= 0:
+        trailing = line[trailing_start + 2 :]
+        middle = line[position:trailing_start]
+    else:
+        middle = line[position:]
+
+    parts = middle.split()
+    command = parts[0].upper() if parts else ""
+    return IrcMessage(raw_tags, prefix, command, parts[1:], trailing)
+
+
+def _skip_spaces(line: str, position: int) -> int:
+    while position < len(line) and line[position] == " ":
+        position += 1
+    return position
+
+
+def _parse_tags(raw_tags: str) -> dict:
+    tags = {}
+    for tag in raw_tags.split(";"):
+        key, _, value = tag.partition("=")
+        if "\\" in value:
+            value = _unescape_tag_value(value)
+        tags[key] = value
+    return tags
+
+
+def _unescape_tag_value(value: str) -> str:
+    output = []
+    i = 0
+    while i < len(value):
+        character = value[i]
+        if character == "\\":
+            i += 1
+            if i < len(value):
+                output.append(_TAG_ESCAPES.get(value[i], value[i]))
+        else:
+            output.append(character)
+        i += 1
+    return "".join(output)
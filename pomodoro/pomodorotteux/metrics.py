@@ -0,0 +1,153 @@
+import bisect
+import os
+import threading
+from typing import Union
+
+
+# Upper bounds (seconds) of the duration histograms, from 10 us (parsing a line) to 10 s (saving a large database)
+DURATION_BUCKETS = (1e-5, 5e-5, 1e-4, 5e-4, 1e-3, 5e-3, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+
+
+class Counter:
+    value: float
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1):
+        with self._lock:
+            self.value += amount
+
+
+class Histogram:
+    buckets: tuple
+    counts: list
+    sum: float
+    count: int
+
+    def __init__(self, buckets: tuple = DURATION_BUCKETS):
+        self.buckets = buckets
+        # One more count for the values over the last bucket (+Inf)
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def cumulative_counts(self) -> list:
+        # Number of values under or equal each bucket, as Prometheus expects them
+        with self._lock:
+            counts = list(self.counts)
+        output = []
+        total = 0
+        for count in counts:
+            total += count
+            output.append(total)
+        return output
+
+
+# What the bot does under load. It is only created when metrics are requested (a metrics_update_callback in the
+# PomodoroCallbacks or a metrics_file_path in the configuration), otherwise everything measuring checks for None and
+# skips it. The gauges are sampled when the metrics are reported, so they cost nothing in between.
+class PomodoroMetrics:
+    irc_bytes_received: Counter
+    irc_lines_received: Counter
+    irc_parse_seconds: Histogram
+    irc_reconnections: Counter
+    callback_seconds: dict
+    callback_queue_seconds: dict
+    callbacks_dropped: Counter
+    save_database_seconds: Histogram
+    save_database_bytes: int
+    outbound_queue_depth: int
+    connected_users: dict
+
+    def __init__(self):
+        self.irc_bytes_received = Counter()
+        self.irc_lines_received = Counter()
+        self.irc_parse_seconds = Histogram()
+        self.irc_reconnections = Counter()
+        self.callback_seconds = {
+            "has_connected": Histogram(),
+            "disconnect_user": Histogram(),
+            "score_update": Histogram(),
+        }
+        # From the dispatch of a callback to its start
+        self.callback_queue_seconds = {name: Histogram() for name in self.callback_seconds}
+        self.callbacks_dropped = Counter()
+        self.save_database_seconds = Histogram()
+        self.save_database_bytes = 0
+        self.outbound_queue_depth = 0
+        # Per channel
+        self.connected_users = {}
+
+    def to_prometheus_text(self) -> str:
+        lines = []
+        _add_metric(lines, "pomodoro_irc_bytes_received_total", "counter", "Bytes received from the IRC server")
+        lines.append(f"pomodoro_irc_bytes_received_total {self.irc_bytes_received.value}")
+        _add_metric(lines, "pomodoro_irc_lines_received_total", "counter", "Lines received from the IRC server")
+        lines.append(f"pomodoro_irc_lines_received_total {self.irc_lines_received.value}")
+
+        _add_metric(lines, "pomodoro_irc_parse_seconds", "histogram", "Time spent parsing a line")
+        _add_histogram(lines, "pomodoro_irc_parse_seconds", self.irc_parse_seconds, "")
+        _add_metric(lines, "pomodoro_irc_reconnections_total", "counter", "Connections to the IRC server reopened")
+        lines.append(f"pomodoro_irc_reconnections_total {self.irc_reconnections.value}")
+        _add_metric(lines, "pomodoro_callback_seconds", "histogram", "Time spent in the PomodoroCallbacks")
+        for name, histogram in self.callback_seconds.items():
+            _add_histogram(lines, "pomodoro_callback_seconds", histogram, f'callback="{name}"')
+        _add_metric(lines, "pomodoro_callback_queue_seconds", "histogram", "Time the callbacks waited to be run")
+        for name, histogram in self.callback_queue_seconds.items():
+            _add_histogram(lines, "pomodoro_callback_queue_seconds", histogram, f'callback="{name}"')
+        _add_metric(lines, "pomodoro_callbacks_dropped_total", "counter", "Callbacks dropped as their queue was full")
+        lines.append(f"pomodoro_callbacks_dropped_total {self.callbacks_dropped.value}")
+
+        _add_metric(lines, "pomodoro_save_database_seconds", "histogram", "Time spent saving the database")
+        _add_histogram(lines, "pomodoro_save_database_seconds", self.save_database_seconds, "")
+        _add_metric(lines, "pomodoro_save_database_bytes", "gauge", "Size of the last database saved")
+        lines.append(f"pomodoro_save_database_bytes {self.save_database_bytes}")
+
+        _add_metric(lines, "pomodoro_outbound_queue_depth", "gauge", "Chat messages waiting to be sent")
+        lines.append(f"pomodoro_outbound_queue_depth {self.outbound_queue_depth}")
+        _add_metric(lines, "pomodoro_connected_users", "gauge", "Users currently connected")
+        for channel, number_of_users in list(self.connected_users.items()):
+            lines.append(f'pomodoro_connected_users{{channel="{_escape_label(channel)}"}} {number_of_users}')
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus_file(self, path: str):
+        # Written aside and swapped, so a scraper (e.g. node_exporter textfile collector) never reads half a file
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            file.write(self.to_prometheus_text())
+        os.replace(tmp_path, path)
+
+
+def _add_metric(lines: list, name: str, metric_type: str, description: str):
+    lines.append(f"# HELP {name} {description}")
+    lines.append(f"# TYPE {name} {metric_type}")
+
+
+def _add_histogram(lines: list, name: str, histogram: Histogram, labels: str):
+    separator = "," if labels else ""
+    bounds = [repr(float(bound)) for bound in histogram.buckets] + ["+Inf"]
+    for bound, count in zip(bounds, histogram.cumulative_counts()):
+        lines.append(f'{name}_bucket{{{labels}{separator}le="{bound}"}} {count}')
+    suffix = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{suffix} {histogram.sum}")
+    lines.append(f"{name}_count{suffix} {histogram.count}")
+
+
+def _escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def create_metrics(config, callbacks) -> Union[PomodoroMetrics, None]:
+    if config.metrics_file_path is None and callbacks.metrics_update_callback is None:
+        return None
+    return PomodoroMetrics()
@@ -1,12 +1,25 @@
-from typing import Callable
+from typing import Callable, Union
 
 
 class PomodoroCallbacks:
+    # The users they receive are read-only snapshots (PomodoroUserSnapshot by name), of the user concerned for
+    # has_connected(name, users) and has_disconnected(name, users), of everyone connected since the start for
+    # score_update(users)
     has_connected_callback: Callable
     disconnect_user_callback: Callable
     score_update_callback: Callable
+    # Optional, receives the PomodoroMetrics every metrics_interval seconds (the metrics are only collected if it is set
+    # or if the configuration has a metrics_file_path)
+    metrics_update_callback: Union[Callable, None]
+    # Optional, for a BackgroundPomodorotteux: called without argument once connected and loaded, or with the exception
+    # which prevented it
+    ready_callback: Union[Callable, None]
+    failure_callback: Union[Callable, None]
 
-    def __init__(self, has_connected, has_disconnected, score_update):
+    def __init__(self, has_connected, has_disconnected, score_update, metrics_update=None, ready=None, failure=None):
         self.has_connected_callback = has_connected
         self.disconnect_user_callback = has_disconnected
         self.score_update_callback = score_update
+        self.metrics_update_callback = metrics_update
+        self.ready_callback = ready
+        self.failure_callback = failure
@@ -1,11 +1,24 @@
+import bisect
+import heapq
+import itertools
 import os
 import pickle
 import time
-from typing import Union
-from copy import deepcopy
+from functools import partial
+from types import MappingProxyType
+from typing import BinaryIO, Callable, NamedTuple, Union
 
+from .binary_snapshot import BinarySnapshot, LazySnapshotUsers
+from .callback_dispatcher import CallbackDispatcher
+from .columnar_users import ColumnarUsers, PomodoroUserView
+from .command_loop import CommandLoop
 from .configuration import TwitchConfigurationInternal
+from .database_journal import DatabaseJournal
+from .database_persister import DatabasePersister
+from .database_sqlite import SqliteDatabase
+from .metrics import PomodoroMetrics
 from .pomodoro_callbacks import PomodoroCallbacks
+from .tomato_history import TomatoHistory
 
 
 class PomodoroUser:
@@ -36,87 +49,656 @@ class PomodoroUser:
         self.last_time_interacted = 0
 
 
+# Read-only copy of a user handed to the callbacks, which run on another thread than the one modifying the users
+class PomodoroUserSnapshot(NamedTuple):
+    pseudo: str
+    is_connected: bool
+    initial_number_of_tomatoes: int
+    number_of_tomato_done: int
+
+    @property
+    def total_number_of_tomatoes(self):
+        return self.initial_number_of_tomatoes + self.number_of_tomato_done
+
+
+# Pickles users as they are saved in the database, compiled and disconnected, reading that state from the live users
+# while they are written instead of transforming a copy of them
+class CompiledUsersPickler(pickle.Pickler):
+    def reducer_override(self, obj):
+        if not isinstance(obj, (PomodoroUser, PomodoroUserView)):
+            return NotImplemented
+
+        # Same state as a PomodoroUser after compile_tomatoes() then disconnect(), the views are saved as PomodoroUser
+        state = {
+            "pseudo": obj.pseudo,
+            "initial_number_of_tomatoes": obj.total_number_of_tomatoes,
+            "is_connected": False,
+            "number_of_tomato_done": 0,
+            "last_time_interacted": 0,
+        }
+        return PomodoroUser, (), state
+
+
+def dump_compiled_users(users, file: BinaryIO):
+    # Only references are copied, as the IRC thread adding users would break iterating the live mapping. A user added
+    # after that is saved next time, a user modified meanwhile is saved with whichever of its values was read
+    names = list(users)
+    CompiledUsersPickler(file).dump({name: users[name] for name in names})
+
+
+# The users are modified from the IRC, liveness and OBS threads. Every modification is a command of a single
+# CommandLoop, so they all happen on its thread without locks: the IRC and OBS threads only queue them, the liveness
+# thread waits for its result. Readers of the leaderboard get the top published after the last commands, and the saves
+# read the live users (see dump_compiled_users). The callbacks are handed to a CallbackDispatcher, the score update once
+# per batch of commands, after the leaderboard it shows was published. They never get the live users but read-only
+# snapshots taken on the thread of the commands: the user concerned, or everyone connected since the database was loaded
+# for the score update. The loop, the dispatcher and the persister are the UsersWorkers, shared by the users of the
+# channels of one engine.
+_PUBLISHED_LEADERBOARD_SIZE = 100
+
+
+# The threads serving PomodoroUsers: the CommandLoop modifying them, the CallbackDispatcher running their callbacks and
+# the write-behind DatabasePersister (None if every change is saved right away). Channels served by one engine share
+# them (see PomodorotteuxEngine.users_workers), so the number of threads does not grow with the channels.
+class UsersWorkers:
+    commands: CommandLoop
+    callback_dispatcher: CallbackDispatcher
+    persister: Union[DatabasePersister, None]
+
+    def __init__(self, config: TwitchConfigurationInternal, metrics: Union[PomodoroMetrics, None] = None):
+        self.commands = CommandLoop(name="PomodoroUsers")
+        self.callback_dispatcher = CallbackDispatcher(
+            config.callback_queue_size, config.callback_overflow_policy, metrics
+        )
+        self.persister = None
+        if config.save_coalescing_window > 0:
+            self.persister = DatabasePersister(coalescing_window=config.save_coalescing_window)
+
+    def close(self):
+        # What is still queued is run, then the callbacks and the pending changes are written
+        self.commands.stop()
+        self.callback_dispatcher.stop()
+        if self.persister is not None:
+            self.persister.stop()
+
+
 class PomodoroUsers:
-    _users: dict
+    _users: Union[dict, ColumnarUsers, LazySnapshotUsers]
+    # Where the journal and sqlite modes write each change, None for the pickle mode which saves everything at once
+    _incremental_store: Union[DatabaseJournal, SqliteDatabase, None]
+    _persister: Union[DatabasePersister, None]
+    _flush_changes: Union[Callable, None]
+    _history: Union[TomatoHistory, None]
+    _metrics: Union[PomodoroMetrics, None]
+    _liveness_heap: list
+    _scheduled_names: set
+    _present_names: set
+    _keyed_by_user_id: bool
+    _leaderboard: list
+    _published_leaderboard: tuple
+    _workers: UsersWorkers
+    _owns_workers: bool
+    _commands: CommandLoop
+    _callback_dispatcher: CallbackDispatcher
+    _pending_score_update: Union[PomodoroCallbacks, None]
+    _tomatoes_version: int
+    _number_of_tomato_awards: int
+    _streaks: dict
+    _user_snapshots: dict
 
-    def __init__(self):
+    def __init__(self, workers: UsersWorkers, owns_workers: bool):
         self._users = {}
+        self._incremental_store = None
+        # The same function each time, so the changes are counted together when the persister is shared
+        self._flush_changes = None
+        self._history = None
+        self._metrics = None
+
+        # Connected users ordered by last interaction, so the ones about to expire are always on top
+        self._liveness_heap = []
+        self._scheduled_names = set()
+        # Connected because the IRC server says they are in the channel (JOIN/NAMES), until it says they left (PART).
+        # They are not disconnected for being silent, so they are not in the liveness heap
+        self._present_names = set()
+        # While a new NAMES list is awaited (after a reconnection), the present users it did not list yet. Those it
+        # never lists left during the outage
+        self._unconfirmed_present_names = None
+        # The names are then ids and the users are shown by their pseudo
+        self._keyed_by_user_id = False
+
+        # (-total_number_of_tomatoes, name) kept sorted, so the best users are first
+        self._leaderboard = []
+        self._published_leaderboard = ()
+        # Changed whenever a total of tomatoes does, so what is derived from them (e.g. chat replies) can be cached
+        self._tomatoes_version = 0
+        # name: (number of tomatoes in a row, award of the last one), only for the current process
+        self._number_of_tomato_awards = 0
+        self._streaks = {}
+        # name: PomodoroUserSnapshot of the users connected since the database was loaded, kept up to date
+        self._user_snapshots = {}
+
+        self._workers = workers
+        self._owns_workers = owns_workers
+        self._commands = workers.commands
+        self._callback_dispatcher = workers.callback_dispatcher
+        self._persister = workers.persister
+        self._pending_score_update = None
 
     @staticmethod
-    def load_database(config: TwitchConfigurationInternal, callbacks: PomodoroCallbacks):
+    def load_database(
+        config: TwitchConfigurationInternal,
+        callbacks: PomodoroCallbacks,
+        metrics: Union[PomodoroMetrics, None] = None,
+        workers: Union[UsersWorkers, None] = None,
+    ):
+        # workers are shared with other PomodoroUsers (which close them), the users have their own otherwise
+        owns_workers = workers is None
+        output = PomodoroUsers(UsersWorkers(config, metrics) if owns_workers else workers, owns_workers)
+        try:
+            output._load_database(config, callbacks, metrics)
+        except Exception:
+            # Nothing of a database which failed to load may keep running, the start can be tried again
+            output.close()
+            raise
+        return output
+
+    def _load_database(
+        self, config: TwitchConfigurationInternal, callbacks: PomodoroCallbacks, metrics: Union[PomodoroMetrics, None]
+    ):
         dir_path = os.path.dirname(config.database_path)
         if not os.path.exists(dir_path):
             os.mkdir(dir_path)
 
-        if not os.path.exists(config.database_path):
-            # Create a new database
-            output = PomodoroUsers()
-        else:
+        if config.database_mode == "journal":
+            # Load the snapshot and replay the events recorded since
+            self._incremental_store = DatabaseJournal(
+                config.database_path,
+                PomodoroUsers._apply_journal_record,
+                config.journal_compaction_threshold,
+                dump_users=dump_compiled_users,
+            )
+            self._users = self._incremental_store.replay()
+            for user in self._users:
+                self._users[user].disconnect()
+        elif config.database_mode == "sqlite":
+            self._incremental_store = SqliteDatabase(SqliteDatabase.path_from_database_path(config.database_path))
+            if self._incremental_store.is_new and os.path.exists(config.database_path):
+                # First start after switching from the pickle database
+                self._incremental_store.migrate_from_pickle(config.database_path)
+            totals = self._incremental_store.load_totals()
+            self._users = {
+                name: PomodoroUser(_pseudo=name, _initial_number_of_tomatoes=total) for name, total in totals.items()
+            }
+        elif config.database_mode == "binary":
+            # Only the header is read now, the users are read from the mapped snapshot when they show up
+            snapshot_path = BinarySnapshot.path_from_database_path(config.database_path)
+            if not os.path.exists(snapshot_path) and os.path.exists(config.database_path):
+                # First start after switching from the pickle database
+                with open(config.database_path, "rb") as file:
+                    users = pickle.load(file)
+                BinarySnapshot.write(snapshot_path, {name: users[name].total_number_of_tomatoes for name in users})
+            self._users = LazySnapshotUsers(BinarySnapshot(snapshot_path), PomodoroUser, self._on_user_loaded)
+        elif os.path.exists(config.database_path):
             with open(config.database_path, "rb") as file:
-                # Load an existing database
-                output = PomodoroUsers()
-                output._users = pickle.load(file)
-                for user in output._users:
-                    output._users[user].disconnect()
-        callbacks.score_update_callback(output._users)
+                # Load an existing database (otherwise a new one is created)
+                self._users = pickle.load(file)
+                for user in self._users:
+                    self._users[user].disconnect()
+        if config.tomato_history:
+            self._history = TomatoHistory(TomatoHistory.path_from_database_path(config.database_path))
+        self._metrics = metrics
+        self._keyed_by_user_id = config.user_key == "user_id"
+        if config.user_store == "columnar":
+            self._users = ColumnarUsers.from_users(self._users)
+        if not isinstance(self._users, LazySnapshotUsers):
+            self._rebuild_leaderboard()
+        self._request_score_update(callbacks)
 
         # Do a backup of the database just to make sure
-        output.save_database(config, False)
-        return output
+        if isinstance(self._incremental_store, SqliteDatabase):
+            self._incremental_store.backup()
+        elif isinstance(self._users, LazySnapshotUsers):
+            self._users.start_backup()
+        else:
+            self.save_database(config, False)
+        self._flush_changes = partial(self._write_pending_changes, config)
+
+    @property
+    def persister(self) -> Union[DatabasePersister, None]:
+        return self._persister
+
+    @property
+    def number_of_connected_users(self) -> int:
+        return self._commands.call(self._count_connected_users)
+
+    @property
+    def history(self) -> Union[TomatoHistory, None]:
+        return self._history
+
+    @property
+    def tomatoes_version(self) -> int:
+        return self._tomatoes_version
+
+    def post(self, function: Callable, *args):
+        # Runs function after the changes already queued, on the thread modifying the users (see user and streak)
+        self._commands.post(function, *args)
+
+    def user(self, name) -> Union[PomodoroUser, PomodoroUserView, None]:
+        # Consistent when called from that thread only
+        return self._users.get(name)
+
+    def streak(self, name) -> int:
+        # Tomatoes in a row up to the last one awarded, 0 if the user missed it
+        streak, last_award = self._streaks.get(name, (0, 0))
+        return streak if last_award == self._number_of_tomato_awards else 0
+
+    def close(self):
+        # Runs what is still queued, the commands (and callbacks) after that run on the calling thread unless the
+        # workers are shared. Then the pending changes are written and the files are closed, nothing is left running
+        if self._owns_workers:
+            self._workers.close()
+        else:
+            # The workers keep serving the other channels
+            self.wait_for_pending_changes()
+            if self._persister is not None:
+                self._persister.flush()
+        if self._history is not None:
+            self._history.close()
+        if self._incremental_store is not None:
+            self._incremental_store.close()
+        if isinstance(self._users, LazySnapshotUsers):
+            self._users.close()
+
+    def leaderboard(self, top_n: int = None) -> list:
+        # The (name, total_number_of_tomatoes) of the top_n best users (everyone if top_n is None)
+        if isinstance(self._incremental_store, SqliteDatabase):
+            return self._incremental_store.leaderboard(top_n)
+        if self._commands.in_loop:
+            # From a callback, the commands before it must be seen
+            return self._compute_leaderboard(top_n)
+        if top_n is not None and top_n <= _PUBLISHED_LEADERBOARD_SIZE:
+            return list(self._published_leaderboard[:top_n])
+        return self._commands.call(self._compute_leaderboard, top_n)
+
+    def _compute_leaderboard(self, top_n: Union[int, None]) -> list:
+        if isinstance(self._users, LazySnapshotUsers):
+            # Only the loaded users are in the sorted list, the others come from the snapshot ranking
+            merged = heapq.merge(self._leaderboard, self._users.snapshot_ranking())
+            entries = list(itertools.islice(merged, top_n))
+        else:
+            entries = self._leaderboard if top_n is None else self._leaderboard[:top_n]
+        if self._keyed_by_user_id:
+            return [(self._users[name].pseudo, -negative_total) for negative_total, name in entries]
+        return [(name, -negative_total) for negative_total, name in entries]
 
     def save_database(self, config: TwitchConfigurationInternal, is_backup: bool = False):
-        # Move the tomato from done today to initial
-        users = deepcopy(self._users)
-        for user in users:
-            users[user].compile_tomatoes()
-            users[user].disconnect()
+        # After the changes already queued, a checkpoint of the journal never falls between a change and its record
+        self._commands.call(self._save_database_and_measure, config, is_backup)
+
+    def _save_database_and_measure(self, config: TwitchConfigurationInternal, is_backup: bool):
+        if self._metrics is None:
+            self._save_database(config, is_backup)
+            return
+
+        start = time.perf_counter()
+        saved_path = self._save_database(config, is_backup)
+        self._metrics.save_database_seconds.observe(time.perf_counter() - start)
+        self._metrics.save_database_bytes = os.path.getsize(saved_path)
+
+    def _save_database(self, config: TwitchConfigurationInternal, is_backup: bool) -> str:
+        # Returns the path of the file written
+        if config.database_mode == "binary":
+            return self._save_binary_snapshot(config, is_backup)
+
+        # The tomatoes done today are moved to initial while the live users are written, see CompiledUsersPickler
+        if self._incremental_store is not None and not is_backup:
+            # A full save folds the journal into the snapshot (or rewrites the sqlite table)
+            self._incremental_store.checkpoint(self._users)
+            if isinstance(self._incremental_store, SqliteDatabase):
+                return SqliteDatabase.path_from_database_path(config.database_path)
+            return config.database_path
 
         database_path = config.database_path + (".bak" if is_backup else "")
         with open(database_path, "wb") as file:
-            pickle.dump(users, file)
+            dump_compiled_users(self._users, file)
+        return database_path
+
+    def _save_binary_snapshot(self, config: TwitchConfigurationInternal, is_backup: bool) -> str:
+        if isinstance(self._users, LazySnapshotUsers) and not is_backup:
+            # The changes since the mapped snapshot, which is only rewritten once in a while
+            return self._users.save()
+        if isinstance(self._users, LazySnapshotUsers):
+            totals = self._users.compiled_totals()
+        else:
+            totals = {name: user.total_number_of_tomatoes for name, user in list(self._users.items())}
+        snapshot_path = BinarySnapshot.path_from_database_path(config.database_path)
+        if is_backup:
+            BinarySnapshot.write(snapshot_path + ".bak", totals)
+            return snapshot_path + ".bak"
 
-    def declare_user_interaction(self, name, config: TwitchConfigurationInternal, callbacks: PomodoroCallbacks):
-        if name not in list(self._users.keys()):
-            self._users[name] = PomodoroUser(_pseudo=name)
+        # Cleared, the overlay of the previous snapshot goes with it
+        overlay_path = LazySnapshotUsers.overlay_path_from_snapshot_path(snapshot_path)
+        BinarySnapshot.write(overlay_path, totals)
+        BinarySnapshot.write(snapshot_path, totals)
+        os.remove(overlay_path)
+        return snapshot_path
+
+    def declare_user_interaction(
+        self,
+        name,
+        config: TwitchConfigurationInternal,
+        callbacks: PomodoroCallbacks,
+        pseudo: str = None,
+        login: str = None,
+    ):
+        # pseudo is the name to show if the users are not keyed by their name. login is the key of the user before the
+        # users were keyed by id, its record then moves to the id the first time it is seen
+        self._commands.post(self._declare_user_interaction, name, config, callbacks, pseudo, login)
+
+    def declare_presence(self, name, config: TwitchConfigurationInternal, callbacks: PomodoroCallbacks):
+        self._commands.post(self._declare_presence, name, config, callbacks)
+
+    def declare_departure(self, name, callbacks: PomodoroCallbacks):
+        self._commands.post(self._declare_departure, name, callbacks)
+
+    def begin_presence_refresh(self):
+        # A new NAMES list is coming, see end_presence_refresh
+        self._commands.post(self._begin_presence_refresh)
+
+    def end_presence_refresh(self, callbacks: PomodoroCallbacks):
+        # The NAMES list is complete, the present users it did not list are gone
+        self._commands.post(self._end_presence_refresh, callbacks)
+
+    def add_tomato_to_connected_users(self, config: TwitchConfigurationInternal, callbacks: PomodoroCallbacks):
+        self._commands.post(self._add_tomato_to_connected_users, config, callbacks)
+
+    def check_if_users_are_alive(self, max_ping_time: float, callbacks: PomodoroCallbacks) -> Union[float, None]:
+        # Returns when the next user will be due (None if no one is connected)
+        return self._commands.call(self._check_if_users_are_alive, max_ping_time, callbacks)
+
+    def disconnect_user(self, name, callbacks: Union[PomodoroCallbacks, None]):
+        self._commands.post(self._disconnect_user, name, callbacks)
+
+    def disconnect_all_users(self):
+        # Queued like the other changes, the persister writes the session which ends
+        self._commands.post(self._disconnect_all_users)
+
+    def clear_database(self):
+        self._commands.call(self._clear_database)
+
+    def wait_for_pending_changes(self):
+        # The changes and their callbacks
+        self._commands.wait_for_pending_commands()
+        self._callback_dispatcher.wait_until_idle()
+
+    def flush_database(self):
+        # What was queued before is saved too
+        self._commands.wait_for_pending_commands()
+        if self._persister is not None:
+            self._persister.flush()
+
+    def _declare_user_interaction(
+        self,
+        name,
+        config: TwitchConfigurationInternal,
+        callbacks: PomodoroCallbacks,
+        pseudo: Union[str, None],
+        login: Union[str, None],
+    ):
+        if login is not None and name not in self._users and login in self._users and login != name:
+            self._move_user(login, name)
+        self._connect_user(name, config, callbacks, pseudo)
+        self._users[name].last_time_interacted = time.time()
+        if name not in self._scheduled_names and name not in self._present_names:
+            self._schedule_liveness_check(name)
+
+    def _declare_presence(self, name, config: TwitchConfigurationInternal, callbacks: PomodoroCallbacks):
+        self._present_names.add(name)
+        if self._unconfirmed_present_names is not None:
+            self._unconfirmed_present_names.discard(name)
+        self._connect_user(name, config, callbacks, None)
+
+    def _declare_departure(self, name, callbacks: PomodoroCallbacks):
+        self._present_names.discard(name)
+        if name in self._users:
+            self._disconnect_user(name, callbacks)
+
+    def _begin_presence_refresh(self):
+        self._unconfirmed_present_names = set(self._present_names)
+
+    def _end_presence_refresh(self, callbacks: PomodoroCallbacks):
+        if self._unconfirmed_present_names is None:
+            # The NAMES list of a first JOIN
+            return
+        names, self._unconfirmed_present_names = self._unconfirmed_present_names, None
+        for name in names:
+            self._declare_departure(name, callbacks)
+
+    def _connect_user(
+        self, name, config: TwitchConfigurationInternal, callbacks: PomodoroCallbacks, pseudo: Union[str, None]
+    ):
+        is_renamed = False
+        if name not in self._users:
+            self._users[name] = PomodoroUser(_pseudo=name if pseudo is None else pseudo)
+            bisect.insort(self._leaderboard, (0, name))
+        elif pseudo is not None and self._users[name].pseudo != pseudo:
+            self._users[name].pseudo = pseudo
+            is_renamed = True
+            if name in self._user_snapshots:
+                self._take_user_snapshot(name)
+            # The leaderboard shows the pseudo
+            self._commands.run_when_idle(self._on_commands_done)
 
         if not self._users[name].is_connected:
             self._users[name].is_connected = True
-            callbacks.has_connected_callback(name, self._users)
-            callbacks.score_update_callback(self._users)
-            self.save_database(config)
+            self._take_user_snapshot(name)
+            self._callback_dispatcher.dispatch(
+                "has_connected", callbacks.has_connected_callback, name, self._snapshot_of(name)
+            )
+            self._request_score_update(callbacks)
+            if self._incremental_store is not None:
+                self._incremental_store.record_connection(name, self._users[name].pseudo)
+            self._save_changes(config)
+        elif is_renamed:
+            # Renamed while connected, the connection record carries the new pseudo
+            if self._incremental_store is not None:
+                self._incremental_store.record_connection(name, pseudo)
+            self._save_changes(config)
 
-        self._users[name].last_time_interacted = time.time()
+    def _move_user(self, old_name, new_name):
+        # Keyed by new_name from now on, it is still disconnected (it was keyed by its login in an older database)
+        user = self._users.pop(old_name)
+        self._users[new_name] = user
+        index = bisect.bisect_left(self._leaderboard, (-user.total_number_of_tomatoes, old_name))
+        del self._leaderboard[index]
+        bisect.insort(self._leaderboard, (-user.total_number_of_tomatoes, new_name))
+        self._user_snapshots.pop(old_name, None)
+        self._streaks.pop(old_name, None)
+        if self._incremental_store is not None:
+            self._incremental_store.record_new_key(old_name, new_name)
 
-    def add_tomato_to_connected_users(self, config: TwitchConfigurationInternal, callbacks: PomodoroCallbacks):
-        for name in list(self._users):
-            if self._users[name].is_connected:
+    def _add_tomato_to_connected_users(self, config: TwitchConfigurationInternal, callbacks: PomodoroCallbacks):
+        if isinstance(self._users, ColumnarUsers):
+            names = self._users.add_tomato_to_connected_users()
+        else:
+            names = [name for name in self._connected_candidates() if self._users[name].is_connected]
+            for name in names:
                 self._users[name].number_of_tomato_done += 1
 
-        callbacks.score_update_callback(self._users)
-        self.save_database(config)
+        self._number_of_tomato_awards += 1
+        for name in names:
+            total = self._users[name].total_number_of_tomatoes
+            self._move_in_leaderboard(name, total - 1, total)
+            streak, last_award = self._streaks.get(name, (0, 0))
+            streak = streak + 1 if last_award == self._number_of_tomato_awards - 1 else 1
+            self._streaks[name] = (streak, self._number_of_tomato_awards)
+            self._take_user_snapshot(name)
+        self._tomatoes_version += 1
+
+        self._request_score_update(callbacks)
+        if self._incremental_store is not None:
+            self._incremental_store.record_tomatoes(names)
+        if self._history is not None:
+            self._history.record_tomatoes(names)
+        self._save_changes(config)
+
+    def _save_changes(self, config: TwitchConfigurationInternal):
+        if self._persister is not None:
+            self._persister.mark_dirty(self._flush_changes)
+        else:
+            self._write_pending_changes(config)
 
-    def check_if_users_are_alive(self, max_ping_time: float, callbacks: PomodoroCallbacks):
+    def _write_pending_changes(self, config: TwitchConfigurationInternal):
+        if self._history is not None:
+            self._history.flush()
+        if self._incremental_store is not None:
+            self._incremental_store.flush()
+        elif isinstance(self._users, LazySnapshotUsers):
+            # The snapshot is closed while it is replaced, it is only read from the thread of the commands
+            self._commands.call(self._save_database_and_measure, config, False)
+        else:
+            self._save_database_and_measure(config, False)
+
+    def _check_if_users_are_alive(self, max_ping_time: float, callbacks: PomodoroCallbacks) -> Union[float, None]:
+        # Only the users whose deadline is passed are looked at. Those which interacted since they were scheduled are
+        # pushed back with their new deadline
         current_time = time.time()
-        for name in self._users:
-            if not self._users[name].is_connected:
+        while self._liveness_heap and self._liveness_heap[0][0] + max_ping_time <= current_time:
+            _, name = heapq.heappop(self._liveness_heap)
+            self._scheduled_names.discard(name)
+            if name not in self._users or not self._users[name].is_connected or name in self._present_names:
                 continue
+
             if current_time - self._users[name].last_time_interacted > max_ping_time:
-                self.disconnect_user(name, callbacks)
+                self._disconnect_user(name, callbacks)
+            else:
+                self._schedule_liveness_check(name)
 
-    def disconnect_user(self, name, callbacks: Union[PomodoroCallbacks, None]):
+        return self._liveness_heap[0][0] + max_ping_time if self._liveness_heap else None
+
+    def _disconnect_user(self, name, callbacks: Union[PomodoroCallbacks, None]):
         if not self._users[name].is_connected:
             return
 
         self._users[name].disconnect()
+        self._take_user_snapshot(name)
         if callbacks is not None:
-            callbacks.disconnect_user_callback(name, self._users)
+            self._callback_dispatcher.dispatch(
+                "disconnect_user", callbacks.disconnect_user_callback, name, self._snapshot_of(name)
+            )
 
-    def disconnect_all_users(self):
-        for name in self._users:
-            self.disconnect_user(name, None)
+    def _disconnect_all_users(self):
+        # The users present in the channel stay connected: Twitch does not announce them again, they would only be back
+        # after leaving and joining the channel
+        if isinstance(self._users, ColumnarUsers) and not self._present_names:
+            names = [name for name in self._scheduled_names if name in self._users]
+            self._users.disconnect_all_users()
+            for name in names:
+                self._take_user_snapshot(name)
+        else:
+            for name in self._scheduled_names - self._present_names:
+                if name in self._users:
+                    self._disconnect_user(name, None)
+        self._liveness_heap = []
+        self._scheduled_names = set()
+        if self._history is not None:
+            # The end of a session
+            self._history.start_session()
 
-    def clear_database(self):
-        self._users = {}
+    def _request_score_update(self, callbacks: PomodoroCallbacks):
+        # Sent once the queued commands are done (right away when running outside the loop)
+        self._pending_score_update = callbacks
+        self._commands.run_when_idle(self._on_commands_done)
+
+    def _on_commands_done(self):
+        self._publish_leaderboard()
+        if self._pending_score_update is not None:
+            callbacks, self._pending_score_update = self._pending_score_update, None
+            self._callback_dispatcher.dispatch_latest(
+                "score_update",
+                callbacks.score_update_callback,
+                MappingProxyType(dict(self._user_snapshots)),
+                key=f"score_update {id(self)}",
+            )
+
+    def _count_connected_users(self) -> int:
+        if isinstance(self._users, ColumnarUsers):
+            return len(self._users.connected_rows)
+        return sum(1 for name in self._connected_candidates() if self._users[name].is_connected)
+
+    def _connected_candidates(self) -> set:
+        # Everyone connected is either in the liveness heap or present in the channel
+        return self._scheduled_names | self._present_names
+
+    def _take_user_snapshot(self, name):
+        user = self._users[name]
+        self._user_snapshots[name] = PomodoroUserSnapshot(
+            user.pseudo, user.is_connected, user.initial_number_of_tomatoes, user.number_of_tomato_done
+        )
+
+    def _snapshot_of(self, name) -> MappingProxyType:
+        # The users argument of the callbacks concerning a single user
+        return MappingProxyType({name: self._user_snapshots[name]})
+
+    def _publish_leaderboard(self):
+        # Replaced at once, so the readers always see a complete one
+        if not isinstance(self._incremental_store, SqliteDatabase):
+            self._published_leaderboard = tuple(self._compute_leaderboard(_PUBLISHED_LEADERBOARD_SIZE))
+
+    def _on_user_loaded(self, name, user: PomodoroUser):
+        bisect.insort(self._leaderboard, (-user.total_number_of_tomatoes, name))
+
+    def _rebuild_leaderboard(self):
+        self._leaderboard = sorted((-user.total_number_of_tomatoes, name) for name, user in self._users.items())
+
+    def _move_in_leaderboard(self, name, old_total: int, new_total: int):
+        index = bisect.bisect_left(self._leaderboard, (-old_total, name))
+        del self._leaderboard[index]
+        bisect.insort(self._leaderboard, (-new_total, name))
+
+    def _schedule_liveness_check(self, name):
+        heapq.heappush(self._liveness_heap, (self._users[name].last_time_interacted, name))
+        self._scheduled_names.add(name)
+
+    def _clear_database(self):
+        if isinstance(self._users, LazySnapshotUsers):
+            # Its files are replaced at the next save
+            self._users.close()
+        self._users = ColumnarUsers() if isinstance(self._users, ColumnarUsers) else {}
+        self._liveness_heap = []
+        self._scheduled_names = set()
+        self._present_names = set()
+        self._unconfirmed_present_names = None
+        self._leaderboard = []
+        self._streaks = {}
+        self._user_snapshots = {}
+        self._tomatoes_version += 1
+        self._commands.run_when_idle(self._on_commands_done)
+        if self._history is not None:
+            self._history.clear()
+        if self._incremental_store is not None:
+            self._incremental_store.record_clear()
+
+    @staticmethod
+    def _apply_journal_record(users: dict, record: dict):
+        if "connect" in record:
+            name = record["connect"]
+            if name not in users:
+                users[name] = PomodoroUser(_pseudo=record.get("pseudo", name))
+            elif "pseudo" in record:
+                # Renamed
+                users[name].pseudo = record["pseudo"]
+        elif "tomato" in record:
+            for name in record["tomato"]:
+                if name not in users:
+                    users[name] = PomodoroUser(_pseudo=name)
+                users[name].initial_number_of_tomatoes += 1
+        elif "rekey" in record:
+            old_name, new_name = record["rekey"]
+            if old_name in users and new_name not in users:
+                users[new_name] = users.pop(old_name)
+        elif "clear" in record:
+            users.clear()
 
     def __str__(self):
         return str(self._users)
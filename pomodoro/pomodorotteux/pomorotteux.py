@@ -1,27 +1,34 @@
-import time
-import socket
-import re
-import _thread
+from typing import Callable, Union
 
 from .configuration import TwitchConfigurationInternal
+from .chat_commands import ChatCommands, register_tomato_commands
+from .chat_queue import OutboundMessageQueue
+from .irc_engine import PomodorotteuxEngine
+from .irc_message import IrcMessage
+from .metrics import PomodoroMetrics, create_metrics
 from .pomodoro_user import PomodoroUsers
 from .pomodoro_callbacks import PomodoroCallbacks
+from .tomato_history import TomatoHistory
 
 
 class Pomodorotteux:
     _config: TwitchConfigurationInternal
 
     _ping_time: float
-    _irc_socket: socket
+    _engine: PomodorotteuxEngine
+    _owns_engine: bool
     _connexion_initialized: bool = False
 
     _users: PomodoroUsers
+    _user_id_of_login: dict
+    _chat_commands: Union[ChatCommands, None]
 
     def __init__(
         self,
         config: TwitchConfigurationInternal,
         callbacks: PomodoroCallbacks,
         ping_time: float = -1,
+        engine: Union[PomodorotteuxEngine, None] = None,
     ):
         self._config = config
 
@@ -29,82 +36,191 @@ class Pomodorotteux:
         self._keep_twitch_connection_alive = True
         self._ping_time = ping_time
         self._callbacks = callbacks
+        # Learned from the tags of the chat messages, the membership messages only have the login
+        self._user_id_of_login = {}
+
+        # The metrics belong to the engine, a shared engine decides for every channel
+        self._owns_engine = engine is None
+        metrics = create_metrics(self._config, self._callbacks) if engine is None else engine.metrics
+
+        # Database information, the users of the channels of a shared engine share its threads
+        workers = None if engine is None else engine.users_workers
+        self._users = PomodoroUsers.load_database(self._config, self._callbacks, metrics, workers)
+        self._chat_commands = None
+        if self._config.chat_commands:
+            self._chat_commands = ChatCommands(self._users, self.post_message, self._name_of_login)
+            register_tomato_commands(self._chat_commands)
+
+        # Twitch information, the engine can be shared with the Pomodorotteux of other channels
+        self._engine = None
+        try:
+            self._engine = PomodorotteuxEngine(self._config, metrics) if engine is None else engine
+            self._engine.join_channel(self)
+        except Exception:
+            # Nothing of a start which failed (e.g. Twitch unreachable) may keep running, it can be tried again
+            self._close_after_failed_start()
+            raise
+        self._connexion_initialized = True
 
-        # Database information
-        self._users = PomodoroUsers.load_database(self._config, self._callbacks)
-
-        # Twitch information
-        self._twitch_irc_connection()
+    def __del__(self):
+        if self._connexion_initialized and self._keep_twitch_connection_alive:
+            self._engine.part_channel(self.channel_name)
 
-        if self._ping_time > 0:
-            _thread.start_new_thread(self._ping_connected_users, ())
+    @property
+    def channel_name(self) -> str:
+        return self._config.channel_name.lower()
 
-    def __del__(self):
-        self._irc_send_data(f"PART {self._config.channel_name}")
+    @property
+    def ping_time(self) -> float:
+        return self._ping_time
 
     def save_database(self):
         self._users.save_database(self._config)
 
-    def end_session(self):
+    @property
+    def persister(self):
+        return self._users.persister
+
+    @property
+    def outbound_messages(self) -> OutboundMessageQueue:
+        return self._engine.outbound_messages
+
+    @property
+    def metrics(self) -> Union[PomodoroMetrics, None]:
+        return self._engine.metrics
+
+    @property
+    def history(self) -> Union[TomatoHistory, None]:
+        return self._users.history
+
+    @property
+    def chat_commands(self) -> Union[ChatCommands, None]:
+        # To register the commands of the application
+        return self._chat_commands
+
+    @property
+    def number_of_connected_users(self) -> int:
+        return self._users.number_of_connected_users
+
+    def report_metrics(self, metrics: PomodoroMetrics):
+        # Called by the engine every metrics_interval seconds
+        if self._callbacks.metrics_update_callback is not None:
+            self._callbacks.metrics_update_callback(metrics)
+
+    def leaderboard(self, top_n: int = None) -> list:
+        return self._users.leaderboard(top_n)
+
+    def disconnect_all_users(self):
+        # Ends a session but stays in the channel, so the next one neither reconnects to Twitch nor reloads the
+        # database. Never waits (e.g. for the disk), it is called from the OBS timer and buttons
         self._users.disconnect_all_users()
+
+    def flush_database(self):
+        # Waits for what was asked before (e.g. disconnect_all_users) and writes it
+        self._users.flush_database()
+
+    def end_session(self):
+        # Only once, the database is closed
+        if not self._keep_twitch_connection_alive:
+            return
+
+        self.disconnect_all_users()
+        self._users.flush_database()
+        self._users.close()
         self._keep_twitch_connection_alive = False
-        self._irc_send_data(f"PART {self._config.channel_name}", bypass_keep_alive=True)
+        if self._owns_engine:
+            self._engine.close()
+        else:
+            self._engine.part_channel(self.channel_name)
+
+    def _close_after_failed_start(self):
+        self._users.close()
+        if self._engine is None:
+            return
+        if self._owns_engine:
+            self._engine.close()
+        else:
+            self._engine.part_channel(self.channel_name)
 
     def clear_database(self):
         self._users.clear_database()
 
     def post_message(self, message):
-        self._irc_send_data(f"PRIVMSG #{self._config.channel_name} :{message}")
+        if self._keep_twitch_connection_alive:
+            self._engine.post_message(self.channel_name, message)
+
+    def post_grouped_message(self, group: str, name: str, formatter: Callable):
+        # Messages of the same group still waiting to be sent are merged, formatter receives the list of names
+        if self._keep_twitch_connection_alive:
+            self._engine.post_grouped_message(self.channel_name, group, name, formatter)
 
     def add_tomato_to_connected_users(self):
         self._users.add_tomato_to_connected_users(self._config, self._callbacks)
 
-    def _ping_connected_users(self):
-        while self._keep_twitch_connection_alive:
-            time.sleep(60)
-            self._users.check_if_users_are_alive(self._ping_time, self._callbacks)
-
-    def _irc_send_data(self, command, bypass_keep_alive: bool = False):
-        # The bypass is a kind of mutex
-        if self._connexion_initialized and self._keep_twitch_connection_alive or bypass_keep_alive:
-            self._irc_socket.send((command + "\n").encode())
-
-    def _twitch_irc_connection(self):
-        self._irc_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._irc_socket.connect((self._config.irc_server_address, self._config.irc_port))
-        self._connexion_initialized = True
-        self._irc_send_data(f"PASS {self._config.oauth_key}")
-        self._irc_send_data(f"NICK {self._config.nickname}")
-        self._irc_send_data(f"JOIN #{self._config.channel_name}")
-
-        _thread.start_new_thread(self._twitch_callback, ())
-
-    def _twitch_callback(self):
-        while self._keep_twitch_connection_alive:
-            time.sleep(1)
-            buffer = self._irc_socket.recv(2 ** 12)
-            irc_messages = buffer.decode().split("\r\n")
-            for irc_message in irc_messages:
-                # Keep liaison alive
-                if irc_message == "PING :tmi.twitch.tv":
-                    self._irc_send_data("PONG :tmi.twitch.tv")
+    def check_if_users_are_alive(self) -> Union[float, None]:
+        # Called by the liveness thread of the engine
+        return self._users.check_if_users_are_alive(self._ping_time, self._callbacks)
+
+    def handle_chat_message(self, message: IrcMessage):
+        # Called by the engine for each PRIVMSG of this channel
+        if not self._keep_twitch_connection_alive:
+            return
+
+        # Register the user if needed
+        sender_name = message.nickname
+        if not sender_name:
+            return
+        if self._config.user_key == "user_id":
+            tags = message.tags or {}
+            if "user-id" not in tags:
+                # Without the tags capability there is no id to key the user with
+                return
+            self._user_id_of_login[sender_name] = tags["user-id"]
+            name = tags["user-id"]
+            pseudo = tags.get("display-name") or sender_name
+            self._users.declare_user_interaction(name, self._config, self._callbacks, pseudo, sender_name)
+        else:
+            name = pseudo = sender_name
+            self._users.declare_user_interaction(name, self._config, self._callbacks)
+
+        if self._chat_commands is not None:
+            self._chat_commands.handle(name, pseudo, message.trailing)
+
+    def _name_of_login(self, login: str):
+        if self._config.user_key == "user_id":
+            # Users who never talked have no known id yet
+            return self._user_id_of_login.get(login)
+        return login
+
+    def handle_reconnection(self):
+        # Called by the engine before joining the channel again, who left meanwhile is only known from the new NAMES
+        if self._keep_twitch_connection_alive and self._config.presence_from_membership:
+            self._users.begin_presence_refresh()
+
+    def handle_membership_message(self, message: IrcMessage):
+        # Called by the engine for each JOIN, PART, NAMES (353) and end of NAMES (366) of this channel
+        if not self._keep_twitch_connection_alive or not self._config.presence_from_membership:
+            return
+        if message.command == "366":
+            self._users.end_presence_refresh(self._callbacks)
+            return
+
+        logins = message.trailing.split() if message.command == "353" else [message.nickname]
+        for login in logins:
+            if login == self._config.nickname.lower():
+                continue
+            if self._config.user_key == "user_id":
+                # Users who never talked have no known id yet, they are seen when they do
+                name = self._user_id_of_login.get(login)
+                if name is None:
                     continue
-                elif len(re.split(r"^.*(Login authentication failed).*$", irc_message)) == 3:
-                    raise ConnectionError(
-                        "Unable to connect to Twitch, need another OAuth key?\n"
-                        "Visit: https://twitchapps.com/tmi/#access_token=7ld7okcsiozvkrcjdwt3z9y31ajrzk&"
-                        "scope=chat%3Aread+chat%3Aedit+channel%3Amoderate+whispers%3Aread+whispers%3Aedit+"
-                        "channel_editor&token_type=bearer"
-                    )
-
-                # If we get another irc_message, check if it is an actual message
-                message_split = re.split(r"^:(.*)!.*@.*PRIVMSG.*#.*:(.*)$", irc_message)
-                sender_name = None if len(message_split) != 4 else message_split[1]
-                # message = None if len(message_split) != 4 else message_split[2]
-
-                # If it is a message, register the user if needed
-                if sender_name:
-                    self._users.declare_user_interaction(sender_name, self._config, self._callbacks)
+            else:
+                name = login
+
+            if message.command == "PART":
+                self._users.declare_departure(name, self._callbacks)
+            else:
+                self._users.declare_presence(name, self._config, self._callbacks)
 
     def __str__(self):
         return str(self._users)
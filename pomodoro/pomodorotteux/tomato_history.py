@@ -0,0 +1,416 @@
+import bisect
+import datetime
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from collections import defaultdict
+from itertools import compress, repeat
+from operator import eq
+from typing import Callable, Iterable, Union
+
+
+# Fixed layout of a chunk, little-endian:
+#   header:  magic, version, number of rows, first and last session timestamps
+#   columns: user indices (uint32), session timestamps (int64 seconds, never decreasing), tomatoes (uint16)
+_MAGIC = b"POMOHIST"
+_VERSION = 1
+_HEADER = struct.Struct("<8sIIqq")
+# A chunk holding that many rows is full, it is never written again
+_CHUNK_ROWS = 1 << 16
+_SECONDS_PER_DAY = 86400
+_EPOCH = datetime.date(1970, 1, 1)
+
+
+class _Chunk:
+    __slots__ = ("path", "number_of_rows", "first_time", "last_time", "columns", "day_totals", "user_totals")
+
+    path: str
+    number_of_rows: int
+    first_time: int
+    last_time: int
+    # (users, times, tomatoes), None until the chunk is read
+    columns: Union[tuple, None]
+    # Aggregates of a full chunk, computed once
+    day_totals: Union[dict, None]
+    user_totals: Union[dict, None]
+
+    def __init__(self, path: str):
+        self.path = path
+        self.number_of_rows = 0
+        self.first_time = 0
+        self.last_time = 0
+        self.columns = None
+        self.day_totals = None
+        self.user_totals = None
+
+    @property
+    def is_full(self) -> bool:
+        return self.number_of_rows >= _CHUNK_ROWS
+
+    @staticmethod
+    def open(path: str):
+        # Only the header is read
+        chunk = _Chunk(path)
+        with open(path, "rb") as file:
+            magic, version, chunk.number_of_rows, chunk.first_time, chunk.last_time = _HEADER.unpack(
+                file.read(_HEADER.size)
+            )
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"{path} is not a version {_VERSION} tomato history chunk")
+        return chunk
+
+    def load(self) -> tuple:
+        if self.columns is not None:
+            return self.columns
+
+        columns = (array("I"), array("q"), array("H"))
+        if self.number_of_rows > 0:
+            with open(self.path, "rb") as file:
+                data = file.read()
+            offset = _HEADER.size
+            for column in columns:
+                size = self.number_of_rows * column.itemsize
+                column.frombytes(data[offset : offset + size])
+                if sys.byteorder == "big":
+                    column.byteswap()
+                offset += size
+        self.columns = columns
+        return columns
+
+    def append(self, user: int, session_time: int, tomatoes: int):
+        users, times, tomatoes_column = self.load()
+        if self.number_of_rows == 0:
+            self.first_time = session_time
+        users.append(user)
+        times.append(session_time)
+        tomatoes_column.append(tomatoes)
+        self.last_time = session_time
+        self.number_of_rows += 1
+
+    def write(self):
+        # Written aside and swapped, a reader never sees half a chunk
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(_HEADER.pack(_MAGIC, _VERSION, self.number_of_rows, self.first_time, self.last_time))
+            for column in self.load():
+                if sys.byteorder == "big":
+                    column = array(column.typecode, column)
+                    column.byteswap()
+                file.write(column.tobytes())
+        os.replace(tmp_path, self.path)
+
+
+# Append-only history of the tomatoes: one (user, session timestamp, tomatoes) row per user and session, so the totals
+# of the users (which only keep today and all time) can be broken down by day, week or user. The rows are kept in
+# chunks of array columns, one file each: a full chunk never changes, so only the last one is rewritten when the rows
+# of a session are flushed, and the aggregates of the full chunks are computed once. The queries skip the chunks out of
+# their range and work on whole columns (bisect and sum on the sorted timestamps, compress to select a user), the
+# group-by of the users being the only loop over rows. The names are indexed in names.txt, one per line. The names and
+# the chunk headers are only read by the first record or query, opening a long history costs nothing.
+# The days are local days (utc_offset seconds from UTC) and the ranges of days include their start and end.
+class TomatoHistory:
+    path: str
+    utc_offset: int
+
+    def __init__(self, path: str, utc_offset: int = None, clock: Callable = time.time):
+        self.path = path
+        self.utc_offset = time.localtime().tm_gmtoff if utc_offset is None else utc_offset
+        self._clock = clock
+        self._lock = threading.Lock()
+
+        os.makedirs(path, exist_ok=True)
+        # None until read by _load_index
+        self._names = None
+        self._index_of_name = None
+        self._number_of_written_names = 0
+        self._chunks = None
+
+        # Tomatoes of the current session not written yet, by user index
+        self._pending_tomatoes = defaultdict(int)
+        self._session_time = self._next_session_time()
+
+    @staticmethod
+    def path_from_database_path(database_path: str) -> str:
+        return os.path.splitext(database_path)[0] + ".history"
+
+    @property
+    def number_of_rows(self) -> int:
+        with self._lock:
+            self._load_index()
+            return sum(chunk.number_of_rows for chunk in self._chunks)
+
+    @property
+    def names(self) -> list:
+        with self._lock:
+            self._load_index()
+            return list(self._names)
+
+    def record_tomatoes(self, names: Iterable):
+        # One tomato to each, counted in the current session
+        with self._lock:
+            self._load_index()
+            for name in names:
+                self._pending_tomatoes[self._index_of(name)] += 1
+
+    def start_session(self):
+        # The tomatoes recorded after that are in a new session
+        self.flush()
+        with self._lock:
+            self._session_time = self._next_session_time()
+
+    def flush(self):
+        with self._lock:
+            if not self._pending_tomatoes:
+                return
+            self._write_names()
+            changed_chunks = []
+            for user, tomatoes in sorted(self._pending_tomatoes.items()):
+                if not self._chunks or self._chunks[-1].is_full:
+                    self._chunks.append(_Chunk(os.path.join(self.path, f"chunk_{len(self._chunks):06d}.bin")))
+                chunk = self._chunks[-1]
+                chunk.append(user, self._session_time, tomatoes)
+                if not changed_chunks or changed_chunks[-1] is not chunk:
+                    changed_chunks.append(chunk)
+            for chunk in changed_chunks:
+                chunk.write()
+            # Further tomatoes of the session are new rows of the same session
+            self._pending_tomatoes = defaultdict(int)
+
+    def clear(self):
+        with self._lock:
+            for file in os.listdir(self.path):
+                os.remove(os.path.join(self.path, file))
+            self._names = []
+            self._index_of_name = {}
+            self._number_of_written_names = 0
+            self._chunks = []
+            self._pending_tomatoes = defaultdict(int)
+
+    def daily_totals(self, name=None, start: datetime.date = None, end: datetime.date = None) -> dict:
+        # date: tomatoes, for the days with tomatoes
+        totals = defaultdict(int)
+        for chunk, users, times, tomatoes in self._select(name, start, end):
+            if chunk is not None:
+                if chunk.day_totals is None:
+                    chunk.day_totals = self._sum_by_day(times, tomatoes)
+                day_totals = chunk.day_totals
+            else:
+                day_totals = self._sum_by_day(times, tomatoes)
+            for day, total in day_totals.items():
+                totals[day] += total
+        return {_date_of_day(day): totals[day] for day in sorted(totals)}
+
+    def weekly_totals(self, name=None, start: datetime.date = None, end: datetime.date = None) -> dict:
+        # Monday of the week: tomatoes
+        totals = defaultdict(int)
+        for date, total in self.daily_totals(name, start, end).items():
+            totals[date - datetime.timedelta(days=date.weekday())] += total
+        return dict(totals)
+
+    def user_totals(self, start: datetime.date = None, end: datetime.date = None) -> dict:
+        # name: tomatoes, for the users with tomatoes
+        totals = defaultdict(int)
+        for chunk, users, times, tomatoes in self._select(None, start, end):
+            if chunk is not None:
+                if chunk.user_totals is None:
+                    chunk.user_totals = _sum_by_key(users, tomatoes)
+                user_totals = chunk.user_totals
+            else:
+                user_totals = _sum_by_key(users, tomatoes)
+            for user, total in user_totals.items():
+                totals[user] += total
+        return {self._names[user]: total for user, total in totals.items()}
+
+    def rolling_totals(
+        self, window_days: int = 7, name=None, start: datetime.date = None, end: datetime.date = None
+    ) -> list:
+        # (date, tomatoes of the window_days days up to it) for every day from start (or the first tomato) to end (or
+        # the last one). The days before start are counted in the first windows
+        first_day = None if start is None else _day_of_date(start) - window_days + 1
+        daily_totals = self.daily_totals(name, None if first_day is None else _date_of_day(first_day), end)
+        if not daily_totals:
+            return []
+        days = [_day_of_date(date) for date in daily_totals]
+        totals = dict(zip(days, daily_totals.values()))
+        first_day = days[0] if start is None else _day_of_date(start)
+        last_day = days[-1] if end is None else _day_of_date(end)
+
+        output = []
+        window_total = sum(totals.get(day, 0) for day in range(first_day - window_days + 1, first_day))
+        for day in range(first_day, last_day + 1):
+            window_total += totals.get(day, 0) - totals.get(day - window_days, 0)
+            output.append((_date_of_day(day), window_total))
+        return output
+
+    def streaks(self, name, today: datetime.date = None) -> tuple:
+        # (current, longest) number of days in a row with tomatoes, the current one still counts if the last tomato
+        # was yesterday
+        days = sorted(_day_of_date(date) for date in self.daily_totals(name))
+        return _streaks_of_days(days, self._today(today))
+
+    def longest_streaks(self, top_n: int = 10, today: datetime.date = None) -> list:
+        # (name, longest, current) of the top_n users with the longest streaks
+        days_of_user = defaultdict(set)
+        for _, users, times, _ in self._select(None, None, None):
+            days = map(int.__floordiv__, map(int.__add__, times, repeat(self.utc_offset)), repeat(_SECONDS_PER_DAY))
+            for user, day in zip(users, days):
+                days_of_user[user].add(day)
+
+        today = self._today(today)
+        streaks = []
+        for user, days in days_of_user.items():
+            current, longest = _streaks_of_days(sorted(days), today)
+            streaks.append((self._names[user], longest, current))
+        streaks.sort(key=lambda streak: (-streak[1], -streak[2], streak[0]))
+        return streaks[:top_n]
+
+    def trend(self, name=None, days: int = 28, today: datetime.date = None) -> float:
+        # Slope (least squares) of the daily tomatoes over the last days, in tomatoes per day per day
+        last_day = self._today(today)
+        first_day = last_day - days + 1
+        totals = self.daily_totals(name, _date_of_day(first_day), _date_of_day(last_day))
+        values = [0] * days
+        for date, total in totals.items():
+            values[_day_of_date(date) - first_day] = total
+        mean_x = (days - 1) / 2
+        mean_y = sum(values) / days
+        variance = sum((x - mean_x) ** 2 for x in range(days))
+        if variance == 0:
+            return 0.0
+        return sum((x - mean_x) * (y - mean_y) for x, y in enumerate(values)) / variance
+
+    def close(self):
+        self.flush()
+
+    def _load_index(self):
+        # Called with the lock held
+        if self._chunks is not None:
+            return
+        self._names = []
+        names_path = os.path.join(self.path, "names.txt")
+        if os.path.exists(names_path):
+            with open(names_path, "r", encoding="utf-8") as file:
+                self._names = [line.rstrip("\n") for line in file]
+        self._index_of_name = {name: index for index, name in enumerate(self._names)}
+        self._number_of_written_names = len(self._names)
+
+        files = sorted(file for file in os.listdir(self.path) if file.startswith("chunk_") and file.endswith(".bin"))
+        self._chunks = [_Chunk.open(os.path.join(self.path, file)) for file in files]
+        # The session may have started before they were read
+        if self._chunks:
+            self._session_time = max(self._session_time, self._chunks[-1].last_time)
+
+    def _index_of(self, name) -> int:
+        index = self._index_of_name.get(name)
+        if index is None:
+            index = len(self._names)
+            self._names.append(name)
+            self._index_of_name[name] = index
+        return index
+
+    def _write_names(self):
+        # Before the rows using them
+        if self._number_of_written_names == len(self._names):
+            return
+        with open(os.path.join(self.path, "names.txt"), "a", encoding="utf-8") as file:
+            file.write("".join(f"{name}\n" for name in self._names[self._number_of_written_names :]))
+        self._number_of_written_names = len(self._names)
+
+    def _next_session_time(self) -> int:
+        # Never before the rows already written, the timestamps of the chunks stay sorted
+        session_time = int(self._clock())
+        if self._chunks:
+            session_time = max(session_time, self._chunks[-1].last_time)
+        return session_time
+
+    def _today(self, today: Union[datetime.date, None]) -> int:
+        if today is not None:
+            return _day_of_date(today)
+        return (int(self._clock()) + self.utc_offset) // _SECONDS_PER_DAY
+
+    def _select(self, name, start: Union[datetime.date, None], end: Union[datetime.date, None]) -> list:
+        # (chunk, users, times, tomatoes) of the rows in the range and of the user. chunk is only given if the columns
+        # are its whole full chunk, whose aggregates can then be cached
+        start_time = None if start is None else _day_of_date(start) * _SECONDS_PER_DAY - self.utc_offset
+        end_time = None if end is None else (_day_of_date(end) + 1) * _SECONDS_PER_DAY - self.utc_offset
+
+        with self._lock:
+            self._load_index()
+            user = None
+            if name is not None:
+                user = self._index_of_name.get(name)
+                if user is None:
+                    return []
+            chunks = list(self._chunks)
+            selected = []
+            for chunk in chunks:
+                if chunk.number_of_rows == 0:
+                    continue
+                if start_time is not None and chunk.last_time < start_time:
+                    continue
+                if end_time is not None and chunk.first_time >= end_time:
+                    continue
+                users, times, tomatoes = chunk.load()
+                if not chunk.is_full:
+                    # The last chunk grows with the flushes, its rows are copied while holding the lock
+                    users, times, tomatoes = users[:], times[:], tomatoes[:]
+                selected.append((chunk if chunk.is_full else None, users, times, tomatoes))
+
+        output = []
+        for chunk, users, times, tomatoes in selected:
+            low = 0 if start_time is None else bisect.bisect_left(times, start_time)
+            high = len(times) if end_time is None else bisect.bisect_left(times, end_time)
+            if low > 0 or high < len(times):
+                chunk = None
+                users, times, tomatoes = users[low:high], times[low:high], tomatoes[low:high]
+            if user is not None:
+                chunk = None
+                mask = list(map(eq, users, repeat(user)))
+                users = array("I", compress(users, mask))
+                times = array("q", compress(times, mask))
+                tomatoes = array("H", compress(tomatoes, mask))
+            if times:
+                output.append((chunk, users, times, tomatoes))
+        return output
+
+    def _sum_by_day(self, times: array, tomatoes: array) -> dict:
+        # The timestamps are sorted, each day is a slice found by bisect
+        totals = {}
+        low = 0
+        while low < len(times):
+            day = (times[low] + self.utc_offset) // _SECONDS_PER_DAY
+            high = bisect.bisect_left(times, (day + 1) * _SECONDS_PER_DAY - self.utc_offset, low)
+            totals[day] = sum(tomatoes[low:high])
+            low = high
+        return totals
+
+
+def _sum_by_key(keys: array, values: array) -> dict:
+    totals = defaultdict(int)
+    for key, value in zip(keys, values):
+        totals[key] += value
+    return totals
+
+
+def _streaks_of_days(days: list, today: int) -> tuple:
+    # days sorted, (current, longest) runs of consecutive days
+    longest = 0
+    run = 0
+    previous = None
+    for day in days:
+        run = run + 1 if previous == day - 1 else 1
+        longest = max(longest, run)
+        previous = day
+    current = run if previous is not None and previous >= today - 1 else 0
+    return current, longest
+
+
+def _day_of_date(date: datetime.date) -> int:
+    return (date - _EPOCH).days
+
+
+def _date_of_day(day: int) -> datetime.date:
+    return _EPOCH + datetime.timedelta(days=day)
@@ -0,0 +1,134 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from pomodorotteux.binary_snapshot import BinarySnapshot, LazySnapshotUsers
+from pomodorotteux.pomodoro_user import PomodoroUser
+
+
+_TOTALS = {"pariterre": 12, "alice": 3, "bob": 12, "éloïse": 7, "zoé": 0, "Émile": 3}
+
+
+class BinarySnapshotTests(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._directory)
+        self._path = os.path.join(self._directory, "database.pomosnap")
+
+    def _open(self) -> BinarySnapshot:
+        snapshot = BinarySnapshot(self._path)
+        self.addCleanup(snapshot.close)
+        return snapshot
+
+    def test_round_trip(self):
+        BinarySnapshot.write(self._path, _TOTALS)
+        snapshot = self._open()
+        self.assertEqual(snapshot.number_of_users, len(_TOTALS))
+        totals = {snapshot.name(index): snapshot.total(index) for index in range(snapshot.number_of_users)}
+        self.assertEqual(totals, _TOTALS)
+        self.assertEqual(sorted(snapshot.names()), sorted(_TOTALS))
+
+    def test_find(self):
+        BinarySnapshot.write(self._path, _TOTALS)
+        snapshot = self._open()
+        for name, total in _TOTALS.items():
+            index = snapshot.find(name)
+            self.assertGreaterEqual(index, 0)
+            self.assertEqual(snapshot.name(index), name)
+            self.assertEqual(snapshot.total(index), total)
+        for name in ("", "a", "zz", "pari", "pariterre2", "eloise"):
+            self.assertEqual(snapshot.find(name), -1)
+
+    def test_ranking(self):
+        BinarySnapshot.write(self._path, _TOTALS)
+        snapshot = self._open()
+        ranking = [(snapshot.name(index), snapshot.total(index)) for index in snapshot.ranking()]
+        self.assertEqual(ranking, sorted(_TOTALS.items(), key=lambda item: (-item[1], item[0])))
+
+    def test_empty(self):
+        BinarySnapshot.write(self._path, {})
+        snapshot = self._open()
+        self.assertEqual(snapshot.number_of_users, 0)
+        self.assertEqual(snapshot.find("alice"), -1)
+        self.assertEqual(list(snapshot.ranking()), [])
+
+    def test_missing_file(self):
+        snapshot = self._open()
+        self.assertEqual(snapshot.number_of_users, 0)
+        self.assertEqual(snapshot.find("alice"), -1)
+
+    def test_not_a_snapshot(self):
+        with open(self._path, "wb") as file:
+            file.write(b"\0" * 64)
+        with self.assertRaises(ValueError):
+            BinarySnapshot(self._path)
+
+    def test_replaced_after_close(self):
+        BinarySnapshot.write(self._path, {"alice": 1})
+        snapshot = BinarySnapshot(self._path)
+        snapshot.close()
+        BinarySnapshot.write(self._path, {"alice": 2})
+        self.assertEqual(self._open().total(0), 2)
+
+
+class LazySnapshotUsersTests(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._directory)
+        self._path = os.path.join(self._directory, "database.pomosnap")
+        BinarySnapshot.write(self._path, _TOTALS)
+
+    def _open(self) -> LazySnapshotUsers:
+        users = LazySnapshotUsers(BinarySnapshot(self._path), PomodoroUser)
+        self.addCleanup(users.close)
+        return users
+
+    def _totals(self, users: LazySnapshotUsers) -> dict:
+        return {name: users[name].total_number_of_tomatoes for name in users}
+
+    def test_lazy_loading(self):
+        loaded = []
+        users = LazySnapshotUsers(BinarySnapshot(self._path), PomodoroUser, lambda name, user: loaded.append(name))
+        self.addCleanup(users.close)
+        self.assertEqual(len(users), len(_TOTALS))
+        self.assertEqual(users.loaded_users, {})
+        self.assertIn("alice", users)
+        self.assertNotIn("carol", users)
+        self.assertEqual(users["alice"].total_number_of_tomatoes, 3)
+        self.assertEqual(loaded, ["alice"])
+        self.assertEqual(self._totals(users), _TOTALS)
+
+    def test_save_in_the_overlay(self):
+        users = self._open()
+        users["alice"].number_of_tomato_done += 1
+        users["carol"] = PomodoroUser(_pseudo="carol", _initial_number_of_tomatoes=1)
+        # Only the changed users are written
+        self.assertEqual(users.save(), users.overlay_path)
+        overlay = BinarySnapshot(users.overlay_path)
+        self.addCleanup(overlay.close)
+        self.assertEqual(sorted(overlay.names()), ["alice", "carol"])
+        users.close()
+
+        users = self._open()
+        self.assertEqual(len(users), len(_TOTALS) + 1)
+        self.assertEqual(self._totals(users), {**_TOTALS, "alice": 4, "carol": 1})
+
+    def test_snapshot_rewritten_when_the_overlay_is_too_big(self):
+        users = self._open()
+        users["alice"].number_of_tomato_done += 1
+        users["bob"].number_of_tomato_done += 1
+        with mock.patch("pomodorotteux.binary_snapshot._OVERLAY_REWRITE_MINIMUM", 1):
+            self.assertEqual(users.save(), self._path)
+        self.assertFalse(os.path.exists(users.overlay_path))
+        self.assertEqual(self._totals(users), {**_TOTALS, "alice": 4, "bob": 13})
+        users.close()
+
+        users = self._open()
+        self.assertEqual(users.loaded_users, {})
+        self.assertEqual(self._totals(users), {**_TOTALS, "alice": 4, "bob": 13})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from pomodorotteux.database_journal import DatabaseJournal
+
+
+def _apply_record(users: dict, record: dict):
+    if "tomato" in record:
+        for name in record["tomato"]:
+            users[name] = users.get(name, 0) + 1
+    elif "clear" in record:
+        users.clear()
+
+
+class DatabaseJournalTests(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._directory)
+        self._path = os.path.join(self._directory, "database.pomo")
+        self._journals = []
+
+    def _open(self, compaction_threshold: int = 1000) -> tuple:
+        journal = DatabaseJournal(self._path, _apply_record, compaction_threshold)
+        self._journals.append(journal)
+        self.addCleanup(journal.close)
+        return journal, journal.replay()
+
+    def _reopen(self) -> dict:
+        for journal in self._journals:
+            journal.close()
+        return self._open()[1]
+
+    def test_replay(self):
+        journal, users = self._open()
+        self.assertEqual(users, {})
+        journal.record_tomatoes(["a", "b"])
+        journal.record_tomatoes(["a"])
+        self.assertEqual(self._reopen(), {"a": 2, "b": 1})
+
+    def test_checkpoint(self):
+        journal, _ = self._open()
+        journal.record_tomatoes(["a"])
+        journal.checkpoint({"a": 1})
+        journal.record_tomatoes(["a"])
+        self.assertEqual(self._reopen(), {"a": 2})
+
+    def test_compaction(self):
+        journal, _ = self._open(compaction_threshold=3)
+        for _ in range(10):
+            journal.record_tomatoes(["a"])
+        journal.wait_for_compaction()
+        self.assertEqual(self._reopen(), {"a": 10})
+
+    def test_crash_before_folding_the_rotated_segment(self):
+        journal, _ = self._open()
+        journal.record_tomatoes(["a"])
+        with mock.patch.object(DatabaseJournal, "_compact_rotated_segment"):
+            journal.compact()
+            journal.wait_for_compaction()
+        journal.record_tomatoes(["a", "b"])
+        journal.flush()
+        self.assertTrue(os.path.exists(self._path + ".journal.compacting"))
+
+        # Without closing the first one, as after a crash
+        journal, users = self._open()
+        self.assertEqual(users, {"a": 2, "b": 1})
+        # The interrupted compaction is finished before rotating again
+        journal.compact()
+        journal.wait_for_compaction()
+        self.assertFalse(os.path.exists(self._path + ".journal.compacting"))
+        self.assertEqual(self._reopen(), {"a": 2, "b": 1})
+
+    def test_crash_after_folding_the_rotated_segment(self):
+        journal, _ = self._open()
+        journal.record_tomatoes(["a"])
+        # The snapshot is written but the segment it contains is not removed
+        with mock.patch("pomodorotteux.database_journal.os.remove"):
+            journal.compact()
+            journal.wait_for_compaction()
+        journal.record_tomatoes(["b"])
+        self.assertTrue(os.path.exists(self._path + ".journal.compacting"))
+
+        # Its tomatoes are not counted twice
+        self.assertEqual(self._reopen(), {"a": 1, "b": 1})
+
+    def test_segment_already_in_the_snapshot_is_skipped(self):
+        journal, _ = self._open()
+        journal.record_tomatoes(["a"])
+        journal.flush()
+        with open(self._path + ".journal", "rb") as file:
+            folded_segment = file.read()
+        journal.checkpoint({"a": 1})
+        journal.close()
+        # A crash between the snapshot and the new journal
+        with open(self._path + ".journal", "wb") as file:
+            file.write(folded_segment)
+
+        journal, users = self._open()
+        self.assertEqual(users, {"a": 1})
+        # The records after it start a newer generation, which is not skipped
+        journal.record_tomatoes(["a"])
+        self.assertEqual(self._reopen(), {"a": 2})
+
+    def test_segment_before_the_generations(self):
+        # Written before the segments were numbered
+        with open(self._path + ".journal", "w", encoding="utf-8") as file:
+            file.write('{"tomato":["a"]}\n')
+        journal, users = self._open()
+        self.assertEqual(users, {"a": 1})
+        journal.record_tomatoes(["a"])
+        self.assertEqual(self._reopen(), {"a": 2})
+
+    def test_torn_last_record(self):
+        journal, _ = self._open()
+        journal.record_tomatoes(["a"])
+        journal.close()
+        with open(self._path + ".journal", "a", encoding="utf-8") as file:
+            file.write('{"tomato":["a"')
+        self.assertEqual(self._open()[1], {"a": 1})
+
+    def test_clear(self):
+        journal, _ = self._open()
+        journal.record_tomatoes(["a"])
+        journal.record_clear()
+        journal.record_tomatoes(["b"])
+        self.assertEqual(self._reopen(), {"b": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+
+from pomodorotteux.irc_message import parse_irc_message
+
+
+class ParseIrcMessageTests(unittest.TestCase):
+    def test_privmsg_with_tags(self):
+        message = parse_irc_message(
+            "@badge-info=;display-name=Pari;user-id=1234 :pari!pari@pari.tmi.twitch.tv PRIVMSG #channel :Bonjour"
+        )
+        self.assertEqual(message.tags, {"badge-info": "", "display-name": "Pari", "user-id": "1234"})
+        self.assertEqual(message.prefix, "pari!pari@pari.tmi.twitch.tv")
+        self.assertEqual(message.nickname, "pari")
+        self.assertEqual(message.command, "PRIVMSG")
+        self.assertEqual(message.params, ["#channel"])
+        self.assertEqual(message.channel, "channel")
+        self.assertEqual(message.trailing, "Bonjour")
+
+    def test_escaped_tag_values(self):
+        message = parse_irc_message(r"@a=b\sc;d=e\:f;g=h\\i;j=\r\n;k=l\x;m=n\ :x PRIVMSG #c :t")
+        self.assertEqual(message.tags, {"a": "b c", "d": "e;f", "g": "h\\i", "j": "\r\n", "k": "lx", "m": "n"})
+
+    def test_tag_without_value(self):
+        message = parse_irc_message("@flag;key=value :x PRIVMSG #c :t")
+        self.assertEqual(message.tags, {"flag": "", "key": "value"})
+
+    def test_no_tags(self):
+        message = parse_irc_message(":x!x@x JOIN #channel")
+        self.assertIsNone(message.tags)
+        self.assertEqual(message.command, "JOIN")
+        self.assertEqual(message.params, ["#channel"])
+        self.assertIsNone(message.trailing)
+
+    def test_no_prefix(self):
+        message = parse_irc_message("PING :tmi.twitch.tv")
+        self.assertIsNone(message.prefix)
+        self.assertIsNone(message.nickname)
+        self.assertEqual(message.command, "PING")
+        self.assertEqual(message.params, [])
+        self.assertEqual(message.trailing, "tmi.twitch.tv")
+
+    def test_tags_without_prefix(self):
+        message = parse_irc_message("@key=value PING :tmi.twitch.tv")
+        self.assertEqual(message.tags, {"key": "value"})
+        self.assertIsNone(message.prefix)
+        self.assertEqual(message.command, "PING")
+
+    def test_trailing_containing_space_colon(self):
+        message = parse_irc_message(":x!x@x PRIVMSG #channel :Salut :) ça va : oui")
+        self.assertEqual(message.params, ["#channel"])
+        self.assertEqual(message.trailing, "Salut :) ça va : oui")
+
+    def test_empty_trailing(self):
+        message = parse_irc_message(":x!x@x PRIVMSG #channel :")
+        self.assertEqual(message.trailing, "")
+
+    def test_names_reply(self):
+        message = parse_irc_message(":bot.tmi.twitch.tv 353 bot = #channel :alice bob carol")
+        self.assertEqual(message.nickname, "bot.tmi.twitch.tv")
+        self.assertEqual(message.command, "353")
+        self.assertEqual(message.params, ["bot", "=", "#channel"])
+        self.assertEqual(message.trailing.split(), ["alice", "bob", "carol"])
+
+    def test_command_is_upper_case(self):
+        self.assertEqual(parse_irc_message("ping :x").command, "PING")
+
+    def test_extra_spaces(self):
+        message = parse_irc_message("@key=value   :x!x@x   PRIVMSG   #channel   :texte")
+        self.assertEqual(message.prefix, "x!x@x")
+        self.assertEqual(message.params, ["#channel"])
+        self.assertEqual(message.trailing, "texte")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import calendar
+import datetime
+import shutil
+import tempfile
+import unittest
+
+from pomodorotteux.tomato_history import TomatoHistory
+
+
+# UTC-5, the local days end at 05:00 UTC
+_UTC_OFFSET = -5 * 3600
+
+
+def _timestamp(date: datetime.date, hour: int, minute: int = 0, second: int = 0) -> int:
+    # Of a local time
+    return calendar.timegm((date.year, date.month, date.day, hour, minute, second)) - _UTC_OFFSET
+
+
+class TomatoHistoryTests(unittest.TestCase):
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._directory)
+        self._now = _timestamp(datetime.date(2024, 3, 4), 8)
+        self._history = self._open()
+
+    def _open(self) -> TomatoHistory:
+        return TomatoHistory(self._directory, _UTC_OFFSET, clock=lambda: self._now)
+
+    def _session(self, date: datetime.date, hour: int, minute: int = 0, second: int = 0, names=("alice",)):
+        self._now = _timestamp(date, hour, minute, second)
+        self._history.start_session()
+        self._history.record_tomatoes(names)
+        self._history.flush()
+
+    def test_day_boundaries(self):
+        monday, tuesday = datetime.date(2024, 3, 4), datetime.date(2024, 3, 5)
+        self._session(monday, 23, 59, 59)
+        self._session(tuesday, 0, 0, 0, names=("alice", "bob"))
+        self.assertEqual(self._history.daily_totals(), {monday: 1, tuesday: 2})
+        self.assertEqual(self._history.daily_totals("bob"), {tuesday: 1})
+        # The days of the range are included
+        self.assertEqual(self._history.daily_totals(start=tuesday), {tuesday: 2})
+        self.assertEqual(self._history.daily_totals(end=monday), {monday: 1})
+        self.assertEqual(self._history.daily_totals(start=monday, end=monday), {monday: 1})
+
+    def test_days_are_local(self):
+        monday = datetime.date(2024, 3, 4)
+        # 03:00 UTC on Tuesday
+        self._session(monday, 22)
+        self.assertEqual(self._history.daily_totals(), {monday: 1})
+        utc_history = TomatoHistory(self._directory, 0)
+        self.assertEqual(utc_history.daily_totals(), {datetime.date(2024, 3, 5): 1})
+
+    def test_session_counted_on_the_day_it_started(self):
+        monday = datetime.date(2024, 3, 4)
+        self._session(monday, 23, 50)
+        self._now = _timestamp(datetime.date(2024, 3, 5), 0, 10)
+        self._history.record_tomatoes(["alice"])
+        self._history.flush()
+        self.assertEqual(self._history.daily_totals(), {monday: 2})
+
+    def test_weekly_and_user_totals(self):
+        sunday, monday = datetime.date(2024, 3, 10), datetime.date(2024, 3, 11)
+        self._session(sunday, 23, 59, 59, names=("alice", "bob"))
+        self._session(monday, 0, 0, 0)
+        self.assertEqual(self._history.weekly_totals(), {datetime.date(2024, 3, 4): 2, datetime.date(2024, 3, 11): 1})
+        self.assertEqual(self._history.user_totals(), {"alice": 2, "bob": 1})
+        self.assertEqual(self._history.user_totals(start=monday), {"alice": 1})
+
+    def test_streaks(self):
+        first_day = datetime.date(2024, 2, 27)
+        for day in (0, 1, 2, 4, 5):
+            self._session(first_day + datetime.timedelta(days=day), 23, 59)
+        last_day = first_day + datetime.timedelta(days=5)
+        self.assertEqual(self._history.streaks("alice", last_day), (2, 3))
+        # Still current the next day, until a tomato is missed
+        self.assertEqual(self._history.streaks("alice", last_day + datetime.timedelta(days=1)), (2, 3))
+        self.assertEqual(self._history.streaks("alice", last_day + datetime.timedelta(days=2)), (0, 3))
+        self.assertEqual(self._history.streaks("nobody", last_day), (0, 0))
+
+    def test_streaks_across_midnight(self):
+        # Two sessions a minute apart on two local days
+        self._session(datetime.date(2024, 3, 4), 23, 59, 30)
+        self._session(datetime.date(2024, 3, 5), 0, 0, 30)
+        self.assertEqual(self._history.streaks("alice", datetime.date(2024, 3, 5)), (2, 2))
+
+    def test_longest_streaks(self):
+        monday = datetime.date(2024, 3, 4)
+        for day in range(3):
+            self._session(monday + datetime.timedelta(days=day), 20, names=("alice", "bob") if day else ("alice",))
+        self._session(monday + datetime.timedelta(days=5), 20, names=("carol",))
+        self.assertEqual(
+            self._history.longest_streaks(today=monday + datetime.timedelta(days=5)),
+            [("alice", 3, 0), ("bob", 2, 0), ("carol", 1, 1)],
+        )
+
+    def test_reopened(self):
+        monday = datetime.date(2024, 3, 4)
+        self._session(monday, 12, names=("alice", "bob"))
+        self._history.close()
+        history = self._open()
+        self.assertEqual(history.names, ["alice", "bob"])
+        self.assertEqual(history.daily_totals(), {monday: 2})
+
+    def test_clear(self):
+        self._session(datetime.date(2024, 3, 4), 12)
+        self._history.clear()
+        self.assertEqual(self._history.daily_totals(), {})
+        self.assertEqual(self._open().number_of_rows, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+# Queries the tomato history kept next to a Pomodoro database, e.g.
+# python tomato_history.py my_database.pomo daily --user pariterre --since 2024-01-01
+import argparse
+import datetime
+import os
+
+from pomodorotteux.tomato_history import TomatoHistory
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Queries the tomato history kept next to a Pomodoro database")
+    parser.add_argument("database_path", help="database_path of the configuration (or the .history directory)")
+    parser.add_argument("query", choices=("daily", "weekly", "users", "rolling", "streaks", "trend"))
+    parser.add_argument("--user", help="Only the tomatoes of this user (as the users are keyed)")
+    parser.add_argument("--since", type=datetime.date.fromisoformat, help="First day, YYYY-MM-DD")
+    parser.add_argument("--until", type=datetime.date.fromisoformat, help="Last day, YYYY-MM-DD")
+    parser.add_argument("--window", type=int, default=7, help="Days of the rolling windows or of the trend")
+    parser.add_argument("--top", type=int, default=20, help="Number of users shown")
+    args = parser.parse_args()
+
+    path = args.database_path
+    if not path.endswith(".history"):
+        path = TomatoHistory.path_from_database_path(path)
+    if not os.path.isdir(path):
+        parser.error(f"No tomato history in {path}")
+    history = TomatoHistory(path)
+
+    if args.query == "daily":
+        for date, total in history.daily_totals(args.user, args.since, args.until).items():
+            print(f"{date}  {total}")
+    elif args.query == "weekly":
+        for date, total in history.weekly_totals(args.user, args.since, args.until).items():
+            print(f"{date}  {total}")
+    elif args.query == "users":
+        totals = sorted(history.user_totals(args.since, args.until).items(), key=lambda item: (-item[1], item[0]))
+        for name, total in totals[: args.top]:
+            print(f"{name}  {total}")
+    elif args.query == "rolling":
+        for date, total in history.rolling_totals(args.window, args.user, args.since, args.until):
+            print(f"{date}  {total}")
+    elif args.query == "streaks":
+        if args.user is not None:
+            current, longest = history.streaks(args.user)
+            print(f"{args.user}  current {current}  longest {longest}")
+        else:
+            for name, longest, current in history.longest_streaks(args.top):
+                print(f"{name}  longest {longest}  current {current}")
+    elif args.query == "trend":
+        print(f"{history.trend(args.user, args.window):+.3f} tomatoes/day per day")
+
+
+if __name__ == "__main__":
+    main()